@@ -1,10 +1,35 @@
 
+from .interned import Interned
+from .scheduler import Scheduler
 from .duration import Duration
+from .fictrac_frame import FicTracFrame
+from .fictrac_framer import FicTracFramer
+from .fictrac_reader import FicTracReader, FicTracSubscription
+from .fictrac_archive import FicTracArchive
+from .alpha_beta_filter import AlphaBetaFilter
 from .closed_loop_condition import  ClosedLoopCondition
 from .open_loop_condition import OpenLoopCondition
 from .spatial_temporal import SpatialTemporal
 from .sweep_condition import SweepCondition
 from .csv_formatter import CsvFormatter
+from .batched_file_handler import BatchedFileHandler
+from .binary_formatter import BinaryFormatter
+from .binary_file_handler import BinaryFileHandler
+from .segmented_file_handler import SegmentedFileHandler
+from .binary_log_reader import BinaryLogReader
+from .log_policy import LogPolicy
+from .clock_model import ClockModel, align_rows
+from .clock_estimator import ClockEstimator
+from .session_socket import SessionSocket
+from .latency_monitor import LatencyMonitor
+from .session import Session
 from .trial import Trial
+from .timeline import Timeline
+from .trial_sequence import TrialSequence, play_trials
+from .protocol import Protocol, ProtocolError
 
-__all__ = ['Duration', 'SpatialTemporal', 'OpenLoopCondition', 'SweepCondition', 'ClosedLoopCondition', 'Trial', 'CsvFormatter']
\ No newline at end of file
+__all__ = ['Duration', 'SpatialTemporal', 'OpenLoopCondition', 'SweepCondition', 'ClosedLoopCondition', 'Trial', 'CsvFormatter', 'BatchedFileHandler',
+    'BinaryFormatter', 'BinaryFileHandler', 'SegmentedFileHandler', 'BinaryLogReader', 'LogPolicy', 'SessionSocket',
+    'FicTracFrame', 'FicTracFramer', 'FicTracReader', 'FicTracSubscription', 'FicTracArchive', 'AlphaBetaFilter', 'LatencyMonitor', 'Scheduler', 'Timeline',
+    'ClockModel', 'ClockEstimator', 'align_rows', 'Protocol', 'ProtocolError',
+    'TrialSequence', 'play_trials', 'Interned', 'Session']
\ No newline at end of file
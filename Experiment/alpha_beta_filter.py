@@ -0,0 +1,55 @@
+"""Alpha-beta filter for smoothing and extrapolating an angle"""
+
+import math
+
+class AlphaBetaFilter():
+    """
+    Estimate an angle and its rate of change from noisy samples and extrapolate the angle into
+    the future. Angles are in radians and may wrap around at 2π; the estimate is unwrapped, so
+    it keeps increasing over several turns.
+    """
+
+    def __init__(self, alpha=0.85, beta=0.05) -> None:
+        """
+        Create a filter without estimate.
+
+        :param float alpha: weight of the residual for the angle, between 0 and 1. Higher
+            values follow the samples more closely.
+        :param float beta: weight of the residual for the rate, between 0 and 2. Higher values
+            react faster to changes of the rate.
+        :rtype: None
+        """
+        self.alpha = alpha
+        self.beta = beta
+        self.angle = None
+        self.rate = 0.0
+
+    def update(self, sample, dt) -> tuple:
+        """
+        Add a new sample.
+
+        :param float sample: measured angle in radians
+        :param float dt: time since the previous sample in seconds
+        :rtype: tuple
+        :returns: filtered angle in radians and rate in radians per second
+        """
+        if self.angle is None or dt <= 0:
+            if self.angle is None:
+                self.angle = sample
+            return self.angle, self.rate
+        predicted = self.angle + self.rate * dt
+        residual = (sample - predicted + math.pi) % (2 * math.pi) - math.pi
+        self.angle = predicted + self.alpha * residual
+        self.rate = self.rate + self.beta * residual / dt
+        return self.angle, self.rate
+
+    def predict(self, horizon) -> float:
+        """
+        Extrapolate the angle.
+
+        :param float horizon: time after the last sample in seconds
+        :rtype: float
+        """
+        if self.angle is None:
+            return 0.0
+        return self.angle + self.rate * horizon
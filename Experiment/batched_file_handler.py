@@ -0,0 +1,186 @@
+"""
+Queue-backed log handler that writes records to disk in batches.
+
+The default `logging.FileHandler` formats and flushes every single record inside the calling
+(green) thread. For the high frequency client logs this competes with the stimulus timing. This
+handler only appends the record to a bounded queue and leaves formatting and writing to a
+background thread.
+
+FlyFlix runs with `eventlet.monkey_patch()`, which turns `threading.Thread` into a greenlet on the
+same hub as the stimulus. Blocking file I/O in such a greenlet would still stall every other
+greenlet, so the writer uses the unpatched `threading` module and runs in a native OS thread.
+Without eventlet, for example in the writer process of the SharedMemoryHandler, this is the
+regular `threading` module.
+"""
+
+import logging
+import time
+
+from collections import deque
+
+try:
+    from eventlet.patcher import original
+    threading = original('threading')
+except ImportError:
+    import threading
+
+class BatchedFileHandler(logging.Handler):
+    """Subclass of logging.Handler that writes formatted records in batches"""
+
+    def __init__(
+        self, filename,
+        max_queue_size=100000, flush_interval=0.25, flush_size=500,
+        mode='a', encoding='utf-8') -> None:
+        """
+        Open the file and start the background writer.
+
+        :param str filename: path of the log file
+        :param int max_queue_size: maximum number of records waiting to be written. Records that
+            arrive while the queue is full are dropped and counted in `dropped_count`.
+        :param float flush_interval: maximum time in seconds a record waits in the queue
+        :param int flush_size: number of queued records that trigger an early write
+        :param str mode: file mode used to open the log file
+        :param str encoding: file encoding
+        :rtype: None
+        """
+        super().__init__()
+        self.filename = filename
+        self.mode = mode
+        self.encoding = encoding
+        self.max_queue_size = max_queue_size
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.dropped_count = 0
+        self.written_count = 0
+        self.stream = self._open()
+        self._queue = deque()
+        self._queue_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_requested = 0
+        self._flush_done = 0
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="BatchedFileHandler", daemon=True)
+        self._writer.start()
+
+    def _open(self):
+        """
+        Open the log file.
+
+        :rtype: file object
+        """
+        return open(self.filename, self.mode, encoding=self.encoding)
+
+    def emit(self, record) -> None:
+        """
+        Queue a record for writing. The server time is taken here and not when the record is
+        formatted, which can be a while later. Records that were timestamped before, for example
+        by the SharedMemoryHandler, keep their time.
+
+        :param logging.LogRecord record: record to be logged
+        :rtype: None
+        """
+        if getattr(record, 'time_ns', None) is None:
+            record.time_ns = time.time_ns()
+        with self._queue_lock:
+            if self._closed or len(self._queue) >= self.max_queue_size:
+                self.dropped_count += 1
+                return
+            self._queue.append(record)
+            queue_size = len(self._queue)
+        if queue_size >= self.flush_size:
+            self._wakeup.set()
+
+    def queue_size(self) -> int:
+        """
+        Number of records currently waiting to be written.
+
+        :rtype: int
+        """
+        return len(self._queue)
+
+    def _run(self) -> None:
+        """
+        Background writer: wait for the flush interval or until enough records are queued, then
+        write everything that is in the queue.
+        """
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            flush_requested = self._flush_requested
+            self._drain()
+            self._flush_done = flush_requested
+
+    def _drain(self) -> None:
+        """
+        Remove all queued records and write them in one go.
+        """
+        with self._write_lock:
+            with self._queue_lock:
+                records = list(self._queue)
+                self._queue.clear()
+            if not records or self.stream is None:
+                return
+            try:
+                self._write_batch(records)
+                self.written_count += len(records)
+            except Exception: # pylint: disable=broad-except
+                self.handleError(records[0])
+
+    def _write_batch(self, records) -> None:
+        """
+        Format the records and write them to the stream.
+
+        :param list records: list of logging.LogRecord
+        :rtype: None
+        """
+        self.stream.write("".join(f"{self.format(record)}\n" for record in records))
+        self.stream.flush()
+
+    def flush(self) -> None:
+        """
+        Write all queued records to disk before returning. The writer thread writes them, the
+        caller only polls with `time.sleep`, which yields to other greenlets under eventlet
+        instead of blocking the hub on a native lock.
+
+        :rtype: None
+        """
+        if threading.current_thread() is self._writer:
+            self._drain()
+            return
+        with self._queue_lock:
+            if self._closed:
+                return
+            self._flush_requested += 1
+            flush_request = self._flush_requested
+        self._wakeup.set()
+        while self._flush_done < flush_request and self._writer.is_alive():
+            time.sleep(0.001)
+
+    def close(self) -> None:
+        """
+        Stop the background writer, write the remaining records and close the file.
+
+        :rtype: None
+        """
+        with self._queue_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._wakeup.set()
+        if self._writer is not threading.current_thread():
+            self._writer.join()
+        self._drain()
+        with self._write_lock:
+            if self.stream is not None:
+                self._close_stream()
+                self.stream = None
+        super().close()
+
+    def _close_stream(self) -> None:
+        """
+        Close the log file.
+
+        :rtype: None
+        """
+        self.stream.close()
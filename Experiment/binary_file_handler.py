@@ -0,0 +1,79 @@
+"""Batched log handler for the binary log format"""
+
+import json
+
+from .batched_file_handler import BatchedFileHandler
+from .binary_formatter import BinaryFormatter, file_header
+
+class BinaryFileHandler(BatchedFileHandler):
+    """
+    Write records in the fixed-width binary format of the BinaryFormatter. Interned strings are
+    written to `<filename>.strings`.
+    """
+
+    def __init__(self, filename, **kwargs) -> None:
+        """
+        Open the binary log and the strings file.
+
+        :param str filename: path of the binary log file
+        :param kwargs: see BatchedFileHandler
+        :rtype: None
+        """
+        self.strings_stream = None
+        kwargs.setdefault('mode', 'ab')
+        kwargs.setdefault('encoding', None)
+        super().__init__(filename, **kwargs)
+        self.setFormatter(BinaryFormatter())
+
+    def _open(self):
+        """
+        Open the log file and the strings file, write the header to new log files.
+
+        :rtype: file object
+        """
+        stream = open(self.filename, self.mode)
+        if stream.tell() == 0:
+            stream.write(file_header())
+        self.strings_stream = open(f"{self.filename}.strings", self.mode.replace('b', ''),
+            encoding='utf-8')
+        return stream
+
+    def setFormatter(self, fmt) -> None:
+        """
+        Only the BinaryFormatter can be used with this handler. The formatter continues the
+        string table of the strings file, which is not empty if the log is appended to.
+
+        :param BinaryFormatter fmt: formatter
+        :rtype: None
+        """
+        if not isinstance(fmt, BinaryFormatter):
+            raise TypeError("BinaryFileHandler requires a BinaryFormatter")
+        with open(f"{self.filename}.strings", "r", encoding="utf-8") as stream:
+            fmt.load_strings(json.loads(line) for line in stream)
+        super().setFormatter(fmt)
+
+    def _write_batch(self, records) -> None:
+        """
+        Encode the records and write them, together with new strings, to disk.
+
+        :param list records: list of logging.LogRecord
+        :rtype: None
+        """
+        data = b"".join(self.format(record) for record in records)
+        new_strings = self.formatter.pop_strings()
+        if new_strings:
+            self.strings_stream.write("".join(f"{json.dumps(s)}\n" for s in new_strings))
+            self.strings_stream.flush()
+        self.stream.write(data)
+        self.stream.flush()
+
+    def close(self) -> None:
+        """
+        Close the log file and the strings file.
+
+        :rtype: None
+        """
+        super().close()
+        if self.strings_stream is not None:
+            self.strings_stream.close()
+            self.strings_stream = None
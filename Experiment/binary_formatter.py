@@ -0,0 +1,174 @@
+"""
+Log data into a compact binary file
+
+Each log row is stored as a fixed-width record of `RECORD_SIZE` bytes, which allows analysis code
+to memory-map the file, for example with numpy:
+
+    numpy.memmap(path, dtype=RECORD_DTYPE, mode='r', offset=RECORD_SIZE)
+
+Strings such as client ids, keys and text values are interned: the record stores the position
+of the string in a sidecar file (`<log>.strings`) that contains one JSON encoded string per line.
+"""
+
+import logging
+import struct
+import time
+
+# type tags of the values stored in a record
+TYPE_NONE = 0
+TYPE_INT = 1
+TYPE_FLOAT = 2
+TYPE_STR = 3
+TYPE_BOOL = 4
+
+MAX_FIELDS = 5
+MAGIC = b"FLYFLIX-BINLOG-1"
+
+# server timestamp, number of fields, one type tag per field, padding, one 8 byte slot per field
+RECORD_HEAD = struct.Struct(f"<qB{MAX_FIELDS}B2x")
+RECORD_SIZE = RECORD_HEAD.size + 8 * MAX_FIELDS
+
+# numpy compatible description of a record, values with TYPE_FLOAT need `.view('<f8')`
+RECORD_DTYPE = [
+    ('server_ns', '<i8'), ('nfields', 'u1'), ('types', 'u1', (MAX_FIELDS,)), ('pad', 'V2'),
+    ('values', '<i8', (MAX_FIELDS,))]
+
+_SLOT_CODES = {TYPE_NONE: 'q', TYPE_INT: 'q', TYPE_FLOAT: 'd', TYPE_STR: 'q', TYPE_BOOL: 'q'}
+_INT64_MIN = -2**63
+_INT64_MAX = 2**63 - 1
+_STRUCTS = {}
+
+
+def record_struct(types) -> struct.Struct:
+    """
+    Get the struct for a record with the given type tags.
+
+    :param tuple types: type tag for each of the `MAX_FIELDS` slots
+    :rtype: struct.Struct
+    """
+    rstruct = _STRUCTS.get(types)
+    if rstruct is None:
+        rstruct = struct.Struct(RECORD_HEAD.format + "".join(_SLOT_CODES[t] for t in types))
+        _STRUCTS[types] = rstruct
+    return rstruct
+
+
+def file_header() -> bytes:
+    """
+    Header at the beginning of the binary log. It has the size of a record.
+
+    :rtype: bytes
+    """
+    return MAGIC.ljust(RECORD_SIZE, b"\x00")
+
+
+class BinaryFormatter(logging.Formatter):
+    """Subclass of logging.Formatter to encode records as fixed-width binary records"""
+
+    def __init__(self):
+        """Simple constructor"""
+        super().__init__()
+        self.strings = {}
+        self.string_count = 0
+        self.new_strings = []
+
+    def intern(self, text) -> int:
+        """
+        Get the id of a string, adding it to the string table if it is new.
+
+        :param str text: string to be interned
+        :rtype: int
+        """
+        sid = self.strings.get(text)
+        if sid is None:
+            sid = self.string_count
+            self.string_count += 1
+            self.strings[text] = sid
+            self.new_strings.append(text)
+        return sid
+
+    def load_strings(self, strings) -> None:
+        """
+        Continue the string table of an existing log, so that records appended to the log refer
+        to the strings that are already in its strings file.
+
+        :param iterable strings: strings in the order of the strings file
+        :rtype: None
+        """
+        for text in strings:
+            self.strings.setdefault(text, self.string_count)
+            self.string_count += 1
+
+    def pop_strings(self) -> list:
+        """
+        Return the strings that were interned since the last call. These need to be written to
+        the strings file before the records that use them.
+
+        :rtype: list
+        """
+        new_strings = self.new_strings
+        self.new_strings = []
+        return new_strings
+
+    def forget_strings(self, strings) -> None:
+        """
+        Remove the most recently interned strings from the string table again, for example
+        when the records that use them could not be written.
+
+        :param list strings: strings from the last call to `pop_strings`
+        :rtype: None
+        """
+        for text in strings:
+            del self.strings[text]
+        self.string_count -= len(strings)
+
+    def encode_value(self, value):
+        """
+        Convert a value to its type tag and slot content.
+
+        Values that are neither None, bool, int, nor float are stored as the string that the
+        CSV writer would have written for them.
+
+        :param value: value to be encoded
+        :rtype: tuple
+        """
+        if value is None:
+            return TYPE_NONE, 0
+        if isinstance(value, bool):
+            return TYPE_BOOL, int(value)
+        if isinstance(value, int) and _INT64_MIN <= value <= _INT64_MAX:
+            return TYPE_INT, value
+        if isinstance(value, float):
+            return TYPE_FLOAT, value
+        if not isinstance(value, str):
+            value = str(value)
+        return TYPE_STR, self.intern(value)
+
+    def format(self, record):
+        """
+        Convert the record to a binary record. Records logged with `extra={'batch': True}`
+        contain a list of rows in `msg`, they are converted to one binary record each.
+
+        :param logging.LogRecord record: record with a list of values in the `msg` key
+        :rtype: bytes
+        """
+        server_time = getattr(record, 'time_ns', None) or time.time_ns()
+        if getattr(record, 'batch', False):
+            return b"".join(self.format_row(server_time, row) for row in record.msg)
+        return self.format_row(server_time, record.msg)
+
+    def format_row(self, server_time, row) -> bytes:
+        """
+        Encode a list of up to `MAX_FIELDS` values.
+
+        :param int server_time: server timestamp in ns
+        :param list row: values of the row
+        :rtype: bytes
+        """
+        if len(row) > MAX_FIELDS:
+            raise ValueError(f"binary log records hold at most {MAX_FIELDS} values")
+        encoded = [self.encode_value(value) for value in row]
+        encoded += [(TYPE_NONE, 0)] * (MAX_FIELDS - len(encoded))
+        types = tuple(e[0] for e in encoded)
+        return record_struct(types).pack(
+            server_time, len(row), *types, *(e[1] for e in encoded))
@@ -0,0 +1,93 @@
+"""Read binary logs written by the BinaryFileHandler and convert them to CSV"""
+
+import json
+import struct
+
+from .binary_formatter import (
+    MAGIC, MAX_FIELDS, RECORD_HEAD, RECORD_SIZE,
+    TYPE_NONE, TYPE_INT, TYPE_FLOAT, TYPE_STR, TYPE_BOOL)
+from .csv_formatter import CsvFormatter
+
+_VALUES_INT = struct.Struct(f"<{MAX_FIELDS}q")
+_FLOAT = struct.Struct("<d")
+_INT = struct.Struct("<q")
+
+class BinaryLogReader():
+    """
+    Reader for the binary log format.
+    """
+
+    def __init__(self, filename, strings=None) -> None:
+        """
+        Load the string table of a binary log.
+
+        :param str filename: path of the binary log file
+        :param list strings: string table to use instead of the strings file of the log
+        :rtype: None
+        """
+        self.filename = filename
+        if strings is not None:
+            self.strings = strings
+            return
+        with open(f"{filename}.strings", "r", encoding="utf-8") as stream:
+            self.strings = [json.loads(line) for line in stream]
+
+    def decode_value(self, value_type, slot):
+        """
+        Convert a slot back to its value.
+
+        :param int value_type: type tag
+        :param int slot: content of the slot, interpreted as int64
+        """
+        if value_type == TYPE_INT:
+            return slot
+        if value_type == TYPE_FLOAT:
+            return _FLOAT.unpack(_INT.pack(slot))[0]
+        if value_type == TYPE_STR:
+            return self.strings[slot]
+        if value_type == TYPE_BOOL:
+            return bool(slot)
+        if value_type == TYPE_NONE:
+            return None
+        raise ValueError(f"unknown type {value_type} in {self.filename}")
+
+    def rows(self):
+        """
+        Iterate over all rows of the log. Each row starts with the server timestamp followed by
+        the logged values, the same as a row in the CSV log.
+
+        :rtype: generator
+        """
+        with open(self.filename, "rb") as stream:
+            if stream.read(RECORD_SIZE).rstrip(b"\x00") != MAGIC:
+                raise ValueError(f"{self.filename} is not a FlyFlix binary log")
+            while True:
+                data = stream.read(RECORD_SIZE)
+                if len(data) < RECORD_SIZE:
+                    break
+                yield self.decode_row(data)
+
+    def decode_row(self, data, offset=0) -> list:
+        """
+        Convert a binary record back to its row, starting with the server timestamp.
+
+        :param bytes data: buffer with the record
+        :param int offset: position of the record in the buffer
+        :rtype: list
+        """
+        head = RECORD_HEAD.unpack_from(data, offset)
+        server_time, nfields, types = head[0], head[1], head[2:]
+        slots = _VALUES_INT.unpack_from(data, offset + RECORD_HEAD.size)
+        return [server_time] + [self.decode_value(types[i], slots[i]) for i in range(nfields)]
+
+    def to_csv(self, csv_filename) -> None:
+        """
+        Write the log in the CSV format used by the CsvFormatter.
+
+        :param str csv_filename: path of the CSV file
+        :rtype: None
+        """
+        formatter = CsvFormatter()
+        with open(csv_filename, "w", encoding="utf-8") as stream:
+            for row in self.rows():
+                stream.write(f"{formatter.format_row(row)}\n")
@@ -0,0 +1,90 @@
+"""Estimation of offset and skew between server and client clock"""
+
+import math
+
+from collections import deque
+
+from .clock_model import ClockModel
+
+class ClockEstimator():
+    """
+    NTP-style estimation of the client clock from repeated `cping`/`cpong` exchanges.
+
+    For each exchange, the server notes when it sent the ping and when the pong arrived; the
+    client answers with its own time. Assuming symmetric delays, the client time corresponds to
+    the midpoint of the round trip, and half the round trip bounds the error of that sample.
+    Offset and skew are fitted by least squares over the recent exchanges with the shortest round
+    trips, which are the least affected by queuing delays.
+    """
+
+    def __init__(self, window=64, best_fraction=0.5) -> None:
+        """
+        Create an estimator without samples.
+
+        :param int window: number of recent exchanges considered
+        :param float best_fraction: fraction of the exchanges with the shortest round trip that
+            is used for the fit
+        :rtype: None
+        """
+        self.samples = deque(maxlen=window)
+        self.best_fraction = best_fraction
+        self.pending = {}
+        self.sequence = 0
+
+    def ping(self, server_ns) -> int:
+        """
+        Register an outgoing ping.
+
+        :param int server_ns: server time when the ping is sent
+        :rtype: int
+        :returns: sequence number that the client sends back with its pong
+        """
+        self.sequence += 1
+        self.pending[self.sequence] = server_ns
+        if len(self.pending) > 16:
+            del self.pending[min(self.pending)]
+        return self.sequence
+
+    def pong(self, sequence, client_ms, server_ns) -> bool:
+        """
+        Add the answer to a ping.
+
+        :param int sequence: sequence number from `ping`
+        :param float client_ms: client time when the ping was answered
+        :param int server_ns: server time when the pong arrived
+        :rtype: bool
+        :returns: False if the ping is unknown
+        """
+        sent_ns = self.pending.pop(sequence, None)
+        if sent_ns is None:
+            return False
+        round_trip = server_ns - sent_ns
+        offset = sent_ns + round_trip / 2 - client_ms * 1e6
+        self.samples.append((client_ms, offset, round_trip))
+        return True
+
+    def model(self) -> ClockModel:
+        """
+        Fit offset and skew to the best recent exchanges.
+
+        The error bound combines the residual scatter of the fit with half of the shortest round
+        trip, which limits how wrong the symmetric delay assumption can be.
+
+        :rtype: ClockModel or None if there are no exchanges yet
+        """
+        if not self.samples:
+            return None
+        count = max(1, int(len(self.samples) * self.best_fraction))
+        best = sorted(self.samples, key=lambda sample: sample[2])[:count]
+        ref_ms = max(sample[0] for sample in self.samples)
+        xs = [(sample[0] - ref_ms) * 1e6 for sample in best]
+        ys = [sample[1] for sample in best]
+        mean_x = sum(xs) / count
+        mean_y = sum(ys) / count
+        var_x = sum((x - mean_x) ** 2 for x in xs)
+        skew = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x if var_x else 0.0
+        offset = mean_y - skew * mean_x
+        residuals = [y - (offset + skew * x) for x, y in zip(xs, ys)]
+        scatter = math.sqrt(sum(r * r for r in residuals) / (count - 2)) if count > 2 else 0.0
+        error = scatter + min(sample[2] for sample in best) / 2
+        return ClockModel(offset, skew, ref_ms, error, len(self.samples))
@@ -0,0 +1,115 @@
+"""Linear model that maps client timestamps onto the server time base"""
+
+import json
+
+class ClockModel():
+    """
+    Relation between the client clock (`performance.now()` in ms) and the server clock
+    (`time.time_ns()`):
+
+        server_ns = client_ms * 1e6 + offset_ns + skew * (client_ms - ref_ms) * 1e6
+    """
+
+    def __init__(self, offset_ns=0, skew=0.0, ref_ms=0.0, error_ns=None, samples=0) -> None:
+        """
+        Create a model.
+
+        :param float offset_ns: offset between the clocks at `ref_ms` in ns
+        :param float skew: relative rate difference of the clocks, for example 1e-6 if the server
+            clock runs 1 µs per s faster than the client clock
+        :param float ref_ms: client time in ms the offset refers to
+        :param float error_ns: bound of the offset error in ns, None if unknown
+        :param int samples: number of exchanges the model is based on
+        :rtype: None
+        """
+        self.offset_ns = offset_ns
+        self.skew = skew
+        self.ref_ms = ref_ms
+        self.error_ns = error_ns
+        self.samples = samples
+
+    def offset_at(self, client_ms) -> float:
+        """
+        Offset between the clocks at a client time.
+
+        :param float client_ms: client timestamp in ms
+        :rtype: float
+        """
+        return self.offset_ns + self.skew * (client_ms - self.ref_ms) * 1e6
+
+    def to_server_ns(self, client_ms) -> int:
+        """
+        Convert a client timestamp, for example a logged `client_timestamp`, to server time.
+
+        :param float client_ms: client timestamp in ms
+        :rtype: int
+        """
+        return int(float(client_ms) * 1e6 + self.offset_at(float(client_ms)))
+
+    def to_client_ms(self, server_ns) -> float:
+        """
+        Convert a server timestamp to client time.
+
+        :param int server_ns: server timestamp in ns
+        :rtype: float
+        """
+        # solve server_ns = c*1e6 + offset_ns + skew*(c - ref_ms)*1e6 for c
+        return (server_ns - self.offset_ns + self.skew * self.ref_ms * 1e6) \
+            / (1e6 * (1 + self.skew))
+
+    def as_dict(self) -> dict:
+        """
+        Parameters of the model, for example to store them in the log.
+
+        :rtype: dict
+        """
+        return {
+            'offset_ns': self.offset_ns, 'skew': self.skew, 'ref_ms': self.ref_ms,
+            'error_ns': self.error_ns, 'samples': self.samples}
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Create a model from the parameters logged as `clock-model`.
+
+        :param dict values: see `as_dict`
+        :rtype: ClockModel
+        """
+        return cls(**values)
+
+
+def align_rows(rows) -> list:
+    """
+    Convert the client timestamps of logged rows to the server time base. Rows have the layout of
+    the repeater log: server time, client id, client timestamp, shared key, key, and value. The
+    `clock-model` rows that the server logs for each client are used for the conversion, each row
+    is converted with the most recent model of its client, or the first one if the row was
+    logged before.
+
+    :param list rows: rows of the repeater log
+    :rtype: list
+    :returns: the rows with the client timestamp in server time appended, None if the row has no
+        client timestamp or there is no model for its client
+    """
+    models = {}
+    for row in rows:
+        if len(row) >= 6 and row[4] == "clock-model":
+            models.setdefault(row[1], []).append((int(row[0]), ClockModel.from_dict(
+                json.loads(row[5]))))
+    aligned = []
+    for row in rows:
+        server_time = None
+        candidates = models.get(row[1]) if len(row) >= 6 else None
+        if candidates:
+            model = candidates[0][1]
+            for logged_ns, candidate in candidates:
+                if logged_ns > int(row[0]):
+                    break
+                model = candidate
+            try:
+                if float(row[2]) != 0:
+                    server_time = model.to_server_ns(row[2])
+            except ValueError:
+                pass
+        aligned.append(list(row) + [server_time])
+    return aligned
@@ -1,10 +1,13 @@
 """Closed loop condition, implementing direct feedback from FicTrac"""
 
+import json
+import math
 import warnings
 import time
-import socket
 
 from . import Duration
+from .alpha_beta_filter import AlphaBetaFilter
+from .fictrac_reader import FicTracReader
 
 class ClosedLoopCondition():
 
@@ -14,7 +17,9 @@ class ClosedLoopCondition():
         self,
         spatial_temporal=None, trial_duration=None,
         gain=1.0, fps=60,
-        pretrial_duration=Duration(500), posttrial_duration=Duration(500)) -> None:
+        pretrial_duration=Duration(500), posttrial_duration=Duration(500),
+        predict=False, alpha=0.85, beta=0.05, latency_ms=None,
+        mode="rate", offset_deg=None) -> None:
         """
         Initialize the closed loop condition.
 
@@ -26,6 +31,17 @@ class ClosedLoopCondition():
         :param Duration pretrial_duration: duration of the pre-trial period, when stimulus is
             shown but not animated.
         :param Duration posttrial_duration: duration of the post-trial period.
+        :param bool predict: compensate the latency by predicting the heading at the time the
+            client renders the next frame, see `loop_predictive`
+        :param float alpha: weight of new heading samples in the alpha-beta filter
+        :param float beta: weight of new heading samples for the rate in the alpha-beta filter
+        :param float latency_ms: latency to compensate in ms. If None, the latency measured for
+            the slowest client is used.
+        :param str mode: `rate` sends the rotation speed for each FicTrac frame (see `loop`),
+            `absolute` sends the panel angle at most once per client frame (see `loop_absolute`)
+        :param float offset_deg: panel angle in degree for a heading of 0 in `absolute` mode. If
+            None, the offset is chosen so that the pattern starts at the closed loop start
+            position.
         :rtype: None
         """
 
@@ -35,13 +51,27 @@ class ClosedLoopCondition():
             warnings.warn("Duration not set")
         if fps <=0 or fps > 60:
             warnings.warn(f"fps ({fps}) outside meaningful constraints")
+        if not 0 < alpha <= 1 or not 0 <= beta < 2:
+            warnings.warn(f"alpha ({alpha}) or beta ({beta}) make the filter unstable")
+        if mode not in ("rate", "absolute"):
+            warnings.warn(f"unknown closed loop mode {mode}, using rate")
+            mode = "rate"
+        if mode == "absolute" and predict:
+            warnings.warn("prediction is not available in absolute mode")
         self.spatial_temporal = spatial_temporal
         self.trial_duration = trial_duration
         self.gain = gain
         self.fps = fps
         self.pretrial_duration = pretrial_duration
         self.posttrial_duration = posttrial_duration
-        self.is_triggering = False
+        self.predict = predict
+        self.alpha = alpha
+        self.beta = beta
+        self.latency_ms = latency_ms
+        self.mode = mode
+        self.offset_deg = offset_deg
+        # sockets with a running loop, a condition can be shared by trials of several sessions
+        self.triggering = set()
 
     def trigger(self, socket_io) -> None:
         """
@@ -52,15 +82,21 @@ class ClosedLoopCondition():
         Specifically, it sends the required FPS and the setup of the screen by triggering the
         current SpatialTemporal object. This is followed by a delay specified in the
         `pretrial_duration`. Then a another thread attempts to connec to the local FicTrac  (see
-        `loop`) and does that for the length of `trial_duration`. At the end the pattern is
+        `loop`) and does that for the length of `trial_duration`. If the displays are synced, the
+        loop starts once the start position is shown, see `SessionSocket.wait_for_sync`. At the end the pattern is
         stopped and held at the current position for the duration of `posttrial_duration`.
 
         The log file contains a `closedloop-start` and a `closedloop-end` with the same timestamp
         (in nanoseconds) at the beginning and the end of the trial.
 
+        A closed loop condition depends on live FicTrac data and cannot be compiled into a
+        `Timeline`. In a `DryRun`, the trial period passes without heading updates.
+
         :param socket socket_io: The Socket.IO used for communicating with the client.
         :rtype: None
         """
+        if getattr(socket_io, "is_compiling", False):
+            raise ValueError("closed loop conditions cannot be compiled into a timeline")
         shared_key = time.time_ns()
         socket_io.emit("meta", (shared_key, "closedloop-start", 1))
         self.trigger_fps(socket_io)
@@ -68,15 +104,38 @@ class ClosedLoopCondition():
         self.spatial_temporal.trigger_stop(socket_io)
         self.spatial_temporal.trigger_closedloop_start_position(socket_io)
         self.pretrial_duration.trigger_delay(socket_io)
-        self.is_triggering = True
-        loopthread = socket_io.start_background_task(self.loop, socket_io)
-        self.trial_duration.trigger_delay(socket_io)
-        self.is_triggering = False
-        loopthread.join()
+        wait_for_sync = getattr(socket_io, "wait_for_sync", None)
+        if wait_for_sync is not None:
+            wait_for_sync()
+        self.triggering.add(socket_io)
+        if self.mode == "absolute":
+            loop = self.loop_absolute
+        elif self.predict:
+            loop = self.loop_predictive
+        else:
+            loop = self.loop
+        if getattr(socket_io, "is_virtual", False):
+            warnings.warn("closed loop condition without FicTrac data in a dry run")
+            self.trial_duration.trigger_delay(socket_io)
+            self.triggering.discard(socket_io)
+        else:
+            loopthread = socket_io.start_background_task(loop, socket_io)
+            self.trial_duration.trigger_delay(socket_io)
+            self.triggering.discard(socket_io)
+            loopthread.join()
         self.spatial_temporal.trigger_stop(socket_io)
         self.posttrial_duration.trigger_delay(socket_io)
         socket_io.emit("meta", (shared_key, "closedloop-end", 1))
 
+    def duration_ms(self) -> float:
+        """
+        Nominal duration of the condition, including pre-trial and post-trial.
+
+        :rtype: float
+        """
+        return self.pretrial_duration.time_duration + self.trial_duration.time_duration \
+            + self.posttrial_duration.time_duration
+
     def trigger_fps(self, socket_io) -> None:
         """
         Trigger sending the FPS via `socket_io`.
@@ -89,54 +148,195 @@ class ClosedLoopCondition():
 
     def loop(self, socket_io):
         """
-        Connect to the local FicTrac, extract the relevant rotational information and forward it
-        to the client via `socket_io`.
+        Receive frames from the shared FicTrac reader, extract the relevant rotational information
+        and forward it to the client via `socket_io`.
 
-        For the ClosedLoopCondition to work, Fictrac needs to run locally and has a socket
-        communication enabled on port 1717. To achieve this, change `sock_host` to `127.0.0.1`
-        and `sock_port` to `1717` in the FicTrac configuration.
+        The reader is taken from `socket_io.fictrac` if the socket provides one, otherwise the
+        default `FicTracReader` is used and started if necessary. See `FicTracReader` for the
+        FicTrac configuration.
 
-        This method reads the 17th column from the FicTrac data, which is the "integrated animal
+        This method uses the 17th column from the FicTrac data, which is the "integrated animal
         heading" and calculates the rotation speed considering the time difference to the previous
-        sample. This rotation speed in radians per second is then sent via `socket_io`.
+        sample. This rotation speed in radians per second is then sent via `socket_io`. If the
+        loop falls behind, it skips to the newest frame. Since the heading is integrated, the
+        rotation speed remains correct.
+
+        If `socket_io` has a `latency_monitor`, the time each update is sent is recorded there,
+        see `LatencyMonitor`. This applies to all closed loop modes.
 
         :param socket socket_io: The Socket.IO used for communicating with the client.
         :rtype: None
         """
         shared_key = time.time_ns()
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-            sock.settimeout(0.1)
-            prevheading = None
-            prevts = None
-            data = ""
-            try:
-                sock.bind(( '127.0.0.1', 1717))
-                new_data = sock.recv(1)
-                data = new_data.decode('UTF-8')
-                socket_io.emit("meta", (shared_key, "fictrac-connect-ok", 1))
-            except: # If Fictrac doesn't exist # FIXME: catch specific exception
-                socket_io.emit("meta", (shared_key, "fictrac-connect-fail", 0))
-                warnings.warn("Fictrac is not running on 127.0.0.1:1717")
-                return
-
-            while self.is_triggering:
-                new_data = sock.recv(1024)
-                if not new_data:
-                    break
-                data += new_data.decode('UTF-8')
-                endline = data.find("\n")
-                line = data[:endline]
-                data = data[endline+1:]
-                toks = line.split(", ")
-                if (len(toks) < 24) | (toks[0] != "FT"):
-                    continue # This is not the expected fictrac data package
-                cnt = int(toks[1])
-                heading = float(toks[17])
-                timestamp = float(toks[22])
+        reader = getattr(socket_io, "fictrac", None) or FicTracReader.get()
+        reader.start(socket_io)
+        subscription = reader.subscribe()
+        monitor = getattr(socket_io, "latency_monitor", None)
+        # updates are shown on arrival, also if the socket synchronises stimulus changes
+        emit = getattr(socket_io, "emit_immediate", socket_io.emit)
+        prevheading = None
+        prevts = None
+        try:
+            while socket_io in self.triggering:
+                frame = subscription.get_latest(timeout=0.1)
+                if frame is None:
+                    continue
                 if prevheading:
-                    updateval = (heading-prevheading)/((timestamp-prevts)/1000)
-                    socket_io.emit('speed', (cnt, updateval * self.gain))
-                prevheading = heading
-                prevts = timestamp
+                    updateval = (frame.heading-prevheading)/((frame.timestamp-prevts)/1000)
+                    emit('speed', (frame.cnt, updateval * self.gain))
+                    if monitor is not None:
+                        monitor.mark(frame, time.time_ns())
+                prevheading = frame.heading
+                prevts = frame.timestamp
+        finally:
+            reader.unsubscribe(subscription)
+        self._end_loop(socket_io, shared_key, subscription)
+
+    def loop_predictive(self, socket_io):
+        """
+        Like `loop`, but smooth the heading with an alpha-beta filter and extrapolate it to the
+        time when the client is expected to show the next frame. This is the time the frame
+        waited on the server, plus the latency to the client, plus half a client frame.
+
+        For each frame, a single `rotate-to` message moves the panels to the predicted position.
+        The raw heading, the filtered heading and rate, the prediction, and the horizon in ms are
+        logged as one `closedloop-prediction` row with a JSON list of these values and the
+        FicTrac frame counter as shared key.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :rtype: None
+        """
+        shared_key = time.time_ns()
+        reader = getattr(socket_io, "fictrac", None) or FicTracReader.get()
+        reader.start(socket_io)
+        subscription = reader.subscribe()
+        monitor = getattr(socket_io, "latency_monitor", None)
+        # updates are shown on arrival, also if the socket synchronises stimulus changes
+        emit = getattr(socket_io, "emit_immediate", socket_io.emit)
+        heading_filter = AlphaBetaFilter(self.alpha, self.beta)
+        start_rad = self.spatial_temporal.closedloop_start_rad()
+        start_heading = None
+        prevts = None
+        try:
+            while socket_io in self.triggering:
+                frame = subscription.get_latest(timeout=0.1)
+                if frame is None:
+                    continue
+                dt = (frame.timestamp - prevts) / 1000 if prevts is not None else 0
+                prevts = frame.timestamp
+                heading, rate = heading_filter.update(frame.heading, dt)
+                if start_heading is None:
+                    start_heading = heading
+                    continue
+                horizon = self._horizon_s(socket_io, frame)
+                predicted = heading_filter.predict(horizon)
+                emit('rotate-to', (
+                    frame.cnt, start_rad + (predicted - start_heading) * self.gain))
+                if monitor is not None:
+                    monitor.mark(frame, time.time_ns())
+                self._log(socket_io, frame.cnt, "closedloop-prediction", json.dumps(
+                    [frame.heading, heading, rate, predicted, horizon * 1000]))
+        finally:
+            reader.unsubscribe(subscription)
+        self._end_loop(socket_io, shared_key, subscription)
+
+    def loop_absolute(self, socket_io):
+        """
+        Send the absolute panel angle `heading * gain + offset` instead of a rotation speed. Lost
+        or late messages therefore do not accumulate into a drift of the pattern.
+
+        FicTrac often runs faster than the client draws frames. Updates are coalesced to at most
+        one `rotate-to` per client frame (`1/fps`), only the latest heading is sent. The number of
+        frames that were superseded before they were sent is logged as `closedloop-coalesced`.
+
+        The FicTrac heading wraps around at 2π, it is unwrapped before the gain is applied.
 
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :rtype: None
+        """
+        shared_key = time.time_ns()
+        reader = getattr(socket_io, "fictrac", None) or FicTracReader.get()
+        reader.start(socket_io)
+        subscription = reader.subscribe()
+        monitor = getattr(socket_io, "latency_monitor", None)
+        # updates are shown on arrival, also if the socket synchronises stimulus changes
+        emit = getattr(socket_io, "emit_immediate", socket_io.emit)
+        interval = 1 / self.fps
+        offset = math.radians(self.offset_deg) if self.offset_deg is not None else None
+        prevheading = None
+        heading = 0.0
+        pending = None
+        pending_frame = None
+        next_emit = 0.0
+        coalesced_count = 0
+        try:
+            while socket_io in self.triggering:
+                timeout = max(0.0, next_emit - time.perf_counter()) if pending else 0.1
+                frame = subscription.get_latest(timeout=timeout)
+                if frame is not None:
+                    if prevheading is None:
+                        heading = frame.heading
+                        if offset is None:
+                            offset = self.spatial_temporal.closedloop_start_rad() \
+                                - heading * self.gain
+                    else:
+                        heading += (frame.heading - prevheading + math.pi) % (2*math.pi) - math.pi
+                    prevheading = frame.heading
+                    if pending is not None:
+                        coalesced_count += 1
+                    pending = (frame.cnt, heading * self.gain + offset)
+                    pending_frame = frame
+                now = time.perf_counter()
+                if pending is not None and now >= next_emit:
+                    emit('rotate-to', pending)
+                    if monitor is not None:
+                        monitor.mark(pending_frame, time.time_ns())
+                    pending = None
+                    next_emit = now + interval
+        finally:
+            reader.unsubscribe(subscription)
+        socket_io.emit("meta", (shared_key, "closedloop-coalesced", coalesced_count))
+        self._end_loop(socket_io, shared_key, subscription)
+
+    def _horizon_s(self, socket_io, frame) -> float:
+        """
+        Time from the FicTrac frame to the expected display on the client.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :param FicTracFrame frame: current frame
+        :rtype: float
+        :returns: prediction horizon in seconds
+        """
+        if self.latency_ms is not None:
+            latency = self.latency_ms / 1000
+        else:
+            expected_latency = getattr(socket_io, "expected_latency_ns", None)
+            latency = expected_latency() / 1e9 if expected_latency else 0
+        waited = (time.time_ns() - frame.received_ns) / 1e9 if frame.received_ns else 0
+        return waited + latency + 0.5 / self.fps
+
+    def _log(self, socket_io, shared_key, key, value) -> None:
+        """
+        Log a value on the server without sending it to the client, if the socket supports it.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :rtype: None
+        """
+        log_event = getattr(socket_io, "log_event", None)
+        if log_event is not None:
+            log_event(shared_key, key, value)
+        else:
+            socket_io.emit("meta", (shared_key, key, value))
+
+    def _end_loop(self, socket_io, shared_key, subscription) -> None:
+        """
+        Log the statistics of the FicTrac subscription at the end of the loop.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :param int shared_key: shared key of the loop
+        :param FicTracSubscription subscription: subscription used in the loop
+        :rtype: None
+        """
+        socket_io.emit("meta", (shared_key, "fictrac-overflow", subscription.overflow_count))
+        socket_io.emit("meta", (shared_key, "fictrac-skipped", subscription.skipped_count))
         socket_io.emit("meta", (shared_key, "fictrac-disconnect-ok", 1))
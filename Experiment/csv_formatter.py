@@ -23,10 +23,26 @@ class CsvFormatter(logging.Formatter):
         """
         Convert the record to a CSV row and return this row as a string.
 
+        Records logged with `extra={'batch': True}` contain a list of rows in `msg`, they are
+        converted to one CSV row each.
+
         :param dict record: dictionary with all the content in the `msg` key
         :rtype: str
         """
-        self.writer.writerow([time.time_ns()] + record.msg) # write CSV row to StringIO "fake file"
+        # The BatchedFileHandler timestamps the record when it is queued
+        server_time = getattr(record, 'time_ns', None) or time.time_ns()
+        if getattr(record, 'batch', False):
+            return "\n".join(self.format_row([server_time] + row) for row in record.msg)
+        return self.format_row([server_time] + record.msg)
+
+    def format_row(self, row):
+        """
+        Convert a list of values to a CSV row, without the trailing line terminator.
+
+        :param list row: values of a single row, starting with the server timestamp
+        :rtype: str
+        """
+        self.writer.writerow(row) # write CSV row to StringIO "fake file"
         data = self.output.getvalue() # get str from StringIO
         self.output.truncate(0) # empty output
         self.output.seek(0)
@@ -0,0 +1,163 @@
+"""
+Run protocols against a virtual clock, without a client and in a fraction of a second.
+
+    python -m Experiment.dry_run protocols/grating.yaml --trace grating.csv
+
+prints the nominal and the simulated duration, the number of messages per event, and all
+warnings, and writes the trace of sent messages to `grating.csv`.
+"""
+
+import argparse
+import csv
+import json
+import sys
+import time
+import warnings
+
+from collections import Counter
+
+from .protocol import Protocol, ProtocolError
+from .timeline import Timeline
+from .trial_sequence import TrialSequence, play_trials
+
+class DryRun(Timeline):
+    """
+    Stand-in for the Socket.IO server that records each message with the time of the virtual
+    clock at which it would have been sent. Durations advance the virtual clock through the
+    scheduler of the dry run instead of sleeping.
+
+    Unlike a `Timeline`, a dry run accepts closed loop conditions. Without FicTrac data, their
+    trial period passes without heading updates, and a warning is recorded.
+    """
+
+    is_compiling = False
+    # Conditions check this flag to skip steps that need live data
+    is_virtual = True
+
+    def __init__(self) -> None:
+        """
+        Create an empty dry run at time 0.
+
+        :rtype: None
+        """
+        super().__init__()
+        self.warnings = []
+        self.sequence = None
+        self.started_ns = time.time_ns()
+        self.ended_ns = self.started_ns
+
+    @classmethod
+    def run(cls, trials, repetitions=1, order="sequential", seed=None, start=0):
+        """
+        Run trials the way the server runs them, including the opening black screen and the
+        progress messages.
+
+        :param trials: list of Trials, or a `TrialSequence`, in which case the other arguments
+            are ignored
+        :param int repetitions: number of repetitions of the list
+        :param str order: order of the trials in each repetition, see `TrialSequence`
+        :param int seed: seed for the order
+        :param int start: position in the sequence to start from
+        :rtype: DryRun
+        """
+        sequence = trials if isinstance(trials, TrialSequence) else TrialSequence(
+            trials, repetitions, order, seed, start)
+        dry_run = cls()
+        dry_run.sequence = sequence
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            play_trials(dry_run, sequence)
+        dry_run.ended_ns = time.time_ns()
+        dry_run.warnings.extend(str(warning.message) for warning in caught)
+        return dry_run
+
+    @classmethod
+    def run_protocol(cls, protocol, seed=None, start=0):
+        """
+        Run a compiled protocol. The problems found while checking it are added to the warnings.
+
+        :param Protocol protocol: compiled protocol
+        :param int seed: seed for the order, overrides the `seed` of the protocol
+        :param int start: position in the sequence to start from
+        :rtype: DryRun
+        """
+        dry_run = cls.run(protocol.sequence(seed, start))
+        dry_run.warnings[:0] = protocol.problems
+        return dry_run
+
+    def trace(self, keep_keys=False) -> list:
+        """
+        Messages sent during the dry run. The shared keys in the messages are taken from the wall
+        clock and differ between runs. Unless `keep_keys` is set, they are replaced by their
+        number in the order of first use, so that traces of different runs can be compared.
+
+        :param bool keep_keys: keep the original shared keys
+        :rtype: list
+        :returns: list of `(offset_ms, event, args)`
+        """
+        if keep_keys:
+            return [(offset, event, list(args)) for offset, event, args in self.entries]
+        keys = {}
+        trace = []
+        for offset, event, args in self.entries:
+            args = list(args)
+            if args and isinstance(args[0], int) and self.started_ns <= args[0] <= self.ended_ns:
+                args[0] = keys.setdefault(args[0], len(keys))
+            trace.append((offset, event, args))
+        return trace
+
+    def summary(self) -> dict:
+        """
+        Simulated duration, number of messages per event, and warnings.
+
+        :rtype: dict
+        """
+        return {
+            'duration_ms': self.duration_ms,
+            'sequence': self.sequence.as_dict() if self.sequence is not None else None,
+            'messages': len(self.entries),
+            'events': dict(Counter(event for _, event, _ in self.entries)),
+            'warnings': self.warnings}
+
+
+def write_trace(trace, stream) -> None:
+    """
+    Write a trace as CSV with the columns offset_ms, event, and the arguments in JSON.
+
+    :param list trace: see `DryRun.trace`
+    :param file stream: open text file
+    :rtype: None
+    """
+    writer = csv.writer(stream)
+    writer.writerow(["offset_ms", "event", "args"])
+    for offset, event, arguments in trace:
+        writer.writerow([f"{offset:.3f}", event, json.dumps(arguments)])
+
+
+def main() -> None:
+    """
+    Command line interface, see `--help`.
+    """
+    parser = argparse.ArgumentParser(description="Run a FlyFlix protocol on a virtual clock")
+    parser.add_argument("protocol", help="protocol file, for example protocols/grating.yaml")
+    parser.add_argument("--trace", help="write the trace as CSV to this file, - for stdout")
+    parser.add_argument("--seed", type=int, help="seed for the order of the trials")
+    parser.add_argument("--start", type=int, default=0, help="position to start from")
+    args = parser.parse_args()
+    try:
+        protocol = Protocol.load(args.protocol)
+        dry_run = DryRun.run_protocol(protocol, args.seed, args.start)
+    except (ProtocolError, ValueError) as error:
+        sys.exit(f"invalid protocol: {error}")
+    summary = dry_run.summary()
+    summary['nominal_duration_ms'] = protocol.duration_ms()
+    if args.trace == "-":
+        write_trace(dry_run.trace(), sys.stdout)
+    elif args.trace:
+        with open(args.trace, "w", newline="", encoding="utf-8") as trace_file:
+            write_trace(dry_run.trace(), trace_file)
+    print(json.dumps(summary, indent=2), file=sys.stderr if args.trace == "-" else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
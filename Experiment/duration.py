@@ -2,13 +2,18 @@
 
 import time
 
-from datetime import datetime, timedelta
+from .interned import Interned
+from .scheduler import Scheduler
 
-class Duration():
+class Duration(Interned):
     """
-    Representation of a duration in FlyFlix
+    Representation of a duration in FlyFlix. Durations are immutable, and equal durations are the
+    same object.
     """
 
+    __slots__ = ('time_duration',)
+    _fields = __slots__
+
     def __init__(self, time_duration=3000) -> None:
         """
         Constructor for Duration
@@ -23,13 +28,23 @@ class Duration():
         Triggers the duration. This is basically a server-side delay for the amount of time
         specified in the constructor.
 
-        :param socket socket_io: Socket.IO used for communication with the client. It is part of
-            the standard interface, but not used in this particular method.
+        If `socket_io` has a `scheduler`, the delay ends at the scheduler's next deadline, which
+        is measured from the start of the protocol. Otherwise the delay is measured from now. The
+        overshoot of the delay is logged as `duration-overshoot-ns`. Messages that `socket_io`
+        collected, see `SessionSocket.flush`, are sent before the delay.
+
+        :param socket socket_io: Socket.IO used for communication with the client, and the source
+            of the scheduler.
         :rtype: None
         """
         shared_key = time.time_ns()
-        ttime = datetime.now() + timedelta(milliseconds=self.time_duration)
+        scheduler = getattr(socket_io, "scheduler", None) or Scheduler()
         socket_io.emit("meta", (shared_key, "duration-delay-start", self.time_duration))
-        while datetime.now() < ttime:
-            time.sleep(0.01)
+        flush = getattr(socket_io, "flush", None)
+        if flush is not None:
+            flush()
+        overshoot = scheduler.wait(self.time_duration)
         socket_io.emit("meta", (shared_key, "duration-delay-end", self.time_duration))
+        log_event = getattr(socket_io, "log_event", None)
+        if log_event is not None:
+            log_event(shared_key, "duration-overshoot-ns", overshoot)
@@ -0,0 +1,155 @@
+"""
+Columnar archive of complete FicTrac frames.
+
+The archive is a sidecar file next to the repeater log. It starts with a single JSON line that
+describes the columns, followed by blocks of frames. Each block has a short header with the
+number of rows and then stores one column after the other as little-endian int64 (`received_ns`
+and `shared_key`) or float64 (all FicTrac columns).
+"""
+
+import json
+import math
+import struct
+import sys
+
+from array import array
+
+# block header: marker and number of rows
+BLOCK_HEAD = struct.Struct("<4sI")
+BLOCK_MARKER = b"FTBK"
+FORMAT = "flyflix-fictrac-archive-1"
+
+class FicTracArchive():
+    """
+    Store complete FicTrac frames together with the server receive time and the shared key of
+    the trial that was running when the frame arrived.
+
+    Frames are collected in preallocated arrays that are reused for every block. Once a block is
+    full, it is written to disk in one go.
+    """
+
+    # FicTrac data columns 1 to 25, see the FicTrac documentation on the output format
+    COLUMNS = (
+        'frame',
+        'delta_rot_cam_x', 'delta_rot_cam_y', 'delta_rot_cam_z', 'delta_rot_error',
+        'delta_rot_lab_x', 'delta_rot_lab_y', 'delta_rot_lab_z',
+        'abs_rot_cam_x', 'abs_rot_cam_y', 'abs_rot_cam_z',
+        'abs_rot_lab_x', 'abs_rot_lab_y', 'abs_rot_lab_z',
+        'pos_lab_x', 'pos_lab_y', 'heading', 'direction', 'speed',
+        'forward', 'side', 'timestamp', 'sequence', 'delta_timestamp', 'alt_timestamp')
+
+    def __init__(self, filename, block_size=1024) -> None:
+        """
+        Create the archive file and write the column description.
+
+        :param str filename: path of the archive, typically the log name with `.fictrac` suffix
+        :param int block_size: number of frames per block
+        :rtype: None
+        """
+        self.filename = filename
+        self.block_size = block_size
+        self.shared_key = 0
+        self.frame_count = 0
+        self._count = 0
+        self._received = array('q', bytes(8 * block_size))
+        self._shared = array('q', bytes(8 * block_size))
+        self._values = [array('d', bytes(8 * block_size)) for _ in self.COLUMNS]
+        self.stream = open(filename, "wb")
+        header = {
+            'format': FORMAT,
+            'columns': ['received_ns', 'shared_key'] + list(self.COLUMNS),
+            'dtypes': ['<i8', '<i8'] + ['<f8'] * len(self.COLUMNS)}
+        self.stream.write(json.dumps(header).encode("utf-8") + b"\n")
+
+    def set_shared_key(self, shared_key) -> None:
+        """
+        Mark all following frames with the shared key of a trial.
+
+        :param int shared_key: shared key of the trial, 0 outside of trials
+        :rtype: None
+        """
+        self.shared_key = int(shared_key)
+
+    def append(self, frame) -> None:
+        """
+        Add a frame to the current block, write the block once it is full.
+
+        :param FicTracFrame frame: frame parsed with `full_columns`
+        :rtype: None
+        """
+        i = self._count
+        self._received[i] = frame.received_ns
+        self._shared[i] = self.shared_key
+        values = frame.values or ()
+        for col, column in enumerate(self._values):
+            column[i] = values[col] if col < len(values) else math.nan
+        self._count += 1
+        self.frame_count += 1
+        if self._count == self.block_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write the frames of the current block to disk.
+
+        :rtype: None
+        """
+        count = self._count
+        if count == 0 or self.stream is None:
+            return
+        chunks = [BLOCK_HEAD.pack(BLOCK_MARKER, count)]
+        for column in [self._received, self._shared] + self._values:
+            part = column[:count]
+            if sys.byteorder != 'little':
+                part.byteswap()
+            chunks.append(part.tobytes())
+        self.stream.write(b"".join(chunks))
+        self.stream.flush()
+        self._count = 0
+
+    def close(self) -> None:
+        """
+        Write the remaining frames and close the file.
+
+        :rtype: None
+        """
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+    @staticmethod
+    def read(filename, shared_key=None) -> dict:
+        """
+        Read an archive into one array per column.
+
+        :param str filename: path of the archive
+        :param int shared_key: only return frames of the trial with this shared key
+        :rtype: dict
+        """
+        with open(filename, "rb") as stream:
+            header = json.loads(stream.readline())
+            if header.get('format') != FORMAT:
+                raise ValueError(f"{filename} is not a FicTrac archive")
+            names = header['columns']
+            columns = {name: array('q' if dtype == '<i8' else 'd') for name, dtype in zip(
+                names, header['dtypes'])}
+            while True:
+                head = stream.read(BLOCK_HEAD.size)
+                if len(head) < BLOCK_HEAD.size:
+                    break
+                marker, count = BLOCK_HEAD.unpack(head)
+                if marker != BLOCK_MARKER:
+                    raise ValueError(f"corrupt block in {filename}")
+                for name in names:
+                    part = array(columns[name].typecode)
+                    part.frombytes(stream.read(count * part.itemsize))
+                    if sys.byteorder != 'little':
+                        part.byteswap()
+                    columns[name].extend(part)
+        if shared_key is not None:
+            keep = [i for i, key in enumerate(columns['shared_key']) if key == int(shared_key)]
+            columns = {
+                name: array(column.typecode, (column[i] for i in keep))
+                for name, column in columns.items()}
+        return columns
@@ -0,0 +1,235 @@
+"""
+Stand-in for FicTrac during development.
+
+The emulator sends synthetic FicTrac data lines over UDP, records the UDP stream of a real
+FicTrac, and replays such a recording in real time or faster. Run it from the repository root:
+
+    python -m Experiment.fictrac_emulator simulate --rate 100
+    python -m Experiment.fictrac_emulator record data/fictrac.rec
+    python -m Experiment.fictrac_emulator replay data/fictrac.rec --speed 2
+"""
+
+import argparse
+import math
+import random
+import socket
+import struct
+import time
+
+# recording: magic, then per datagram the offset in ns from the first datagram and its length
+RECORDING_MAGIC = b"FLYFLIX-FTREC-1\n"
+DATAGRAM_HEAD = struct.Struct("<qI")
+
+class FicTracEmulator():
+    """
+    Generate FicTrac data lines for a simulated fly.
+
+    The turning rate follows an Ornstein-Uhlenbeck process, so that the fly keeps turning in one
+    direction for a while and occasionally switches direction. The walking speed varies the same
+    way around `speed_mean`. All 25 columns of the FicTrac output are filled consistently.
+    """
+
+    def __init__(
+        self, rate=100.0, turn_sd=1.5, turn_tau=0.5, speed_mean=0.2, speed_sd=0.1,
+        seed=None) -> None:
+        """
+        Create a simulated fly at heading 0.
+
+        :param float rate: frames per second
+        :param float turn_sd: standard deviation of the turning rate in rad/s
+        :param float turn_tau: time constant of the turning rate in s
+        :param float speed_mean: mean walking speed in rad/frame of the ball
+        :param float speed_sd: standard deviation of the walking speed
+        :param int seed: seed for the random number generator
+        :rtype: None
+        """
+        self.rate = rate
+        self.turn_sd = turn_sd
+        self.turn_tau = turn_tau
+        self.speed_mean = speed_mean
+        self.speed_sd = speed_sd
+        self.random = random.Random(seed)
+        self.cnt = 0
+        self.turn = 0.0
+        self.speed = speed_mean
+        self.heading = 0.0
+        self.abs_rot = [0.0, 0.0, 0.0]
+        self.pos = [0.0, 0.0]
+        self.timestamp = time.time() * 1000
+
+    def _ou_step(self, value, mean, sd) -> float:
+        """
+        Advance an Ornstein-Uhlenbeck process by one frame.
+
+        :param float value: current value
+        :param float mean: long term mean
+        :param float sd: stationary standard deviation
+        :rtype: float
+        """
+        dt = 1 / self.rate
+        decay = math.exp(-dt / self.turn_tau)
+        noise = sd * math.sqrt(1 - decay * decay)
+        return mean + (value - mean) * decay + noise * self.random.gauss(0, 1)
+
+    def next_line(self) -> bytes:
+        """
+        Advance the simulation by one frame and return the FicTrac data line.
+
+        :rtype: bytes
+        """
+        dt = 1 / self.rate
+        self.cnt += 1
+        self.turn = self._ou_step(self.turn, 0.0, self.turn_sd)
+        self.speed = max(0.0, self._ou_step(self.speed, self.speed_mean, self.speed_sd))
+        d_heading = self.turn * dt
+        self.heading = (self.heading + d_heading) % (2 * math.pi)
+        forward, side = self.speed, 0.0
+        delta = [side, forward, d_heading]
+        self.abs_rot = [a + d for a, d in zip(self.abs_rot, delta)]
+        self.pos[0] += forward * math.cos(self.heading)
+        self.pos[1] += forward * math.sin(self.heading)
+        self.timestamp += dt * 1000
+        # the simulated fly does not walk sideways, so it moves in the direction it faces
+        direction = self.heading
+        values = [self.cnt] + delta + [0.01] + delta + self.abs_rot + self.abs_rot \
+            + self.pos + [self.heading, direction, self.speed, forward, side,
+            self.timestamp, self.cnt, dt * 1000, self.timestamp]
+        return ("FT, " + ", ".join(str(v) for v in values) + "\n").encode("ascii")
+
+
+def simulate(host, port, rate, duration=None, seed=None) -> None:
+    """
+    Send synthetic FicTrac lines to `host`:`port` at `rate` frames per second.
+
+    :param str host: address FlyFlix listens on
+    :param int port: port FlyFlix listens on
+    :param float rate: frames per second
+    :param float duration: stop after this many seconds, run forever if None
+    :param int seed: seed for the random number generator
+    :rtype: None
+    """
+    emulator = FicTracEmulator(rate=rate, seed=seed)
+    start = time.perf_counter()
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        while duration is None or emulator.cnt < duration * rate:
+            deadline = start + emulator.cnt / rate
+            delay = deadline - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sock.sendto(emulator.next_line(), (host, port))
+
+
+def record(filename, host, port, duration=None) -> int:
+    """
+    Record the FicTrac UDP stream with the receive time of each datagram.
+
+    :param str filename: path of the recording
+    :param str host: address FicTrac sends its data to
+    :param int port: port FicTrac sends its data to
+    :param float duration: stop after this many seconds, run until interrupted if None
+    :rtype: int
+    :returns: number of recorded datagrams
+    """
+    count = 0
+    first = None
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock, \
+            open(filename, "wb") as stream:
+        sock.bind((host, port))
+        sock.settimeout(0.1)
+        stream.write(RECORDING_MAGIC)
+        start = time.perf_counter()
+        try:
+            while duration is None or time.perf_counter() - start < duration:
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                now = time.perf_counter_ns()
+                first = now if first is None else first
+                stream.write(DATAGRAM_HEAD.pack(now - first, len(data)) + data)
+                count += 1
+        except KeyboardInterrupt:
+            pass
+    return count
+
+
+def read_recording(filename):
+    """
+    Iterate over the datagrams of a recording.
+
+    :param str filename: path of the recording
+    :rtype: generator of (offset in ns, bytes)
+    """
+    with open(filename, "rb") as stream:
+        if stream.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+            raise ValueError(f"{filename} is not a FicTrac recording")
+        while True:
+            head = stream.read(DATAGRAM_HEAD.size)
+            if len(head) < DATAGRAM_HEAD.size:
+                return
+            offset, length = DATAGRAM_HEAD.unpack(head)
+            yield offset, stream.read(length)
+
+
+def replay(filename, host, port, speed=1.0, loop=False) -> int:
+    """
+    Send a recording to `host`:`port` with the original timing.
+
+    :param str filename: path of the recording
+    :param str host: address FlyFlix listens on
+    :param int port: port FlyFlix listens on
+    :param float speed: playback speed, 2 is twice as fast. 0 sends as fast as possible.
+    :param bool loop: start again at the end of the recording
+    :rtype: int
+    :returns: number of sent datagrams
+    """
+    count = 0
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        while True:
+            start = time.perf_counter()
+            for offset, data in read_recording(filename):
+                if speed > 0:
+                    delay = start + offset / 1e9 / speed - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+                sock.sendto(data, (host, port))
+                count += 1
+            if not loop:
+                return count
+
+
+def main() -> None:
+    """
+    Command line interface, see `--help`.
+    """
+    parser = argparse.ArgumentParser(description="FicTrac stand-in for FlyFlix development")
+    parser.add_argument("--host", default="127.0.0.1", help="UDP address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=1717, help="UDP port (default: %(default)s)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sim = commands.add_parser("simulate", help="send synthetic FicTrac lines")
+    sim.add_argument("--rate", type=float, default=100.0, help="frames per second")
+    sim.add_argument("--duration", type=float, help="seconds to run, default: forever")
+    sim.add_argument("--seed", type=int, help="random seed")
+    rec = commands.add_parser("record", help="record a FicTrac UDP stream")
+    rec.add_argument("filename")
+    rec.add_argument("--duration", type=float, help="seconds to record, default: until Ctrl-C")
+    rep = commands.add_parser("replay", help="replay a recorded FicTrac UDP stream")
+    rep.add_argument("filename")
+    rep.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 for maximum")
+    rep.add_argument("--loop", action="store_true", help="repeat the recording")
+    args = parser.parse_args()
+    try:
+        if args.command == "simulate":
+            simulate(args.host, args.port, args.rate, args.duration, args.seed)
+        elif args.command == "record":
+            count = record(args.filename, args.host, args.port, args.duration)
+            print(f"recorded {count} datagrams")
+        else:
+            count = replay(args.filename, args.host, args.port, args.speed, args.loop)
+            print(f"sent {count} datagrams")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+"""Single frame of FicTrac data"""
+
+class FicTracFrame():
+    """
+    Values of one FicTrac output line. FicTrac sends lines starting with `FT` followed by at
+    least 23 comma separated columns, see
+    https://github.com/rjdmoore/fictrac/blob/master/doc/data_header.txt
+    """
+
+    __slots__ = ('cnt', 'heading', 'timestamp', 'received_ns', 'parsed_ns', 'values')
+
+    def __init__(self, cnt, heading, timestamp, received_ns=0, values=None) -> None:
+        """
+        Create a frame.
+
+        :param int cnt: frame counter (column 1)
+        :param float heading: integrated animal heading in radians (column 17)
+        :param float timestamp: FicTrac timestamp in ms (column 22)
+        :param int received_ns: server time in ns when the frame was received
+        :param tuple values: all columns starting with column 1, only set if the framer parses
+            complete lines
+        :rtype: None
+        """
+        self.cnt = cnt
+        self.heading = heading
+        self.timestamp = timestamp
+        self.received_ns = received_ns
+        self.parsed_ns = received_ns
+        self.values = values
@@ -0,0 +1,97 @@
+"""Incremental framing and parsing of the FicTrac data stream"""
+
+from .fictrac_frame import FicTracFrame
+
+class FicTracFramer():
+    """
+    Split the FicTrac byte stream into lines and parse them into FicTracFrames.
+
+    Data is collected in a bytes buffer, every complete line of a datagram is parsed, and a
+    partial line at the end is kept for the next datagram. Only the columns up to the last one
+    that is needed are split, unless `full_columns` is set.
+    """
+
+    # FicTrac lines have at least 23 columns after the `FT` prefix
+    MIN_COLUMNS = 24
+
+    def __init__(self, max_buffer=65536, full_columns=False) -> None:
+        """
+        Create an empty framer.
+
+        :param int max_buffer: maximum size of an incomplete line in bytes before it is
+            discarded as malformed
+        :param bool full_columns: parse all columns into `FicTracFrame.values`
+        :rtype: None
+        """
+        self.buffer = bytearray()
+        self.max_buffer = max_buffer
+        self.full_columns = full_columns
+        self.frame_count = 0
+        self.malformed_count = 0
+        self.skipped_count = 0
+
+    def feed(self, data, received_ns=0) -> list:
+        """
+        Add data from a datagram and return all complete frames.
+
+        :param bytes data: data received from FicTrac
+        :param int received_ns: server time in ns when the data was received
+        :rtype: list
+        """
+        self.buffer += data
+        end = self.buffer.rfind(b"\n")
+        if end < 0:
+            if len(self.buffer) > self.max_buffer:
+                self.malformed_count += 1
+                self.buffer.clear()
+            return []
+        lines = self.buffer[:end].split(b"\n")
+        del self.buffer[:end+1]
+        frames = []
+        for line in lines:
+            frame = self.parse(line, received_ns)
+            if frame is not None:
+                frames.append(frame)
+        self.frame_count += len(frames)
+        return frames
+
+    def feed_latest(self, data, received_ns=0):
+        """
+        Add data from a datagram and return only the newest complete frame. Older frames from
+        the same datagram are counted in `skipped_count`.
+
+        :param bytes data: data received from FicTrac
+        :param int received_ns: server time in ns when the data was received
+        :rtype: FicTracFrame or None
+        """
+        frames = self.feed(data, received_ns)
+        if not frames:
+            return None
+        self.skipped_count += len(frames) - 1
+        return frames[-1]
+
+    def parse(self, line, received_ns=0):
+        """
+        Parse a single line.
+
+        :param bytes line: line without line break
+        :param int received_ns: server time in ns when the line was received
+        :rtype: FicTracFrame or None if the line is not a valid FicTrac data line
+        """
+        line = line.strip()
+        if not line:
+            return None
+        if self.full_columns:
+            toks = line.split(b",")
+        else:
+            toks = line.split(b",", self.MIN_COLUMNS - 1)
+        if len(toks) < self.MIN_COLUMNS or toks[0] != b"FT":
+            self.malformed_count += 1
+            return None
+        try:
+            values = tuple(float(tok) for tok in toks[1:]) if self.full_columns else None
+            return FicTracFrame(
+                int(toks[1]), float(toks[17]), float(toks[22]), received_ns, values)
+        except ValueError:
+            self.malformed_count += 1
+            return None
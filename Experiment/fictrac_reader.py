@@ -0,0 +1,218 @@
+"""Shared reader for the FicTrac UDP stream"""
+
+import queue
+import socket
+import time
+import warnings
+
+from .fictrac_framer import FicTracFramer
+
+class FicTracSubscription():
+    """
+    Bounded queue of FicTrac frames for a single consumer. If the consumer falls behind, the
+    oldest frames are discarded and counted in `overflow_count`.
+    """
+
+    def __init__(self, maxsize=100) -> None:
+        """
+        Create an empty subscription.
+
+        :param int maxsize: maximum number of frames waiting in the queue
+        :rtype: None
+        """
+        self.frames = queue.Queue(maxsize)
+        self.overflow_count = 0
+        self.skipped_count = 0
+
+    def put(self, frame) -> None:
+        """
+        Add a frame, discarding the oldest frame if the queue is full.
+
+        :param FicTracFrame frame: new frame
+        :rtype: None
+        """
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.overflow_count += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """
+        Get the next frame.
+
+        :param float timeout: maximum time in seconds to wait for a frame
+        :rtype: FicTracFrame or None if no frame arrived within the timeout
+        """
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_latest(self, timeout=None):
+        """
+        Get the newest frame and discard older frames that are still waiting. This lets a
+        consumer that fell behind skip straight to the current frame. Discarded frames are
+        counted in `skipped_count`.
+
+        :param float timeout: maximum time in seconds to wait for a frame
+        :rtype: FicTracFrame or None if no frame arrived within the timeout
+        """
+        frame = self.get(timeout)
+        while frame is not None:
+            try:
+                newer = self.frames.get_nowait()
+            except queue.Empty:
+                break
+            self.skipped_count += 1
+            frame = newer
+        return frame
+
+
+class FicTracReader():
+    """
+    Long-lived reader for the FicTrac UDP stream. It binds the socket once, parses each frame
+    once and publishes the frames to all subscribers.
+
+    For the reader to work, FicTrac needs to run with socket communication enabled. To achieve
+    this, set `sock_host` and `sock_port` in the FicTrac configuration to the `host` and `port`
+    of the reader.
+    """
+
+    _readers = {}
+    _default = None
+
+    def __init__(self, host='127.0.0.1', port=1717) -> None:
+        """
+        Create a reader, use `FicTracReader.get` to share readers.
+
+        :param str host: address FicTrac sends its data to
+        :param int port: port FicTrac sends its data to
+        :rtype: None
+        """
+        self.host = host
+        self.port = port
+        self.subscriptions = []
+        self.is_running = False
+        self.is_failed = False
+        self.framer = FicTracFramer()
+
+    @property
+    def frame_count(self) -> int:
+        """
+        Number of valid frames received.
+
+        :rtype: int
+        """
+        return self.framer.frame_count
+
+    @property
+    def malformed_count(self) -> int:
+        """
+        Number of lines that could not be parsed.
+
+        :rtype: int
+        """
+        return self.framer.malformed_count
+
+    @classmethod
+    def get(cls, host=None, port=None):
+        """
+        Get the reader for an address. Without an address, the first reader that was requested
+        is returned, or a reader for 127.0.0.1:1717 is created.
+
+        :param str host: address FicTrac sends its data to
+        :param int port: port FicTrac sends its data to
+        :rtype: FicTracReader
+        """
+        if host is None and port is None and cls._default is not None:
+            return cls._default
+        address = (host or '127.0.0.1', port or 1717)
+        reader = cls._readers.get(address)
+        if reader is None:
+            reader = cls(*address)
+            cls._readers[address] = reader
+        if cls._default is None:
+            cls._default = reader
+        return reader
+
+    def subscribe(self, maxsize=100) -> FicTracSubscription:
+        """
+        Create a subscription that receives all frames from now on.
+
+        :param int maxsize: maximum number of frames waiting in the queue
+        :rtype: FicTracSubscription
+        """
+        subscription = FicTracSubscription(maxsize)
+        self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription) -> None:
+        """
+        Stop sending frames to a subscription.
+
+        :param FicTracSubscription subscription: subscription returned by `subscribe`
+        :rtype: None
+        """
+        self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+
+    def start(self, socket_io) -> None:
+        """
+        Start reading in a background task, unless the reader is already running.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :rtype: None
+        """
+        if self.is_running:
+            return
+        self.is_running = True
+        self.is_failed = False
+        socket_io.start_background_task(self.run, socket_io)
+
+    def stop(self) -> None:
+        """
+        Stop reading and release the socket.
+
+        :rtype: None
+        """
+        self.is_running = False
+
+    def run(self, socket_io) -> None:
+        """
+        Read from the FicTrac socket until `stop` is called.
+
+        :param socket socket_io: The Socket.IO used for communicating with the client.
+        :rtype: None
+        """
+        shared_key = time.time_ns()
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(0.1)
+            try:
+                sock.bind((self.host, self.port))
+            except OSError:
+                self.is_running = False
+                self.is_failed = True
+                socket_io.emit("meta", (shared_key, "fictrac-connect-fail", 0))
+                warnings.warn(f"Cannot listen for Fictrac on {self.host}:{self.port}")
+                return
+            while self.is_running:
+                try:
+                    new_data = sock.recv(4096)
+                except socket.timeout:
+                    continue
+                is_first = self.framer.frame_count == 0
+                frames = self.framer.feed(new_data, time.time_ns())
+                parsed_ns = time.time_ns()
+                if frames and is_first:
+                    socket_io.emit("meta", (shared_key, "fictrac-connect-ok", 1))
+                for frame in frames:
+                    frame.parsed_ns = parsed_ns
+                    for subscription in self.subscriptions:
+                        subscription.put(frame)
+        socket_io.emit("meta", (shared_key, "fictrac-malformed", self.malformed_count))
+        socket_io.emit("meta", (shared_key, "fictrac-disconnect-ok", 1))
@@ -0,0 +1,70 @@
+"""Immutable stimulus descriptors that are shared between equal instances"""
+
+import weakref
+
+class _InternedType(type):
+    """
+    Metaclass that freezes new instances and replaces them by an existing equal instance.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        instance = super().__call__(*args, **kwargs)
+        object.__setattr__(instance, "_is_frozen", True)
+        try:
+            return cls._instances.setdefault(instance.key(), instance)
+        except TypeError:
+            # unhashable values, the instance is frozen but not shared
+            return instance
+
+
+class Interned(metaclass=_InternedType):
+    """
+    Base class for immutable descriptors with `__slots__`.
+
+    Subclasses list the constructor values in `_fields` and can precompute derived values, for
+    example the payloads of Socket.IO messages, in further slots during `__init__`. Once
+    `__init__` returns, the instance is frozen. If an equal instance exists, it is returned
+    instead, so that identical stimuli in a protocol share one object. Instances compare and
+    hash by the values in `_fields`.
+    """
+
+    __slots__ = ('_is_frozen', '_hash', '__weakref__')
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._instances = weakref.WeakValueDictionary()
+
+    def key(self) -> tuple:
+        """
+        Values that identify the descriptor. The types are part of the key, so that for example
+        `False` and `0` remain different.
+
+        :rtype: tuple
+        """
+        return tuple((type(value), value) for value in (
+            getattr(self, field) for field in self._fields))
+
+    def __setattr__(self, name, value) -> None:
+        if getattr(self, "_is_frozen", False):
+            raise AttributeError(f"{type(self).__name__} is immutable")
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self is other or self.key() == other.key()
+
+    def __hash__(self) -> int:
+        try:
+            return self._hash
+        except AttributeError:
+            object.__setattr__(self, "_hash", hash(self.key()))
+            return self._hash
+
+    def __repr__(self) -> str:
+        values = ", ".join(f"{field}={getattr(self, field)!r}" for field in self._fields)
+        return f"{type(self).__name__}({values})"
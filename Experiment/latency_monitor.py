@@ -0,0 +1,139 @@
+"""Latency measurement for the closed loop, from the FicTrac frame to the rendered frame"""
+
+import math
+
+from collections import OrderedDict, deque
+
+class LatencyMonitor():
+    """
+    Join timestamps of the closed loop stages by the FicTrac frame counter.
+
+    The server records when a frame was received via UDP, when it was parsed, and when the
+    update was sent. Clients report when they received the update, the next `Loop.tick`, and the
+    next render in their own clock. Server and client stages are measured as durations on their
+    own clocks. The network stage is measured for each frame: the client receive time is mapped
+    to server time with the clock model of the client, see `ClockModel`, and the emit time is
+    subtracted. Until the clock model is based on `min_clock_samples` exchanges, the one-way
+    latency estimated from the `ssync`/`csync` round trip is used instead. Such samples are
+    counted as `estimated` in the network stage.
+    """
+
+    STAGES = ('parse', 'emit', 'network', 'tick', 'render', 'total')
+
+    def __init__(
+            self, network_latency=None, max_pending=1000, window=1000, clock_model=None,
+            min_clock_samples=8) -> None:
+        """
+        Create an empty monitor.
+
+        :param dict network_latency: one-way latency in ns per client id, for example
+            `SessionSocket.latency`, used until the clock model of a client converged
+        :param int max_pending: number of server marks kept while waiting for client reports
+        :param int window: number of recent samples per stage used for `percentiles`
+        :param callable clock_model: returns the ClockModel of a client id or None, for example
+            `SessionSocket.clock_model`
+        :param int min_clock_samples: number of clock exchanges before the clock model is used
+        :rtype: None
+        """
+        self.network_latency = network_latency if network_latency is not None else {}
+        self.clock_model = clock_model
+        self.min_clock_samples = min_clock_samples
+        self.recent_estimated = deque(maxlen=window)
+        self.trial_estimated = 0
+        self.max_pending = max_pending
+        self.pending = OrderedDict()
+        self.recent = {stage: deque(maxlen=window) for stage in self.STAGES}
+        self.trial = {stage: [] for stage in self.STAGES}
+
+    def mark(self, frame, emitted_ns) -> None:
+        """
+        Record the server stages of a frame that was sent to the clients.
+
+        :param FicTracFrame frame: frame the update was based on
+        :param int emitted_ns: server time in ns when the update was sent
+        :rtype: None
+        """
+        self.pending[frame.cnt] = (frame.received_ns, frame.parsed_ns, emitted_ns)
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+
+    def report(self, sid, reports) -> int:
+        """
+        Add client timestamps and join them with the server marks.
+
+        :param str sid: client id
+        :param list reports: list of [cnt, receive, tick, render] with client times in ms
+        :rtype: int
+        :returns: number of reports that matched a server mark
+        """
+        model = self.clock_model(sid) if self.clock_model is not None else None
+        if model is not None and model.samples < self.min_clock_samples:
+            model = None
+        estimated_network = self.network_latency.get(sid, 0) / 1e6
+        matched = 0
+        for cnt, receive, tick, render in reports:
+            server = self.pending.get(cnt)
+            if server is None:
+                continue
+            received_ns, parsed_ns, emitted_ns = server
+            if model is not None:
+                network = (model.to_server_ns(receive) - emitted_ns) / 1e6
+            else:
+                network = estimated_network
+            sample = {
+                'parse': (parsed_ns - received_ns) / 1e6,
+                'emit': (emitted_ns - parsed_ns) / 1e6,
+                'network': network,
+                'tick': tick - receive,
+                'render': render - tick}
+            sample['total'] = (emitted_ns - received_ns) / 1e6 + network + render - receive
+            for stage, value in sample.items():
+                self.recent[stage].append(value)
+                self.trial[stage].append(value)
+            self.recent_estimated.append(model is None)
+            self.trial_estimated += model is None
+            matched += 1
+        return matched
+
+    def percentiles(self) -> dict:
+        """
+        p50, p95, and p99 of the recent samples for each stage.
+
+        :rtype: dict
+        :returns: stage name to dict with `p50`, `p95`, `p99`, and `count`, times in ms. The
+            network stage also has the number of `estimated` samples.
+        """
+        percentiles = {stage: _percentiles(values) for stage, values in self.recent.items()}
+        percentiles['network']['estimated'] = sum(self.recent_estimated)
+        return percentiles
+
+    def trial_summary(self) -> dict:
+        """
+        Percentiles of all samples since the last summary, then start collecting for the next
+        trial.
+
+        :rtype: dict
+        :returns: see `percentiles`, None if no samples were collected
+        """
+        if not self.trial['total']:
+            return None
+        summary = {stage: _percentiles(values) for stage, values in self.trial.items()}
+        summary['network']['estimated'] = self.trial_estimated
+        self.trial = {stage: [] for stage in self.STAGES}
+        self.trial_estimated = 0
+        return summary
+
+
+def _percentiles(values) -> dict:
+    """
+    Nearest-rank percentiles.
+
+    :param values: iterable of numbers
+    :rtype: dict
+    """
+    ordered = sorted(values)
+    if not ordered:
+        return {'p50': None, 'p95': None, 'p99': None, 'count': 0}
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, math.ceil(p / 100 * len(ordered)) - 1))]
+    return {'p50': rank(50), 'p95': rank(95), 'p99': rank(99), 'count': len(ordered)}
@@ -0,0 +1,177 @@
+"""Per-key policy to reduce the amount of logged data"""
+
+import hashlib
+import json
+import warnings
+
+ACTIONS = ('keep', 'drop', 'decimate', 'summarize')
+
+class LogPolicy():
+    """
+    Policy that decides for each log row if it is kept, dropped, decimated, or summarized. The
+    same policy is sent to the client, so that most of the rows are not even transmitted.
+
+    Rules are defined per key, either as the name of the action or as a dictionary:
+
+        loop-skip: drop
+        loop-tick-delta: {action: decimate, every: 10}
+        loop-render: {action: summarize, window: trial-end}
+        panels-tick-rotation: {action: keep, during: [openloop-trial-start, openloop-trial-end]}
+
+    `decimate` keeps every n-th row, `summarize` replaces the rows by a single row with the key
+    `<key>-summary` that contains count, min, max, and mean whenever the `window` key is logged.
+    With `during` the rule only keeps rows between the two keys. Keys without a rule are kept.
+    """
+
+    def __init__(self, rules=None) -> None:
+        """
+        Initialize the policy.
+
+        :param dict rules: dictionary with the rule for each key
+        :rtype: None
+        """
+        self.rules = {}
+        for key, rule in (rules or {}).items():
+            self.rules[key] = self._normalize(key, rule)
+        self.version = hashlib.sha1(
+            json.dumps(self.rules, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+        self.windows = {}
+        self.summary_windows = {}
+        for key, rule in self.rules.items():
+            if rule['during']:
+                self.windows[tuple(rule['during'])] = False
+            if rule['action'] == 'summarize':
+                self.summary_windows.setdefault(rule['window'], []).append(key)
+        self.markers = {marker for window in self.windows for marker in window}
+        self.markers.update(self.summary_windows)
+        self.counters = {}
+        self.summaries = {}
+
+    @staticmethod
+    def _normalize(key, rule) -> dict:
+        """
+        Convert a rule to the dictionary representation.
+
+        :param str key: key the rule applies to
+        :param rule: name of the action or dictionary with `action`, `every`, `during`, `window`
+        :rtype: dict
+        """
+        if isinstance(rule, str):
+            rule = {'action': rule}
+        action = rule.get('action', 'keep')
+        if action not in ACTIONS:
+            raise ValueError(f"Unknown log policy action '{action}' for key '{key}'")
+        every = int(rule.get('every', 1))
+        if every < 1:
+            warnings.warn(f"log policy for '{key}' decimates by {every}, keeping all")
+            every = 1
+        during = rule.get('during')
+        if during is not None and len(during) != 2:
+            raise ValueError(f"log policy 'during' for key '{key}' needs a start and end key")
+        window = rule.get('window', during[1] if during else 'trial-end')
+        return {
+            'action': action, 'every': every,
+            'during': list(during) if during else None, 'window': window}
+
+    def as_dict(self) -> dict:
+        """
+        Policy in a form that can be logged and sent to the client.
+
+        :rtype: dict
+        """
+        return {'version': self.version, 'rules': self.rules}
+
+    def filter_rows(self, rows) -> list:
+        """
+        Apply the policy to a list of log rows. Each row is a list of client id, client timestamp,
+        request timestamp, key, and value.
+
+        :param list rows: log rows in the order they were logged
+        :rtype: list
+        """
+        if not self.rules:
+            return rows
+        kept = []
+        for row in rows:
+            key = row[3]
+            if key in self.markers:
+                kept.extend(self._observe_marker(key))
+            rule = self.rules.get(key)
+            if rule is None or self._accept(row, rule):
+                kept.append(row)
+        return kept
+
+    def flush_summaries(self) -> list:
+        """
+        Return summary rows for all keys that have unreported samples.
+
+        :rtype: list
+        """
+        rows = []
+        for window in list(self.summary_windows):
+            rows.extend(self._summary_rows(window))
+        return rows
+
+    def _observe_marker(self, key) -> list:
+        """
+        Open or close the `during` windows and report summaries that end with this key.
+
+        :param str key: marker key
+        :rtype: list
+        """
+        for window in self.windows:
+            if key == window[0]:
+                self.windows[window] = True
+            elif key == window[1]:
+                self.windows[window] = False
+        return self._summary_rows(key)
+
+    def _summary_rows(self, window) -> list:
+        """
+        Rows that summarize the keys reported at `window`.
+
+        :param str window: marker key
+        :rtype: list
+        """
+        rows = []
+        for key in self.summary_windows.get(window, []):
+            for (sid, skey), summary in list(self.summaries.items()):
+                if skey != key:
+                    continue
+                del self.summaries[(sid, skey)]
+                last = summary.pop('last')
+                summary['mean'] = summary['sum'] / summary['count'] if summary['count'] else None
+                del summary['sum']
+                rows.append([sid, last[1], last[2], f"{key}-summary", json.dumps(summary)])
+        return rows
+
+    def _accept(self, row, rule) -> bool:
+        """
+        Decide if a row is kept.
+
+        :param list row: log row
+        :param dict rule: normalized rule for the key of the row
+        :rtype: bool
+        """
+        if rule['during'] and not self.windows[tuple(rule['during'])]:
+            return False
+        action = rule['action']
+        if action == 'keep':
+            return True
+        if action == 'drop':
+            return False
+        counter_key = (row[0], row[3])
+        if action == 'decimate':
+            count = self.counters.get(counter_key, 0)
+            self.counters[counter_key] = count + 1
+            return count % rule['every'] == 0
+        summary = self.summaries.setdefault(
+            counter_key, {'count': 0, 'sum': 0.0, 'min': None, 'max': None, 'last': None})
+        summary['last'] = row
+        value = row[4]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['min'] = value if summary['min'] is None else min(summary['min'], value)
+            summary['max'] = value if summary['max'] is None else max(summary['max'], value)
+        return False
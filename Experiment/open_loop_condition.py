@@ -3,12 +3,18 @@ import warnings
 import time
 
 from . import Duration
+from .interned import Interned
 
-class OpenLoopCondition():
+class OpenLoopCondition(Interned):
     """
-    Description of open loop condition
+    Description of open loop condition. Conditions are immutable, and equal conditions are the
+    same object.
     """
 
+    __slots__ = (
+        'spatial_temporal', 'trial_duration', 'pretrial_duration', 'posttrial_duration', 'fps')
+    _fields = __slots__
+
     def __init__(
         self,
         spatial_temporal=None, trial_duration=None, fps=60,
@@ -37,6 +43,15 @@ class OpenLoopCondition():
         self.posttrial_duration = posttrial_duration
         self.fps = fps
 
+    def duration_ms(self) -> float:
+        """
+        Nominal duration of the condition, including pre-trial and post-trial.
+
+        :rtype: float
+        """
+        return self.pretrial_duration.time_duration + self.trial_duration.time_duration \
+            + self.posttrial_duration.time_duration
+
     def trigger_fps(self, socket_io) -> None:
         """
         Trigger the fps setting.
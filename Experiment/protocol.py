@@ -0,0 +1,342 @@
+"""
+Protocols declared in YAML files and compiled into sequences of Trials.
+
+A protocol file describes one or more blocks. Each block has a parameter grid whose cartesian
+product defines the trials (the first parameter is the outermost loop), optional derived
+variables in `let`, and the `Trial` arguments in `trial`. In `let` and `trial`, strings starting
+with `=` are evaluated as Python expressions of the grid variables, other strings are formatted
+with the variables, for example `"Rotation alpha {alpha}"`. Arguments ending in `_duration` are
+given in ms. Arguments in the protocol-level `defaults` apply to all blocks.
+
+    name: grating
+    description: Gratings at different speeds
+    repetitions: 2
+    order: sequential
+    defaults:
+      pretrial_duration: 0
+      posttrial_duration: 0
+    blocks:
+      - name: rotation
+        grid:
+          alpha: [22.5, 45]
+          speed: [2, 4, 8]
+          direction: [-1, 1]
+        trial:
+          bar_deg: =alpha
+          rotate_deg_hz: =alpha*2*speed*direction
+          openloop_duration: 5000
+          comment: "Rotation alpha {alpha} speed {speed} direction {direction}"
+
+The blocks are concatenated into the trials that are repeated `repetitions` times. `order` is
+`sequential`, `shuffle` (a new random order for each repetition, `shuffle: true` is a shorthand),
+or `latin-square` (counterbalanced across repetitions), see `TrialSequence`. An optional `seed`
+fixes the order. An optional `log-policy` has the same rules as `logpolicy.yaml`, see `LogPolicy`,
+and replaces the policy of the session while the protocol runs:
+
+    log-policy:
+      loop-skip: drop
+      loop-tick-delta: {action: decimate, every: 10}
+
+Trials are only created when they are run, so that large grids need little memory. The
+conditions of each Trial are kept once they are created, so that the stimulus descriptors and
+their message payloads are encoded once and shared by all repetitions, see `Interned`.
+"""
+
+import bisect
+import hashlib
+import inspect
+import math
+import warnings
+
+from pathlib import Path
+
+import yaml
+
+from .duration import Duration
+from .log_policy import LogPolicy
+from .trial import Trial
+from .trial_sequence import OPENING_DURATION_MS, TrialSequence
+
+# functions available in expressions
+EXPRESSION_FUNCTIONS = {
+    'abs': abs, 'round': round, 'min': min, 'max': max, 'int': int, 'float': float}
+
+class ProtocolError(ValueError):
+    """A protocol definition that cannot be compiled"""
+
+
+class Protocol():
+    """
+    Protocol compiled from a declarative definition. Compiled protocols are cached by the SHA-256
+    of their file content, see `load`.
+
+    A protocol is a sequence of Trials: `len(protocol)` is the number of trials in one
+    repetition, and `protocol[index]` creates the Trial at that position.
+    """
+
+    _cache = {}
+
+    def __init__(self, definition, name=None, digest=None) -> None:
+        """
+        Compile a protocol definition. The definition is validated, and the first Trial of each
+        block is created to check the expressions. All Trials are checked by `check`.
+
+        :param dict definition: parsed protocol definition
+        :param str name: name of the protocol, defaults to the `name` in the definition
+        :param str digest: content hash of the definition file
+        :raises ProtocolError: if the definition cannot be compiled
+        :rtype: None
+        """
+        if not isinstance(definition, dict):
+            raise ProtocolError("protocol definition must be a mapping")
+        self.name = name or definition.get('name')
+        self.description = definition.get('description', "")
+        self.digest = digest
+        self.repetitions = definition.get('repetitions', 1)
+        if not isinstance(self.repetitions, int) or self.repetitions < 1:
+            raise ProtocolError(f"{self.name}: repetitions must be a positive integer")
+        self.order = definition.get(
+            'order', "shuffle" if definition.get('shuffle', False) else "sequential")
+        if self.order not in TrialSequence.ORDERS:
+            raise ProtocolError(
+                f"{self.name}: order must be one of {', '.join(TrialSequence.ORDERS)}")
+        self.seed = definition.get('seed')
+        if self.seed is not None and not isinstance(self.seed, int):
+            raise ProtocolError(f"{self.name}: seed must be an integer")
+        self.log_policy = definition.get('log-policy')
+        if self.log_policy is not None:
+            if not isinstance(self.log_policy, dict) or not all(
+                    isinstance(rule, (str, dict)) for rule in self.log_policy.values()):
+                raise ProtocolError(
+                    f"{self.name}: log-policy must be a mapping from keys to rules")
+            try:
+                LogPolicy(self.log_policy)
+            except (TypeError, ValueError) as error:
+                raise ProtocolError(f"{self.name}: log-policy: {error}") from error
+        self._problems = None
+        self._trial_duration_ms = None
+        self._blocks = []
+        self._offsets = []
+        defaults = definition.get('defaults') or {}
+        blocks = definition.get('blocks')
+        if not blocks:
+            raise ProtocolError(f"{self.name}: no blocks defined")
+        for number, block in enumerate(blocks):
+            self._offsets.append(len(self))
+            self._blocks.append(self._compile_block(block, defaults, number))
+            self._create(self._blocks[-1], 0)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load a protocol file. A file with the same content is only compiled once.
+
+        :param str path: path of the YAML file
+        :raises ProtocolError: if the definition cannot be compiled
+        :rtype: Protocol
+        """
+        content = Path(path).read_bytes()
+        digest = hashlib.sha256(content).hexdigest()
+        protocol = cls._cache.get(digest)
+        if protocol is None:
+            try:
+                definition = yaml.safe_load(content)
+            except yaml.YAMLError as error:
+                raise ProtocolError(f"{path}: {error}") from error
+            protocol = cls(definition, name=Path(path).stem, digest=digest)
+            cls._cache[digest] = protocol
+        return protocol
+
+    @classmethod
+    def load_all(cls, directory="protocols") -> dict:
+        """
+        Load all protocol files in a directory. Files that cannot be compiled are skipped with a
+        warning.
+
+        :param str directory: directory with `*.yaml` files
+        :rtype: dict
+        :returns: protocol name to Protocol
+        """
+        protocols = {}
+        for path in sorted(Path(directory).glob("*.yaml")):
+            try:
+                protocols[path.stem] = cls.load(path)
+            except ProtocolError as error:
+                warnings.warn(f"Protocol {path} skipped: {error}")
+        return protocols
+
+    def _compile_block(self, block, defaults, number) -> dict:
+        """
+        Validate a block and prepare the creation of its Trials.
+
+        :param dict block: block definition with `grid`, `let`, and `trial`
+        :param dict defaults: Trial arguments for all blocks
+        :param int number: position of the block, used in messages
+        :rtype: dict
+        """
+        label = f"{self.name} block {block.get('name', number)}"
+        grid = block.get('grid') or {}
+        arguments = dict(defaults)
+        arguments.update(block.get('trial') or {})
+        parameters = inspect.signature(Trial.__init__).parameters
+        unknown = [key for key in arguments if key not in parameters or key == 'trial_id']
+        if unknown:
+            raise ProtocolError(f"{label}: unknown trial arguments {', '.join(unknown)}")
+        for key, values in grid.items():
+            if not isinstance(values, list) or not values:
+                raise ProtocolError(f"{label}: grid values of {key} must be a non-empty list")
+        return {
+            'label': label, 'grid': grid, 'let': block.get('let') or {},
+            'arguments': arguments, 'size': math.prod(len(values) for values in grid.values()),
+            'created': {}}
+
+    def _create(self, block, index) -> tuple:
+        """
+        Create the Trial at a position in a block. The position is decoded into grid values in
+        the order of `itertools.product`, so the first parameter is the outermost loop. The
+        conditions, comment, and warnings are kept in the block, so later Trials at the same
+        position reuse the conditions instead of creating and encoding them again.
+
+        :param dict block: block prepared by `_compile_block`
+        :param int index: position in the block
+        :raises ProtocolError: if the Trial cannot be created
+        :rtype: tuple
+        :returns: the Trial and the warnings raised while creating it
+        """
+        created = block['created'].get(index)
+        if created is not None:
+            conditions, comment, warning_messages = created
+            return Trial.from_conditions(index, conditions, comment), warning_messages
+        label = block['label']
+        variables = {}
+        remainder = index
+        for key, values in reversed(block['grid'].items()):
+            remainder, position = divmod(remainder, len(values))
+            variables[key] = values[position]
+        variables = {key: variables[key] for key in block['grid']}
+        for key, value in block['let'].items():
+            variables[key] = self._evaluate(value, variables, label)
+        kwargs = {}
+        for key, value in block['arguments'].items():
+            value = self._evaluate(value, variables, label)
+            if key.endswith('_duration') and value is not None:
+                if not isinstance(value, (int, float)) or value < 0:
+                    raise ProtocolError(f"{label}: {key} must be a duration in ms >= 0")
+                value = Duration(value)
+            kwargs[key] = value
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter("always")
+            try:
+                trial = Trial(index, **kwargs)
+            except (TypeError, ValueError, ZeroDivisionError) as error:
+                raise ProtocolError(f"{label} {variables}: {error}") from error
+        warning_messages = [f"{label} {variables}: {warning.message}" for warning in caught]
+        block['created'][index] = (trial.conditions, trial.comment, warning_messages)
+        return trial, warning_messages
+
+    def __len__(self) -> int:
+        """
+        Number of trials in one repetition.
+
+        :rtype: int
+        """
+        return sum(block['size'] for block in self._blocks)
+
+    def __getitem__(self, index):
+        """
+        Create the Trial at a position of the protocol. Warnings are reported by `check`.
+
+        :param int index: position in one repetition
+        :raises IndexError: if the position is outside the protocol
+        :rtype: Trial
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("protocol index out of range")
+        number = bisect.bisect_right(self._offsets, index) - 1
+        trial, _ = self._create(self._blocks[number], index - self._offsets[number])
+        return trial
+
+    @staticmethod
+    def _evaluate(value, variables, label):
+        """
+        Evaluate an expression (`=...`) or format a string with the variables.
+
+        :param value: value from the definition
+        :param dict variables: grid and derived variables
+        :param str label: position in the protocol, used in messages
+        :rtype: evaluated value
+        """
+        if not isinstance(value, str):
+            return value
+        try:
+            if value.startswith("="):
+                return eval( # pylint: disable=eval-used
+                    value[1:], {'__builtins__': EXPRESSION_FUNCTIONS}, dict(variables))
+            if "{" in value:
+                return value.format(**variables)
+        except Exception as error: # pylint: disable=broad-except
+            raise ProtocolError(f"{label}: cannot evaluate '{value}': {error}") from error
+        return value
+
+    def check(self) -> list:
+        """
+        Create each Trial once, one at a time, to collect the warnings and the duration.
+
+        :raises ProtocolError: if a Trial cannot be created
+        :rtype: list
+        :returns: problems, see `problems`
+        """
+        problems = []
+        duration = 0
+        for block in self._blocks:
+            for index in range(block['size']):
+                trial, warning_messages = self._create(block, index)
+                problems.extend(warning_messages)
+                duration += trial.duration_ms()
+        self._problems = problems
+        self._trial_duration_ms = duration
+        return problems
+
+    @property
+    def problems(self) -> list:
+        """
+        Warnings raised while creating the Trials, for example about patterns that are not
+        seamless.
+
+        :rtype: list
+        """
+        if self._problems is None:
+            self.check()
+        return self._problems
+
+    def sequence(self, seed=None, start=0) -> TrialSequence:
+        """
+        Trials of all repetitions in the order of the protocol.
+
+        :param int seed: seed for the order, overrides the `seed` of the protocol
+        :param int start: position in the sequence to start from
+        :rtype: TrialSequence
+        """
+        return TrialSequence(
+            self, self.repetitions, self.order, seed if seed is not None else self.seed, start)
+
+    def duration_ms(self) -> float:
+        """
+        Nominal duration of the protocol from the start of the first trial.
+
+        :rtype: float
+        """
+        if self._trial_duration_ms is None:
+            self.check()
+        return OPENING_DURATION_MS + self.repetitions * self._trial_duration_ms
+
+    def summary(self) -> dict:
+        """
+        Name, content hash, size, order, nominal duration, and problems of the protocol.
+
+        :rtype: dict
+        """
+        return {
+            'name': self.name, 'digest': self.digest, 'trials': len(self),
+            'repetitions': self.repetitions, 'order': self.order, 'seed': self.seed,
+            'duration_ms': self.duration_ms(), 'problems': self.problems}
@@ -0,0 +1,108 @@
+"""Drift-free timing of consecutive delays"""
+
+import time
+
+class Scheduler():
+    """
+    Schedule delays against absolute deadlines measured from the start of a protocol.
+
+    Each call to `wait` moves the deadline by the requested duration and sleeps until that
+    deadline is reached. Time spent between delays, for example to send messages, and the
+    overshoot of previous delays is therefore absorbed by the next delay, and errors do not
+    accumulate. The overshoot of each delay is recorded.
+    """
+
+    def __init__(self, clock=None, sleep=None, coarse_margin_ns=2_000_000) -> None:
+        """
+        Create a scheduler, call `start` at the beginning of the protocol.
+
+        :param callable clock: monotonic clock in ns, defaults to `time.monotonic_ns`
+        :param callable sleep: function to sleep for a number of seconds, defaults to
+            `time.sleep`
+        :param int coarse_margin_ns: time before the deadline in ns at which the coarse sleep ends
+            and the scheduler yields until the deadline
+        :rtype: None
+        """
+        self.clock = clock
+        self.sleep = sleep
+        self.coarse_margin_ns = coarse_margin_ns
+        self.origin_ns = None
+        self.deadline_ns = None
+        self.overshoot_ns = []
+
+    def _now(self) -> int:
+        """
+        Current time of the clock in ns.
+
+        :rtype: int
+        """
+        return self.clock() if self.clock is not None else time.monotonic_ns()
+
+    def _sleep(self, seconds) -> None:
+        """
+        Sleep, using the configured sleep function.
+
+        :param float seconds: duration in seconds
+        :rtype: None
+        """
+        if self.sleep is not None:
+            self.sleep(seconds)
+        else:
+            time.sleep(seconds)
+
+    def start(self) -> None:
+        """
+        Set the origin of all following deadlines to the current time.
+
+        :rtype: None
+        """
+        self.origin_ns = self._now()
+        self.deadline_ns = self.origin_ns
+        self.overshoot_ns = []
+
+    def elapsed_ms(self) -> float:
+        """
+        Time since `start`.
+
+        :rtype: float
+        """
+        if self.origin_ns is None:
+            return 0.0
+        return (self._now() - self.origin_ns) / 1e6
+
+    def wait(self, duration_ms) -> int:
+        """
+        Sleep until the next deadline, `duration_ms` after the previous one. The first part of
+        the wait is a coarse sleep, the last `coarse_margin_ns` only yield to other tasks.
+
+        :param float duration_ms: duration in ms
+        :rtype: int
+        :returns: overshoot in ns, the time between deadline and the end of the wait
+        """
+        if self.deadline_ns is None:
+            self.start()
+        self.deadline_ns += int(duration_ms * 1e6)
+        remaining = self.deadline_ns - self._now()
+        if remaining > self.coarse_margin_ns:
+            self._sleep((remaining - self.coarse_margin_ns) / 1e9)
+        while self._now() < self.deadline_ns:
+            self._sleep(0)
+        overshoot = self._now() - self.deadline_ns
+        self.overshoot_ns.append(overshoot)
+        return overshoot
+
+    def summary(self) -> dict:
+        """
+        Statistics of the overshoot of all delays since `start`.
+
+        :rtype: dict
+        :returns: number of delays, mean and maximum overshoot in ms, and the difference between
+            the elapsed and the nominal time in ms
+        """
+        count = len(self.overshoot_ns)
+        nominal = (self.deadline_ns - self.origin_ns) / 1e6 if self.origin_ns is not None else 0
+        return {
+            'count': count,
+            'mean_overshoot_ms': sum(self.overshoot_ns) / count / 1e6 if count else 0,
+            'max_overshoot_ms': max(self.overshoot_ns, default=0) / 1e6,
+            'drift_ms': self.elapsed_ms() - nominal}
@@ -0,0 +1,256 @@
+"""
+Batched CSV log handler that splits the log into compressed segments with a trial index.
+"""
+
+import gzip
+import json
+import zlib
+
+from .batched_file_handler import BatchedFileHandler
+
+# placeholder in the queue that starts a new segment
+_ROTATE = object()
+
+class SegmentedFileHandler(BatchedFileHandler):
+    """
+    Write CSV rows into numbered segments `<basename>_<nnn>.csv[.gz]`. A new segment is started
+    by calling `rotate`, for example at the beginning of each protocol run, and whenever a
+    segment exceeds `max_bytes`. A segment without trials, such as the first segment with the
+    rows logged before the first run, is continued by `rotate` instead of left almost empty. Segments that exceed `max_bytes` during a trial are rotated
+    after the `trial-end` row, so that each trial is stored in a single segment.
+
+    Each segment has a sidecar index `<segment>.index` with one JSON object per line. It lists
+    the byte offsets of the rows with a key in `index_keys` together with their shared key. In
+    compressed segments every trial is stored in its own gzip member, so that a single trial can
+    be extracted with `extract` without decompressing the rest of the segment.
+    """
+
+    def __init__(
+        self, basename, compress=True, max_bytes=256*1024*1024, header=None,
+        index_keys=('trial-start', 'trial-end'), **kwargs) -> None:
+        """
+        Open the first segment.
+
+        :param str basename: path of the log file without suffix
+        :param bool compress: compress segments with gzip while they are written
+        :param int max_bytes: start a new segment once a segment is larger than this size and
+            no trial is running
+        :param list header: row that is written at the beginning of each segment
+        :param tuple index_keys: keys of the rows that are added to the index. The first key
+            starts a new gzip member, the last key ends it.
+        :param kwargs: see BatchedFileHandler
+        :rtype: None
+        """
+        self.basename = basename
+        self.compress = compress
+        self.max_bytes = max_bytes
+        self.header = header
+        self.index_keys = index_keys
+        self.segment = 0
+        self.raw_stream = None
+        self.index_stream = None
+        self._needs_header = False
+        self._in_trial = False
+        self._has_trials = False
+        self._rotate_pending = False
+        kwargs.setdefault('mode', 'w')
+        super().__init__(self._segment_name(), **kwargs)
+
+    def _segment_name(self) -> str:
+        """
+        File name of the current segment.
+
+        :rtype: str
+        """
+        suffix = ".csv.gz" if self.compress else ".csv"
+        return f"{self.basename}_{self.segment:03d}{suffix}"
+
+    def _open(self):
+        """
+        Open the current segment and its index.
+
+        :rtype: file object
+        """
+        if self.compress:
+            self.raw_stream = open(self.filename, f"{self.mode}b")
+        else:
+            self.raw_stream = open(self.filename, self.mode, encoding=self.encoding)
+        self.index_stream = open(f"{self.filename}.index", self.mode, encoding='utf-8')
+        self._needs_header = self.header is not None
+        return self._open_member()
+
+    def _open_member(self):
+        """
+        Start a new gzip member in a compressed segment.
+
+        :rtype: file object
+        """
+        if not self.compress:
+            return self.raw_stream
+        return gzip.open(self.raw_stream, 'wt', encoding=self.encoding)
+
+    def _close_member(self) -> None:
+        """
+        Finish the current gzip member.
+
+        :rtype: None
+        """
+        if self.compress:
+            self.stream.close()
+
+    def _close_stream(self) -> None:
+        """
+        Close the current segment and its index.
+
+        :rtype: None
+        """
+        self._close_member()
+        self.raw_stream.close()
+        self.index_stream.close()
+
+    def rotate(self) -> None:
+        """
+        Start a new segment once all records logged so far are written, unless the current
+        segment does not contain a trial yet.
+
+        :rtype: None
+        """
+        with self._queue_lock:
+            self._queue.append(_ROTATE)
+        self._wakeup.set()
+
+    def _rotate_now(self) -> None:
+        """
+        Close the current segment and open the next one.
+
+        :rtype: None
+        """
+        self._close_stream()
+        self._rotate_pending = False
+        self._has_trials = False
+        self.segment += 1
+        self.filename = self._segment_name()
+        self.stream = self._open()
+
+    def _offset(self) -> int:
+        """
+        Current position in the (compressed) segment.
+
+        :rtype: int
+        """
+        self.stream.flush()
+        return self.raw_stream.tell()
+
+    def _write_index(self, row, offset) -> None:
+        """
+        Add a row to the index.
+
+        :param list row: log row with client id, client timestamp, shared key, key, and value
+        :param int offset: byte offset in the segment
+        :rtype: None
+        """
+        self.index_stream.write(json.dumps({
+            'key': row[3], 'shared_key': row[2], 'value': row[4], 'offset': offset}) + "\n")
+
+    def _write_row(self, server_time, row) -> None:
+        """
+        Write a single row, starting and ending gzip members around indexed rows, and start a
+        pending new segment after the row that ends a trial.
+
+        :param int server_time: server timestamp in ns
+        :param list row: logged values
+        :rtype: None
+        """
+        if self._needs_header:
+            header = [server_time] + list(self.header)
+            self.stream.write(f"{self.formatter.format_row(header)}\n")
+            self._needs_header = False
+        key = row[3] if len(row) == 5 else None
+        if key == self.index_keys[0]:
+            self._in_trial = True
+            self._has_trials = True
+            self._close_member()
+            self._write_index(row, self.raw_stream.tell())
+            self.stream = self._open_member()
+        self.stream.write(f"{self.formatter.format_row([server_time] + row)}\n")
+        if key in self.index_keys and key != self.index_keys[0]:
+            if key == self.index_keys[-1]:
+                self._in_trial = False
+                self._close_member()
+                self._write_index(row, self.raw_stream.tell())
+                if self._rotate_pending:
+                    self._rotate_now()
+                else:
+                    self.stream = self._open_member()
+            else:
+                self._write_index(row, self._offset())
+
+    def _write_batch(self, records) -> None:
+        """
+        Write the records row by row and rotate segments where requested or when the segment
+        grows beyond `max_bytes`. Within a trial, the size rotation waits for the end of the
+        trial.
+
+        :param list records: list of logging.LogRecord and rotation requests
+        :rtype: None
+        """
+        for record in records:
+            if record is _ROTATE:
+                if self._has_trials:
+                    self._rotate_now()
+                continue
+            rows = record.msg if getattr(record, 'batch', False) else [record.msg]
+            for row in rows:
+                self._write_row(record.time_ns, row)
+        self.stream.flush()
+        self.index_stream.flush()
+        if self.raw_stream.tell() > self.max_bytes:
+            if self._in_trial:
+                self._rotate_pending = True
+            else:
+                self._rotate_now()
+
+    @staticmethod
+    def extract(segment, shared_key) -> str:
+        """
+        Extract the rows of a single trial from a segment.
+
+        :param str segment: path of the segment
+        :param shared_key: shared key of the `trial-start` row
+        :rtype: str
+        """
+        start, end = None, None
+        with open(f"{segment}.index", "r", encoding="utf-8") as stream:
+            for line in stream:
+                entry = json.loads(line)
+                if str(entry['shared_key']) != str(shared_key):
+                    continue
+                if start is None:
+                    start = entry['offset']
+                end = entry['offset']
+        if start is None:
+            raise KeyError(f"shared key {shared_key} is not in the index of {segment}")
+        with open(segment, "rb") as stream:
+            stream.seek(start)
+            data = stream.read(end - start) if end > start else stream.read()
+        if segment.endswith(".gz"):
+            data = _decompress_members(data)
+        return data.decode("utf-8")
+
+
+def _decompress_members(data) -> bytes:
+    """
+    Decompress consecutive gzip members. Unlike `gzip.decompress` this also returns the content
+    of a member that is still being written.
+
+    :param bytes data: compressed data
+    :rtype: bytes
+    """
+    content = []
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        content.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            break
+        data = decompressor.unused_data
+    return b"".join(content)
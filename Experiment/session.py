@@ -0,0 +1,215 @@
+"""State of one arena that a FlyFlix server drives"""
+
+import logging
+
+from collections import Counter
+from threading import Lock
+
+from .latency_monitor import LatencyMonitor
+from .log_policy import LogPolicy
+from .session_socket import SessionSocket
+
+class Session():
+    """
+    Everything that belongs to one rig: the clients in its Socket.IO rooms, the start flag of its
+    protocol, its metadata, log file, log policy, FicTrac reader, and the running timeline.
+    Several sessions run side by side in one server without sharing any of this state.
+
+    Clients declare one of the `ROLES` when they connect and join the room of that role.
+    Stimulus messages sent through `socket` only reach the `arena` displays, status messages
+    sent with `emit` only reach the `control` panels by default. `observer` clients do not
+    display the stimulus, for example the socket an arena page uses for its start and stop
+    buttons. They only receive messages sent to their role explicitly and are not part of clock
+    synchronisation. The number of messages sent to each role is counted in `message_counts`.
+    """
+
+    ROLES = ("arena", "control", "observer")
+
+    def __init__(self, name, socket_io, fictrac_host='127.0.0.1', fictrac_port=1717) -> None:
+        """
+        Create a session without log and FicTrac reader.
+
+        :param str name: name of the session, selected by clients with `?session=<name>`
+        :param SocketIO socket_io: the Socket.IO server
+        :param str fictrac_host: address FicTrac sends the data of this rig to
+        :param int fictrac_port: port FicTrac sends the data of this rig to
+        :rtype: None
+        """
+        self.name = name
+        self.room = f"session-{name}"
+        self.clients = {}
+        self.message_counts = Counter()
+        self.fictrac_host = fictrac_host
+        self.fictrac_port = fictrac_port
+        self.is_started = False
+        self.run_fictrac = False
+        # number of the current FicTrac run, see `start_fictrac`
+        self.fictrac_run = 0
+        # a protocol is running, and the request of the protocol that waits for the start
+        self.is_running = False
+        self.protocol_token = None
+        self.metadata = {}
+        self.metadata_lock = Lock()
+        self.log_policy = LogPolicy()
+        self.log_handler = None
+        self.log_segmented = False
+        self.logger = logging.getLogger(f"flyflix.session.{name}")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.socket = SessionSocket(socket_io, room=self.room_for("arena"))
+        self.latency_monitor = LatencyMonitor(
+            self.socket.latency, clock_model=self.socket.clock_model)
+        self.socket.latency_monitor = self.latency_monitor
+        self.fictrac_reader = None
+        self.fictrac_archive = None
+        self.timeline = {'timeline': None, 'loaded': False, 'finished': False}
+
+    def room_for(self, role) -> str:
+        """
+        Name of the Socket.IO room for the clients of a role.
+
+        :param str role: one of `ROLES`
+        :rtype: str
+        """
+        return f"{self.room}-{role}"
+
+    def join(self, sid, role) -> str:
+        """
+        Register a client with its role.
+
+        :param str sid: Socket.IO id of the client
+        :param str role: one of `ROLES`
+        :raises ValueError: for an unknown role
+        :rtype: str
+        :returns: the room the client needs to join
+        """
+        if role not in self.ROLES:
+            raise ValueError(f"role must be one of {', '.join(self.ROLES)}")
+        self.clients[sid] = role
+        return self.room_for(role)
+
+    def leave(self, sid):
+        """
+        Forget a client.
+
+        :param str sid: Socket.IO id of the client
+        :rtype: str or None if the client was not registered
+        :returns: the room the client needs to leave
+        """
+        role = self.clients.pop(sid, None)
+        self.socket.forget_client(sid)
+        return self.room_for(role) if role is not None else None
+
+    def role_of(self, sid):
+        """
+        Role of a client.
+
+        :param str sid: Socket.IO id of the client
+        :rtype: str or None if the client is not registered
+        """
+        return self.clients.get(sid)
+
+    def emit(self, event, *args, role="control", **kwargs) -> None:
+        """
+        Send a message to the clients of one or more roles, bypassing the logging and batching of
+        `socket`. Used for status messages such as `condition-update` and for control messages
+        to the arena pages such as `start-triggered`.
+
+        :param str event: name of the event
+        :param args: content of the message, see `SocketIO.emit`
+        :param role: role of the receiving clients, or a tuple of roles
+        :rtype: None
+        """
+        if 'to' in kwargs:
+            self.message_counts[role if isinstance(role, str) else role[0]] += 1
+            self.socket.socket_io.emit(event, *args, **kwargs)
+            return
+        for each_role in (role,) if isinstance(role, str) else role:
+            self.message_counts[each_role] += 1
+            self.socket.socket_io.emit(event, *args, to=self.room_for(each_role), **kwargs)
+
+    def traffic(self) -> dict:
+        """
+        Number of connected clients and of messages sent for each role, including the stimulus
+        messages and `meta-batch` packets that `socket` sent to the arena.
+
+        :rtype: dict
+        """
+        clients = Counter(self.clients.values())
+        messages = self.message_counts.copy()
+        messages["arena"] += self.socket.message_count
+        return {
+            role: {'clients': clients[role], 'messages': messages[role]}
+            for role in self.ROLES}
+
+    def start_fictrac(self):
+        """
+        Start a FicTrac run, unless one is running. The background tasks that log and forward
+        the frames of the run check `reads_fictrac` with the number of their run, so that tasks
+        of a stopped run end even if a new run starts before they noticed the stop.
+
+        :rtype: int or None if FicTrac is already read
+        :returns: number of the new run
+        """
+        if self.run_fictrac:
+            return None
+        self.run_fictrac = True
+        self.fictrac_run += 1
+        return self.fictrac_run
+
+    def stop_fictrac(self) -> None:
+        """
+        End the current FicTrac run.
+
+        :rtype: None
+        """
+        self.run_fictrac = False
+
+    def reads_fictrac(self, run) -> bool:
+        """
+        Check if a FicTrac run is still the current run.
+
+        :param int run: number of the run, see `start_fictrac`
+        :rtype: bool
+        """
+        return self.run_fictrac and run == self.fictrac_run
+
+    def archive_fictrac(self, run, on_frame=None) -> int:
+        """
+        Write each frame of the FicTrac reader to the FicTrac archive, if the session has one,
+        as long as the FicTrac run continues. Frames that arrive after the run ended are not
+        written, so that a task of a stopped run does not write frames again that the task of
+        the next run also writes.
+
+        :param int run: number of the FicTrac run, see `start_fictrac`
+        :param callable on_frame: called with each archived frame
+        :rtype: int
+        :returns: number of frames that were lost because the archive fell behind
+        """
+        subscription = self.fictrac_reader.subscribe(maxsize=1000)
+        try:
+            while self.reads_fictrac(run):
+                frame = subscription.get(timeout=0.1)
+                if frame is None or not self.reads_fictrac(run):
+                    continue
+                if self.fictrac_archive is not None:
+                    self.fictrac_archive.append(frame)
+                if on_frame is not None:
+                    on_frame(frame)
+        finally:
+            self.fictrac_reader.unsubscribe(subscription)
+            if self.fictrac_archive is not None:
+                self.fictrac_archive.flush()
+        return subscription.overflow_count
+
+    def set_log_handler(self, handler) -> None:
+        """
+        Write the log of the session with `handler`.
+
+        :param logging.Handler handler: handler for the log file of the session
+        :rtype: None
+        """
+        if self.log_handler is not None:
+            self.logger.removeHandler(self.log_handler)
+        self.log_handler = handler
+        self.logger.addHandler(handler)
@@ -0,0 +1,238 @@
+"""Socket.IO wrapper that logs server events where they happen"""
+
+import time
+
+class SessionSocket():
+    """
+    Wrapper around the Socket.IO server that is passed to Trials, Conditions, and Durations
+    instead of the Socket.IO server itself.
+
+    Events sent as `meta` messages are written to the log at the time they are sent. Previously
+    they were only stored once a client sent them back as a `dl` message.
+
+    With `batch_meta` set, `meta` messages without further options are collected and sent
+    together as a single `meta-batch` message of `[shared_key, key, value]` entries. The batch
+    is sent by `flush`, which Durations call before they wait, and once `max_batch` messages are
+    collected. Markers with a key in `flush_keys`, by default the start and end of each trial,
+    send the batch right away, so that clients see them when they happen. If clients log the
+    `meta` messages (`echo_meta`), the batch is also sent before any other message, so that the
+    client log keeps the order of all messages.
+
+    The wrapper also keeps an estimate of the one-way latency to each client, see
+    `update_latency`, and a ClockEstimator for the clock of each client in `clocks`. The number
+    of sent messages, counting each `meta-batch` once, is kept in `message_count`.
+
+    With `sync_lead_ms` set, changes of the stimulus (`SYNC_EVENTS`) are not applied on arrival.
+    Each client receives a `sync-at` message with the change and a start time `sync_lead_ms`
+    in the future, converted to the clock of that client with its clock model. The clients apply
+    the change on their first frame at or after the start time, so that several displays change
+    on the same frame. Changes sent within `SYNC_GROUP_NS` of each other share one start time.
+    Clients without a clock model receive the change immediately. Closed loop updates are sent
+    with `emit_immediate`, since a lead would add to the latency of the feedback, but only after
+    the start time of the changes before them, see `wait_for_sync`.
+    """
+
+    SYNC_EVENTS = ("speed", "oscillation", "spatial-setup", "rotate-to", "camera-flip", "fps")
+    SYNC_GROUP_NS = 5_000_000
+    FLUSH_KEYS = ("trial-start", "trial-end")
+
+    def __init__(
+            self, socket_io, log=None, echo_meta=False, batch_meta=False, max_batch=64,
+            room=None, sync_lead_ms=None) -> None:
+        """
+        Wrap a Socket.IO server.
+
+        :param SocketIO socket_io: the Socket.IO server
+        :param callable log: function that stores a server event, called with the shared key, key,
+            and value of each `meta` message
+        :param bool echo_meta: if clients should also log the `meta` messages they receive
+        :param bool batch_meta: collect `meta` messages into `meta-batch` messages
+        :param int max_batch: maximum number of `meta` messages in a batch
+        :param str room: Socket.IO room that receives the messages, None for all clients
+        :param float sync_lead_ms: time between sending a stimulus change and showing it on all
+            displays, None to show changes on arrival
+        :rtype: None
+        """
+        self.socket_io = socket_io
+        self.log = log
+        self.echo_meta = echo_meta
+        self.batch_meta = batch_meta
+        self.max_batch = max_batch
+        self.pending_meta = []
+        self.flush_keys = set(self.FLUSH_KEYS)
+        self.room = room
+        self.message_count = 0
+        self.sync_lead_ms = sync_lead_ms
+        self.sync_at_ns = None
+        self.sync_sent_ns = 0
+        self.sync_models = {}
+        self.latency = {}
+        self.clocks = {}
+
+    def emit(self, event, *args, **kwargs) -> None:
+        """
+        Send a message to the clients in `room`, log `meta` messages. With `batch_meta` set, `meta`
+        messages are collected until the next `flush`. With `sync_lead_ms` set, stimulus changes
+        are sent as `sync-at` messages.
+
+        :param str event: name of the event
+        :param args: content of the message, `(shared_key, key, value)` for `meta` events
+        :param kwargs: see `SocketIO.emit`
+        :rtype: None
+        """
+        if event == "meta" and self.log is not None:
+            shared_key, key, value = args[0]
+            self.log(shared_key, key, value)
+        if event == "meta" and self.batch_meta and not kwargs:
+            self.pending_meta.append(list(args[0]))
+            if len(self.pending_meta) >= self.max_batch or args[0][1] in self.flush_keys:
+                self.flush()
+            return
+        if self.echo_meta or kwargs:
+            self.flush()
+        if self.sync_lead_ms is not None and event in self.SYNC_EVENTS and not kwargs \
+                and self.clocks:
+            self._emit_synced(event, args[0])
+            return
+        self.emit_immediate(event, *args, **kwargs)
+
+    def emit_immediate(self, event, *args, **kwargs) -> None:
+        """
+        Send a message to the clients in `room` to be applied on arrival, also in sync mode.
+
+        :param str event: name of the event
+        :param args: content of the message
+        :param kwargs: see `SocketIO.emit`
+        :rtype: None
+        """
+        if self.room is not None:
+            kwargs.setdefault('to', self.room)
+        self.message_count += 1
+        self.socket_io.emit(event, *args, **kwargs)
+
+    def _emit_synced(self, event, payload) -> None:
+        """
+        Send a stimulus change to each client with the start time of the current group of
+        changes in the clock of that client. A new group logs its start time as `sync-at`.
+
+        :param str event: name of the event, one of `SYNC_EVENTS`
+        :param tuple payload: content of the message, starting with the shared key
+        :rtype: None
+        """
+        now = time.time_ns()
+        if self.sync_at_ns is None or now - self.sync_sent_ns > self.SYNC_GROUP_NS:
+            self.sync_at_ns = now + int(self.sync_lead_ms * 1e6)
+            self.sync_models = {sid: self.clock_model(sid) for sid in list(self.clocks)}
+            if self.log is not None:
+                self.log(payload[0], "sync-at", self.sync_at_ns)
+        self.sync_sent_ns = now
+        for sid, model in self.sync_models.items():
+            self.message_count += 1
+            if model is None:
+                self.socket_io.emit(event, payload, to=sid)
+            else:
+                self.socket_io.emit(
+                    "sync-at", (model.to_client_ms(self.sync_at_ns), event, list(payload)),
+                    to=sid)
+
+    def wait_for_sync(self) -> None:
+        """
+        Wait until the start time of the last stimulus change sent with `sync-at`, so that
+        messages sent with `emit_immediate` afterwards are not shown before that change.
+
+        :rtype: None
+        """
+        if self.sync_at_ns is None:
+            return
+        remaining_ns = self.sync_at_ns - time.time_ns()
+        if remaining_ns > 0:
+            self.sleep(remaining_ns / 1e9)
+
+    def flush(self) -> None:
+        """
+        Send the collected `meta` messages as one `meta-batch` message.
+
+        :rtype: None
+        """
+        if not self.pending_meta:
+            return
+        batch, self.pending_meta = self.pending_meta, []
+        self.message_count += 1
+        if self.room is not None:
+            self.socket_io.emit("meta-batch", batch, to=self.room)
+        else:
+            self.socket_io.emit("meta-batch", batch)
+
+    def log_event(self, shared_key, key, value) -> None:
+        """
+        Write an event to the log without sending it to the clients.
+
+        :param shared_key: shared key of the event
+        :param str key: key of the event
+        :param value: value of the event
+        :rtype: None
+        """
+        if self.log is not None:
+            self.log(shared_key, key, value)
+
+    def update_latency(self, sid, round_trip_ns, weight=0.2) -> None:
+        """
+        Update the latency estimate of a client with a measured round trip time. The one-way
+        latency is half the round trip, smoothed with an exponential moving average.
+
+        :param str sid: client id
+        :param int round_trip_ns: time between sending a message and receiving the answer in ns
+        :param float weight: weight of the new measurement
+        :rtype: None
+        """
+        one_way = round_trip_ns / 2
+        previous = self.latency.get(sid)
+        self.latency[sid] = one_way if previous is None else \
+            previous + weight * (one_way - previous)
+
+    def forget_client(self, sid) -> None:
+        """
+        Remove the latency and clock estimates of a disconnected client.
+
+        :param str sid: client id
+        :rtype: None
+        """
+        self.latency.pop(sid, None)
+        self.clocks.pop(sid, None)
+
+    def clock_model(self, sid):
+        """
+        Current model of a client clock.
+
+        :param str sid: client id
+        :rtype: ClockModel or None if the clock of the client was not measured yet
+        """
+        estimator = self.clocks.get(sid)
+        return estimator.model() if estimator is not None else None
+
+    def expected_latency_ns(self) -> float:
+        """
+        One-way latency to the slowest connected client.
+
+        :rtype: float
+        :returns: latency in ns, 0 if no latency was measured
+        """
+        return max(self.latency.values(), default=0)
+
+    def start_background_task(self, target, *args, **kwargs):
+        """
+        Start a background task, see `SocketIO.start_background_task`.
+
+        :param callable target: function to run in the background
+        :rtype: thread object
+        """
+        return self.socket_io.start_background_task(target, *args, **kwargs)
+
+    def sleep(self, seconds=0) -> None:
+        """
+        Sleep, see `SocketIO.sleep`.
+
+        :param float seconds: duration in seconds
+        :rtype: None
+        """
+        self.socket_io.sleep(seconds)
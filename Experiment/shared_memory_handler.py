@@ -0,0 +1,512 @@
+"""
+Log handler that hands records to a writer process through a shared-memory ring buffer.
+
+The BatchedFileHandler already moves formatting and writing into a background thread, but that
+thread still shares the process, and with eventlet the scheduler, with the stimulus and the
+FicTrac reader. A slow disk, for example a network mount, then delays the stimulus. This handler
+only encodes each record into fixed-size slots of a `multiprocessing.shared_memory` ring buffer.
+A separate writer process, started with `python -m Experiment.shared_memory_handler`, reads the
+ring and passes the records to the actual file handler.
+
+Rows are encoded as the fixed-width records of the binary log, see `BinaryFormatter`. Strings
+are interned, and each record carries the strings that were added to the table for it, so the
+writer process builds the same string table.
+
+The ring relies on the order of stores to shared memory, which Python cannot enforce. It is
+only available on x86, see `ORDERED_STORES`.
+"""
+
+import argparse
+import importlib
+import json
+import logging
+import os
+import platform
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+from multiprocessing import resource_tracker, shared_memory
+
+from .binary_formatter import BinaryFormatter, RECORD_SIZE
+from .binary_log_reader import BinaryLogReader
+
+# stores become visible to other processes in program order, so that the data of a record is
+# written before the position that publishes it
+ORDERED_STORES = platform.machine().lower() in ('x86_64', 'amd64', 'i386', 'i686', 'x86')
+
+# positions of the counters at the beginning of the shared memory. The position written by the
+# logging process and the counters written by the writer process are in separate cache lines.
+_WRITE_POS = 0
+_READ_POS = 64
+_WRITER_DROPPED = 72
+_WRITTEN = 80
+_FLUSHED = 88
+_COUNTER = struct.Struct("<Q")
+_DATA_OFFSET = 128
+
+# head of each record: payload size and kind
+_RECORD_HEAD = struct.Struct("<IB")
+KIND_RECORD = 0
+KIND_ROTATE = 1
+KIND_FLUSH = 2
+KIND_CLOSE = 3
+
+# head of the payload of a log record: batch flag and number of new strings, each new string
+# follows with its size, then the binary records of the rows
+_ROWS_HEAD = struct.Struct("<BI")
+_STRING_HEAD = struct.Struct("<I")
+
+
+class SharedMemoryRing():
+    """
+    Single-producer single-consumer ring buffer of `capacity` slots with `slot_size` bytes in
+    shared memory. A record occupies as many consecutive slots as its size requires.
+
+    The producer only advances the write position and the consumer only the read position, so
+    no lock is shared between the processes. The data of a record is copied before the write
+    position is advanced. Without memory barriers, this only makes the data visible to the
+    consumer before the position on platforms with ordered stores, so the ring refuses to start
+    on other platforms.
+    """
+
+    def __init__(self, capacity=65536, slot_size=128, name=None) -> None:
+        """
+        Create the ring, or attach to an existing ring if `name` is given.
+
+        :param int capacity: number of slots
+        :param int slot_size: size of a slot in bytes
+        :param str name: name of the shared memory of an existing ring
+        :raises RuntimeError: if the platform does not have ordered stores, see `ORDERED_STORES`
+        :rtype: None
+        """
+        if not ORDERED_STORES:
+            raise RuntimeError(
+                f"the shared memory ring needs x86 store ordering, not {platform.machine()}")
+        self.capacity = capacity
+        self.slot_size = slot_size
+        size = _DATA_OFFSET + capacity * slot_size
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+            self.memory.buf[:_DATA_OFFSET] = bytes(_DATA_OFFSET)
+            self.is_owner = True
+        else:
+            self.memory = _attach(name)
+            self.is_owner = False
+        self.name = self.memory.name
+        self.data = self.memory.buf[_DATA_OFFSET:size]
+
+    def get(self, position) -> int:
+        """
+        Read a counter.
+
+        :param int position: position of the counter, for example `_WRITE_POS`
+        :rtype: int
+        """
+        return _COUNTER.unpack_from(self.memory.buf, position)[0]
+
+    def set(self, position, value) -> None:
+        """
+        Write a counter.
+
+        :param int position: position of the counter
+        :param int value: new value
+        :rtype: None
+        """
+        _COUNTER.pack_into(self.memory.buf, position, value)
+
+    def used(self) -> int:
+        """
+        Number of slots that were written but not read yet.
+
+        :rtype: int
+        """
+        return self.get(_WRITE_POS) - self.get(_READ_POS)
+
+    def slots(self, size) -> int:
+        """
+        Number of slots for a record.
+
+        :param int size: size of the payload in bytes
+        :rtype: int
+        """
+        return -(-(_RECORD_HEAD.size + size) // self.slot_size)
+
+    def push(self, kind, payload) -> bool:
+        """
+        Append a record, unless there are not enough free slots. Only one thread may push.
+
+        :param int kind: kind of the record, for example `KIND_RECORD`
+        :param bytes payload: content of the record
+        :rtype: bool
+        :returns: False if the ring is full
+        """
+        needed = self.slots(len(payload))
+        write = self.get(_WRITE_POS)
+        if write - self.get(_READ_POS) + needed > self.capacity:
+            return False
+        self._copy_in(write, _RECORD_HEAD.pack(len(payload), kind) + payload)
+        self.set(_WRITE_POS, write + needed)
+        return True
+
+    def pop(self):
+        """
+        Remove the oldest record. Only one thread may pop.
+
+        :rtype: tuple or None if the ring is empty
+        :returns: kind and payload of the record
+        """
+        read = self.get(_READ_POS)
+        if read == self.get(_WRITE_POS):
+            return None
+        size, kind = _RECORD_HEAD.unpack(self._copy_out(read, _RECORD_HEAD.size))
+        payload = self._copy_out(read, _RECORD_HEAD.size + size)[_RECORD_HEAD.size:]
+        self.set(_READ_POS, read + self.slots(size))
+        return kind, payload
+
+    def _copy_in(self, slot, data) -> None:
+        """
+        Copy data into the ring, starting at a slot and wrapping around at the end.
+        """
+        total = len(self.data)
+        start = (slot % self.capacity) * self.slot_size
+        first = min(len(data), total - start)
+        self.data[start:start + first] = data[:first]
+        if first < len(data):
+            self.data[:len(data) - first] = data[first:]
+
+    def _copy_out(self, slot, size) -> bytes:
+        """
+        Copy data out of the ring, starting at a slot and wrapping around at the end.
+        """
+        total = len(self.data)
+        start = (slot % self.capacity) * self.slot_size
+        first = min(size, total - start)
+        data = bytes(self.data[start:start + first])
+        if first < size:
+            data += bytes(self.data[:size - first])
+        return data
+
+    def close(self) -> None:
+        """
+        Detach from the shared memory and remove it if this ring created it.
+
+        :rtype: None
+        """
+        self.data.release()
+        self.memory.close()
+        if self.is_owner:
+            self.memory.unlink()
+
+
+def _attach(name) -> shared_memory.SharedMemory:
+    """
+    Attach to shared memory created by another process, without letting the resource tracker
+    of this process remove it at exit.
+
+    :param str name: name of the shared memory
+    :rtype: shared_memory.SharedMemory
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13
+        memory = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(memory._name, "shared_memory") # pylint: disable=protected-access
+        return memory
+
+
+def _encode_rows(batch, strings, data) -> bytes:
+    """
+    Payload of a log record.
+
+    :param bool batch: True if the record contains a list of rows
+    :param list strings: strings that were added to the string table for the rows
+    :param bytes data: binary records of the rows, see `BinaryFormatter.format_row`
+    :rtype: bytes
+    """
+    parts = [_ROWS_HEAD.pack(batch, len(strings))]
+    for text in strings:
+        encoded = text.encode("utf-8", "surrogatepass")
+        parts.append(_STRING_HEAD.pack(len(encoded)))
+        parts.append(encoded)
+    parts.append(data)
+    return b"".join(parts)
+
+
+def _decode_rows(reader, payload) -> tuple:
+    """
+    Rows of a log record. The strings of the record are added to the string table of the reader.
+
+    :param BinaryLogReader reader: reader with the string table of the writer process
+    :param bytes payload: payload from `_encode_rows`
+    :rtype: tuple
+    :returns: batch flag and the rows, each starting with the server timestamp
+    """
+    batch, count = _ROWS_HEAD.unpack_from(payload)
+    offset = _ROWS_HEAD.size
+    for _ in range(count):
+        size = _STRING_HEAD.unpack_from(payload, offset)[0]
+        offset += _STRING_HEAD.size
+        reader.strings.append(payload[offset:offset + size].decode("utf-8", "surrogatepass"))
+        offset += size
+    rows = [
+        reader.decode_row(payload, start) for start in range(offset, len(payload), RECORD_SIZE)]
+    return bool(batch), rows
+
+
+def _class_path(cls) -> str:
+    """
+    Importable name of a class.
+
+    :param type cls: class
+    :rtype: str
+    """
+    return f"{cls.__module__}:{cls.__qualname__}"
+
+
+def _import_class(path):
+    """
+    Import a class by its name from `_class_path`.
+
+    :param str path: name of the class
+    :rtype: type
+    """
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+class SharedMemoryHandler(logging.Handler):
+    """
+    Subclass of logging.Handler that passes records through a SharedMemoryRing to a writer
+    process. The writer process creates `handler_class` with the given arguments and handles
+    the records there, so that formatting, compression, and disk writes never block the logging
+    process.
+
+    Records that arrive while the ring is full are dropped and counted in `dropped_count`,
+    together with the records the file handler in the writer process dropped. `stats` reports
+    the fill level of the ring and its high-water mark, which shows how close the logging came
+    to dropping records.
+    """
+
+    def __init__(
+        self, handler_class, *args, formatter_class=None, capacity=65536, slot_size=128,
+        flush_timeout=5.0, poll_interval=0.01, **kwargs) -> None:
+        """
+        Create the ring buffer and start the writer process.
+
+        :param type handler_class: log handler that writes the records in the writer process,
+            for example SegmentedFileHandler
+        :param args: positional arguments for `handler_class`, for example the file name
+        :param type formatter_class: formatter for `handler_class`, None for its default
+        :param int capacity: number of slots in the ring
+        :param int slot_size: size of a slot in bytes, records larger than a slot use several
+        :param float flush_timeout: maximum time in seconds `flush` waits for the writer
+        :param float poll_interval: time in seconds the writer waits when the ring is empty
+        :param kwargs: keyword arguments for `handler_class`, they need to be JSON serializable
+        :rtype: None
+        """
+        super().__init__()
+        self.ring = SharedMemoryRing(capacity, slot_size)
+        self.encoder = BinaryFormatter()
+        self.flush_timeout = flush_timeout
+        self.ring_dropped_count = 0
+        self.high_water = 0
+        self._flush_count = 0
+        self._push_lock = threading.Lock()
+        self._closed = False
+        spec = {
+            'handler': _class_path(handler_class), 'args': list(args), 'kwargs': kwargs,
+            'formatter': _class_path(formatter_class) if formatter_class is not None else None}
+        self.process = subprocess.Popen([
+            sys.executable, "-m", "Experiment.shared_memory_handler",
+            self.ring.name, str(capacity), str(slot_size), json.dumps(spec),
+            "--poll-interval", str(poll_interval), "--parent", str(os.getpid())])
+
+    @property
+    def dropped_count(self) -> int:
+        """
+        Number of records that were dropped because the ring or the writer queue was full.
+
+        :rtype: int
+        """
+        writer_dropped = self.ring.get(_WRITER_DROPPED) if not self._closed else 0
+        return self.ring_dropped_count + writer_dropped
+
+    def emit(self, record) -> None:
+        """
+        Encode a record into the ring. The server time is taken here, as in the
+        BatchedFileHandler. Strings that are new in a dropped record are removed from the string
+        table again, since the writer process never receives them.
+
+        :param logging.LogRecord record: record to be logged
+        :rtype: None
+        """
+        batch = getattr(record, 'batch', False)
+        server_time = time.time_ns()
+        try:
+            data = b"".join(
+                self.encoder.format_row(server_time, row)
+                for row in (record.msg if batch else [record.msg]))
+        except (TypeError, ValueError):
+            self.encoder.forget_strings(self.encoder.pop_strings())
+            self.handleError(record)
+            return
+        strings = self.encoder.pop_strings()
+        if not self._push(KIND_RECORD, _encode_rows(batch, strings, data)):
+            self.encoder.forget_strings(strings)
+            self.ring_dropped_count += 1
+
+    def _push(self, kind, payload, wait=False) -> bool:
+        """
+        Append a record to the ring and track the high-water mark.
+
+        :param int kind: kind of the record
+        :param bytes payload: content of the record
+        :param bool wait: wait for free slots instead of failing, used for control records
+        :rtype: bool
+        """
+        deadline = time.monotonic() + self.flush_timeout
+        while True:
+            with self._push_lock:
+                if self._closed:
+                    return False
+                is_pushed = self.ring.push(kind, payload)
+                if is_pushed:
+                    self.high_water = max(self.high_water, self.ring.used())
+                    return True
+            if not wait or time.monotonic() > deadline or self.process.poll() is not None:
+                return False
+            time.sleep(0.005)
+
+    def rotate(self) -> None:
+        """
+        Start a new segment once all records logged so far are written, see
+        `SegmentedFileHandler.rotate`.
+
+        :rtype: None
+        """
+        self._push(KIND_ROTATE, b"", wait=True)
+
+    def flush(self) -> None:
+        """
+        Wait until the writer process wrote all records logged so far, or `flush_timeout`
+        passed.
+
+        :rtype: None
+        """
+        self._flush_count += 1
+        if not self._push(KIND_FLUSH, _COUNTER.pack(self._flush_count), wait=True):
+            return
+        deadline = time.monotonic() + self.flush_timeout
+        while self.ring.get(_FLUSHED) < self._flush_count:
+            if time.monotonic() > deadline or self.process.poll() is not None:
+                return
+            time.sleep(0.005)
+
+    def stats(self) -> dict:
+        """
+        Fill level and counters of the ring.
+
+        :rtype: dict
+        """
+        return {
+            'capacity': self.ring.capacity, 'slot_size': self.ring.slot_size,
+            'used': self.ring.used(), 'high_water': self.high_water,
+            'dropped': self.ring_dropped_count, 'writer_dropped': self.ring.get(_WRITER_DROPPED),
+            'written': self.ring.get(_WRITTEN)}
+
+    def close(self) -> None:
+        """
+        Let the writer process write the remaining records and close the file, then remove the
+        ring.
+
+        :rtype: None
+        """
+        if self._closed:
+            return
+        self._push(KIND_CLOSE, b"", wait=True)
+        try:
+            self.process.wait(self.flush_timeout)
+        except subprocess.TimeoutExpired:
+            self.process.terminate()
+        with self._push_lock:
+            self._closed = True
+            self.ring.close()
+        super().close()
+
+
+def write_ring(ring, handler, poll_interval=0.01, parent=None) -> None:
+    """
+    Writer loop: pass the records from the ring to the handler until a close record arrives or
+    the logging process ends.
+
+    :param SharedMemoryRing ring: ring attached to the memory of the logging process
+    :param logging.Handler handler: handler that writes the records
+    :param float poll_interval: time in seconds to wait when the ring is empty
+    :param int parent: process id of the logging process
+    :rtype: None
+    """
+    reader = BinaryLogReader(ring.name, strings=[])
+    written = 0
+    while True:
+        entry = ring.pop()
+        if entry is None:
+            ring.set(_WRITTEN, written)
+            ring.set(_WRITER_DROPPED, getattr(handler, "dropped_count", 0))
+            if parent is not None and os.getppid() != parent:
+                break
+            time.sleep(poll_interval)
+            continue
+        kind, payload = entry
+        if kind == KIND_RECORD:
+            batch, rows = _decode_rows(reader, payload)
+            if rows:
+                msg = [row[1:] for row in rows] if batch else rows[0][1:]
+                record = logging.makeLogRecord({
+                    'msg': msg, 'batch': batch, 'time_ns': rows[0][0], 'levelno': logging.INFO,
+                    'levelname': "INFO"})
+                handler.handle(record)
+            written += len(rows)
+        elif kind == KIND_ROTATE:
+            rotate = getattr(handler, "rotate", None)
+            if rotate is not None:
+                rotate()
+        elif kind == KIND_FLUSH:
+            handler.flush()
+            ring.set(_WRITTEN, written)
+            ring.set(_WRITER_DROPPED, getattr(handler, "dropped_count", 0))
+            ring.set(_FLUSHED, _COUNTER.unpack(payload)[0])
+        elif kind == KIND_CLOSE:
+            break
+    handler.close()
+    ring.set(_WRITTEN, written)
+
+
+def main() -> None:
+    """
+    Writer process, started by SharedMemoryHandler.
+    """
+    parser = argparse.ArgumentParser(description="Write FlyFlix log records from shared memory")
+    parser.add_argument("name", help="name of the shared memory")
+    parser.add_argument("capacity", type=int, help="number of slots")
+    parser.add_argument("slot_size", type=int, help="size of a slot in bytes")
+    parser.add_argument("spec", help="JSON with handler, args, kwargs, and formatter")
+    parser.add_argument("--poll-interval", type=float, default=0.01)
+    parser.add_argument("--parent", type=int, help="process id of the logging process")
+    args = parser.parse_args()
+    spec = json.loads(args.spec)
+    handler = _import_class(spec['handler'])(*spec['args'], **spec['kwargs'])
+    if spec['formatter'] is not None:
+        handler.setFormatter(_import_class(spec['formatter'])())
+    ring = SharedMemoryRing(args.capacity, args.slot_size, name=args.name)
+    try:
+        write_ring(ring, handler, args.poll_interval, args.parent)
+    finally:
+        ring.close()
+
+
+if __name__ == "__main__":
+    main()
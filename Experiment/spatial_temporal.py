@@ -7,12 +7,20 @@ import math
 import time
 
 from . import Duration
+from .interned import Interned
 
-class SpatialTemporal():
+class SpatialTemporal(Interned):
     """
-    Description of spatial and temporal stimulation.
+    Description of spatial and temporal stimulation. Descriptions are immutable, and equal
+    descriptions are the same object. The payloads of the messages that set up and move the
+    pattern are computed once when the description is created.
     """
 
+    _fields = (
+        'bar_deg', 'space_deg', 'rotate_deg_hz', 'start_mask_deg', 'end_mask_deg',
+        'fg_color', 'bg_color', 'osc_freq', 'osc_width', 'bar_height', 'flip_camera')
+    __slots__ = _fields + ('_spatial_payload', '_speed_rad', '_oscillation_payload')
+
     def __init__(self,
         bar_deg=60, space_deg=60, 
         rotate_deg_hz=0, 
@@ -57,6 +65,16 @@ class SpatialTemporal():
         self.osc_width = osc_width
         self.bar_height = bar_height
         self.flip_camera = flip_camera
+        self._spatial_payload = (
+            math.radians(bar_deg),
+            math.radians(space_deg),
+            math.radians(start_mask_deg),
+            math.radians(end_mask_deg),
+            fg_color,
+            bg_color,
+            bar_height)
+        self._speed_rad = math.radians(rotate_deg_hz) if rotate_deg_hz is not None else None
+        self._oscillation_payload = (osc_freq, osc_width)
 
     def is_bar_sweep(self) -> bool:
         """
@@ -130,11 +148,11 @@ class SpatialTemporal():
         :rtype: None
         """
         shared_key = time.time_ns()
-        socket_io.emit('speed', (shared_key, math.radians(self.rotate_deg_hz)))
+        socket_io.emit('speed', (shared_key, self._speed_rad))
 
     def trigger_oscillation(self, socket_io) -> None:
         shared_key = time.time_ns()
-        socket_io.emit('oscillation', (shared_key, self.osc_freq, self.osc_width))
+        socket_io.emit('oscillation', (shared_key, *self._oscillation_payload))
 
     def trigger_stop(self, socket_io) -> None:
         """
@@ -156,15 +174,7 @@ class SpatialTemporal():
         :rtype: None
         """
         shared_key = time.time_ns()
-        socket_io.emit('spatial-setup', (
-            shared_key,
-            math.radians(self.bar_deg),
-            math.radians(self.space_deg),
-            math.radians(self.start_mask_deg),
-            math.radians(self.end_mask_deg),
-            self.fg_color,
-            self.bg_color,
-            self.bar_height))
+        socket_io.emit('spatial-setup', (shared_key, *self._spatial_payload))
         socket_io.emit('camera-flip', (shared_key, self.flip_camera))
 
     def trigger_sweep_start_position(self, socket_io) -> None:
@@ -201,6 +211,15 @@ class SpatialTemporal():
         :rtype: None
         """
         shared_key = time.time_ns()
+        socket_io.emit('rotate-to', (shared_key, self.closedloop_start_rad()))
+
+    def closedloop_start_rad(self) -> float:
+        """
+        Starting position for a closed loop experiment, see `trigger_closedloop_start_position`.
+
+        :rtype: float
+        :returns: angle in radians
+        """
         start_angle = 0
         if self.is_bar_sweep():
             start_angle = 180
@@ -210,4 +229,4 @@ class SpatialTemporal():
             start_angle = 112
         else:
             warnings.warn("not 2 item pattern. Rotate to 0")
-        socket_io.emit('rotate-to', (shared_key, math.radians(start_angle)))
+        return math.radians(start_angle)
@@ -4,9 +4,18 @@ import warnings
 import time
 
 from . import Duration
+from .interned import Interned
 
-class SweepCondition():
-    """ Description of a condition with a single stimulus sweep."""
+class SweepCondition(Interned):
+    """
+    Description of a condition with a single stimulus sweep. Conditions are immutable, and equal
+    conditions are the same object.
+    """
+
+    __slots__ = (
+        'spatial_temporal', 'pretrial_duration', 'posttrial_duration', 'fps', 'trial_duration',
+        'is_bar_sweep')
+    _fields = __slots__[:4]
 
     def __init__(
         self,
@@ -30,6 +39,8 @@ class SweepCondition():
         if fps <=0 or fps > 60:
             warnings.warn(f"fps ({fps}) outside meaningful constraints")
         self.spatial_temporal = spatial_temporal
+        self.trial_duration = None
+        self.is_bar_sweep = None
         if self.spatial_temporal.is_bar_sweep():
             self.trial_duration = self.spatial_temporal.get_bar_sweep_duration()
             self.is_bar_sweep = True
@@ -40,6 +51,15 @@ class SweepCondition():
         self.posttrial_duration = posttrial_duration
         self.fps = fps
 
+    def duration_ms(self) -> float:
+        """
+        Nominal duration of the condition, including pre-trial and post-trial.
+
+        :rtype: float
+        """
+        return self.pretrial_duration.time_duration + self.trial_duration.time_duration \
+            + self.posttrial_duration.time_duration
+
     def trigger_fps(self, socket_io):
         """
         Set the client frame rate.
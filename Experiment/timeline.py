@@ -0,0 +1,103 @@
+"""Compile trials into a timeline that the client executes on its own frame clock"""
+
+import time
+
+from .scheduler import Scheduler
+
+class Timeline():
+    """
+    List of `(offset_ms, event, args)` entries compiled from trials.
+
+    To compile, the trials are triggered with the timeline in place of the Socket.IO server.
+    The timeline records each message with its offset instead of sending it, and its scheduler
+    advances a virtual clock instead of sleeping. The resulting timeline is sent to the client in
+    advance and executed there by `timeline.js`.
+    """
+
+    # Conditions check this flag to refuse steps that need a live connection
+    is_compiling = True
+
+    def __init__(self) -> None:
+        """
+        Create an empty timeline at offset 0.
+
+        :rtype: None
+        """
+        # in ms, so that the ID survives the round trip through JavaScript numbers
+        self.timeline_id = time.time_ns() // 1_000_000
+        self.entries = []
+        self.now_ns = 0
+        self.scheduler = Scheduler(clock=self._clock, sleep=self._advance, coarse_margin_ns=0)
+        self.scheduler.start()
+
+    @classmethod
+    def compile(cls, trials):
+        """
+        Compile a list of trials.
+
+        :param list trials: trials in the order they are executed
+        :rtype: Timeline
+        """
+        timeline = cls()
+        for trial in trials:
+            trial.trigger(timeline)
+        return timeline
+
+    def _clock(self) -> int:
+        """
+        Current offset of the timeline in ns.
+
+        :rtype: int
+        """
+        return self.now_ns
+
+    def _advance(self, seconds) -> None:
+        """
+        Advance the virtual clock instead of sleeping.
+
+        :param float seconds: time in seconds
+        :rtype: None
+        """
+        self.now_ns += int(seconds * 1e9)
+
+    def emit(self, event, *args, **kwargs) -> None: # pylint: disable=unused-argument
+        """
+        Record a message at the current offset.
+
+        :param str event: name of the event
+        :param args: content of the message, see `SocketIO.emit`
+        :rtype: None
+        """
+        if not args:
+            arguments = []
+        elif isinstance(args[0], tuple):
+            arguments = list(args[0])
+        else:
+            arguments = [args[0]]
+        self.entries.append((self.now_ns / 1e6, event, arguments))
+
+    def sleep(self, seconds=0) -> None:
+        """
+        Advance the virtual clock, see `SocketIO.sleep`.
+
+        :param float seconds: duration in seconds
+        :rtype: None
+        """
+        self._advance(seconds)
+
+    @property
+    def duration_ms(self) -> float:
+        """
+        Length of the timeline.
+
+        :rtype: float
+        """
+        return self.now_ns / 1e6
+
+    def as_list(self) -> list:
+        """
+        Entries in the format expected by the client.
+
+        :rtype: list
+        """
+        return [list(entry) for entry in self.entries]
@@ -6,7 +6,12 @@ import time
 from . import Duration, SpatialTemporal, OpenLoopCondition, SweepCondition, ClosedLoopCondition
 
 class Trial():
-    """Single trial, the combination of an open loop and a closed loop condition."""
+    """
+    Single trial, the combination of an open loop and a closed loop condition. The open loop
+    conditions are shared with equal trials, see `Interned`.
+    """
+
+    __slots__ = ('trial_id', 'comment', 'conditions')
 
     def __init__(self,
                  trial_id,
@@ -14,6 +19,8 @@ class Trial():
                  start_mask_deg=0, end_mask_deg=0,
                  openloop_duration=Duration(3000), sweep=None,
                  closedloop_bar_deg = None, closedloop_duration=Duration(5000), gain=1,
+                 predict=False, predict_alpha=0.85, predict_beta=0.05, predict_latency_ms=None,
+                 closedloop_mode="rate", closedloop_offset_deg=None,
                  fg_color=0x00ff00, bg_color=0x000000,
                  osc_freq=0, osc_width=0,
                  bar_height=0.8,
@@ -35,6 +42,15 @@ class Trial():
             in degree
         :param Duration closedloop_duration: duration of the closed loop condition
         :param float gain: multiplier for orientation change read from the FicTrac instance
+        :param bool predict: compensate the latency in the closed loop condition by predicting
+            the heading, see `ClosedLoopCondition`
+        :param float predict_alpha: alpha of the filter for the predicted heading
+        :param float predict_beta: beta of the filter for the predicted heading
+        :param float predict_latency_ms: latency to compensate in ms, None uses the measured
+            latency
+        :param str closedloop_mode: `rate` streams the rotation speed, `absolute` sends the panel
+            angle, see `ClosedLoopCondition`
+        :param float closedloop_offset_deg: panel angle for a heading of 0 in `absolute` mode
         :param float fps: client frame rate
         :param Duration pretrial_duration: duration of the pre-trial, where the stimulus is shown
             but not animated. Applies to open loop and closed loop conditions.
@@ -49,7 +65,7 @@ class Trial():
             space_deg = bar_deg
         if 360 % (bar_deg + space_deg) != 0:
             warnings.warn(f"Pattern is not seamless: Bars are {bar_deg}°, space is {space_deg}°.")
-        self.conditions = []
+        conditions = []
         self.trial_id = trial_id
         self.comment = comment
 
@@ -68,13 +84,13 @@ class Trial():
                 trial_duration=openloop_duration,
                 fps=fps,
                 pretrial_duration=pretrial_duration, posttrial_duration=posttrial_duration)
-            self.conditions.append(olc)
+            conditions.append(olc)
         elif sweep is not None:
             olc = SweepCondition(
                 spatial_temporal=openloop_spatial_temporal,
                 sweep_count=1, fps=fps,
                 pretrial_duration=pretrial_duration, posttrial_duration=posttrial_duration)
-            self.conditions.append(olc)
+            conditions.append(olc)
         else:
             warnings.warn("Either sweep or duration needs to be set")
 
@@ -89,9 +105,38 @@ class Trial():
             clc = ClosedLoopCondition(
                 spatial_temporal=closedloop_spatial_temporal, trial_duration=closedloop_duration,
                 gain=gain, fps=fps,
-                pretrial_duration=pretrial_duration, posttrial_duration=posttrial_duration)
-            self.conditions.append(clc)
+                pretrial_duration=pretrial_duration, posttrial_duration=posttrial_duration,
+                predict=predict, alpha=predict_alpha, beta=predict_beta,
+                latency_ms=predict_latency_ms,
+                mode=closedloop_mode, offset_deg=closedloop_offset_deg)
+            conditions.append(clc)
+        self.conditions = tuple(conditions)
+
+
+    @classmethod
+    def from_conditions(cls, trial_id, conditions, comment=None):
+        """
+        Create a trial from the conditions of an existing trial, without creating the conditions
+        again.
+
+        :param str trial_id: unique identifier for trial, preferably an integer number
+        :param tuple conditions: conditions of the trial
+        :param str comment: additional comment that can be logged with the data
+        :rtype: Trial
+        """
+        trial = cls.__new__(cls)
+        trial.trial_id = trial_id
+        trial.comment = comment
+        trial.conditions = tuple(conditions)
+        return trial
 
+    def duration_ms(self) -> float:
+        """
+        Nominal duration of all conditions of the trial.
+
+        :rtype: float
+        """
+        return sum(condition.duration_ms() for condition in self.conditions)
 
     def trigger(self, socket_io) -> None:
         """
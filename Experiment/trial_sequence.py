@@ -0,0 +1,166 @@
+"""Order of the trials in a protocol, shared by live runs, timelines, and dry runs"""
+
+import itertools
+import random
+import time
+
+from .duration import Duration
+
+# black screen before the first trial
+OPENING_DURATION_MS = 100
+
+class TrialSequence():
+    """
+    Repetitions of a block of trials in sequential, shuffled, or counterbalanced order.
+
+    The block can be a list of Trials or any object that creates the Trial at a position on
+    access, such as a `Protocol`. Trials are only accessed while iterating, so that a long
+    sequence never holds more than one Trial at a time. The order of each repetition only depends
+    on the seed and the repetition number, which makes it possible to resume a sequence at any
+    position with the same order.
+    """
+
+    ORDERS = ("sequential", "shuffle", "latin-square")
+
+    def __init__(self, block, repetitions=1, order="sequential", seed=None, start=0) -> None:
+        """
+        Define a sequence.
+
+        In `shuffle` order, each repetition is a random permutation of the block. In
+        `latin-square` order, repetition `r` follows row `seed + r` of a balanced Latin square,
+        so that each trial appears at each position, and follows each other trial equally often
+        across `len(block)` repetitions (`2 * len(block)` for an odd block size). Use a different
+        seed for each fly to counterbalance the order across flies.
+
+        :param block: trials of one repetition, supports `len()` and indexing
+        :param int repetitions: number of repetitions of the block
+        :param str order: one of `ORDERS`
+        :param int seed: seed for the order, drawn at random if not given
+        :param int start: position in the sequence to start from, for example to resume an
+            interrupted experiment
+        :raises ValueError: for an unknown order or a start outside the sequence
+        :rtype: None
+        """
+        if order not in self.ORDERS:
+            raise ValueError(f"order must be one of {', '.join(self.ORDERS)}")
+        self.block = block
+        self.repetitions = repetitions
+        self.order = order
+        if seed is None:
+            seed = random.randrange(2**32) if order == "shuffle" else 0
+        self.seed = seed
+        if not 0 <= start <= len(self):
+            raise ValueError(f"start must be between 0 and {len(self)}")
+        self.start = start
+
+    def __len__(self) -> int:
+        """
+        Number of trials in all repetitions.
+
+        :rtype: int
+        """
+        return len(self.block) * self.repetitions
+
+    def positions(self, repetition):
+        """
+        Positions in the block in the order of a repetition.
+
+        :param int repetition: number of the repetition
+        :rtype: iterable of int
+        """
+        size = len(self.block)
+        if self.order == "shuffle":
+            positions = list(range(size))
+            random.Random(f"{self.seed}:{repetition}").shuffle(positions)
+            return positions
+        if self.order == "latin-square":
+            return (latin_square(size, self.seed + repetition, column)
+                for column in range(size))
+        return range(size)
+
+    def __iter__(self):
+        """
+        Iterate from `start` to the end of the sequence.
+
+        :rtype: iterator of tuples
+        :returns: index in the sequence, repetition number, and Trial
+        """
+        size = len(self.block)
+        if size == 0:
+            return
+        first_repetition, skip = divmod(self.start, size)
+        for repetition in range(first_repetition, self.repetitions):
+            offset = skip if repetition == first_repetition else 0
+            positions = itertools.islice(self.positions(repetition), offset, None)
+            for index, position in enumerate(positions, repetition * size + offset):
+                yield index, repetition, self.block[position]
+
+    def as_dict(self) -> dict:
+        """
+        Parameters of the sequence, needed to reproduce or resume it.
+
+        :rtype: dict
+        """
+        return {
+            'trials': len(self), 'repetitions': self.repetitions, 'order': self.order,
+            'seed': self.seed, 'start': self.start}
+
+
+def latin_square(size, row, column) -> int:
+    """
+    Element of a balanced Latin square (Williams design), computed without building the square.
+
+    The first row is 0, 1, size-1, 2, size-2, …; the other rows add the row number modulo
+    `size`. For an odd size, rows `size` to `2*size-1` are the reversed rows `0` to `size-1`.
+
+    :param int size: number of conditions
+    :param int row: row of the square, taken modulo `size` (`2*size` for an odd size)
+    :param int column: column of the square
+    :rtype: int
+    """
+    if size % 2 == 1 and (row // size) % 2 == 1:
+        column = size - 1 - column
+    if column == 0:
+        value = 0
+    elif column % 2 == 1:
+        value = (column + 1) // 2
+    else:
+        value = size - column // 2
+    return (value + row) % size
+
+
+def play_trials(target, sequence, progress=None, is_running=None) -> bool:
+    """
+    Show a short black screen and then trigger the trials of a sequence through `target`,
+    which can be the Socket.IO server, a `Timeline`, or a `DryRun`.
+
+    :param socket target: receives the messages of the trials
+    :param TrialSequence sequence: trials in the order they are run
+    :param callable progress: called with a progress message before each trial, defaults to
+        sending `condition-update` through `target`
+    :param callable is_running: checked after each trial, the run stops once it returns False
+    :rtype: bool
+    :returns: False if the run was stopped
+    """
+    total = len(sequence)
+    if progress is None:
+        progress = lambda message: target.emit("condition-update", message)
+    opening_black_screen = Duration(OPENING_DURATION_MS)
+    opening_black_screen.trigger_delay(target)
+    current_repetition = None
+    try:
+        for index, repetition, current_trial in sequence:
+            if repetition != current_repetition:
+                target.emit("meta", (time.time_ns(), "block-repetition", repetition))
+                current_repetition = repetition
+            progress(f"Condition {index + 1} of {total}")
+            current_trial.set_id(index + 1)
+            current_trial.trigger(target)
+            if is_running is not None and not is_running():
+                return False
+    finally:
+        # send the messages that `target` collected, see `SessionSocket.flush`
+        flush = getattr(target, "flush", None)
+        if flush is not None:
+            flush()
+    return True
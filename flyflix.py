@@ -1,18 +1,14 @@
 #!/bin/env python
 
-import socket
 import time
-import logging
-import random
 import inspect
 import warnings
 import json
 import netifaces
-from threading import Lock
+from functools import partial
 
 
 from pathlib import Path
-from logging import FileHandler
 
 import yaml
 import datetime
@@ -23,31 +19,23 @@ import eventlet
 
 
 from flask import Flask, render_template, request, url_for
-from flask.logging import default_handler
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
 
 from engineio.payload import Payload
 
-from Experiment import Duration, Trial, CsvFormatter
+from Experiment import CsvFormatter, BinaryFileHandler, SegmentedFileHandler, \
+    LogPolicy, FicTracReader, FicTracArchive, Scheduler, Timeline, \
+    ClockEstimator, Protocol, ProtocolError, Session, play_trials
+from Experiment.shared_memory_handler import ORDERED_STORES, SharedMemoryHandler
 
 app = Flask(__name__)
 
-start = False
 SWEEPCOUNTERREACHED = False
-RUN_FICTRAC = False
-
-# metadata variable - DO NOT CHANGE
-# use control panel to update values or defaultsconfig.yaml to set defaults
-metadata = {}
-metadata_lock = Lock()
 
+# Clients that still send one `dl` message per log entry need a high packet limit, the arena
+# sends its log entries in `dl-batch` messages.
 Payload.max_decode_packets = 1500
 
-# metadata variable - DO NOT CHANGE
-# use control panel to update values or defaultsconfig.yaml to set defaults
-metadata = {}
-metadata_lock = Lock()
-
 
 # Using eventlet breaks UDP reading thread unless patched.
 # See http://eventlet.net/doc/basic_usage.html?highlight=monkey_patch#patching-functions for more.
@@ -61,19 +49,197 @@ socketio = SocketIO(app, cors_allowed_origins='*')
 
 # socketio = SocketIO(app, async_mode='threading')
 
-def read_metadata():
+# one Session per rig with its own room, start flag, metadata, log, and FicTrac reader, see
+# read_sessions(). The metadata of each session starts with the values in defaultsconfig.yaml
+# and is updated through the control panel.
+sessions = {}
+
+# name of the session used by clients and pages that do not select one with `?session=<name>`
+default_session_name = "default"
+
+# session name of each connected client
+client_sessions = {}
+
+# protocols compiled from protocols/*.yaml, see before_first_request()
+protocols = {}
+
+# roles of the sockets that receive the start, stop, and restart messages for the arena pages:
+# the page control sockets connect as observers, older pages without a role as arena
+PAGE_ROLES = ("arena", "observer")
+
+def log_server_event(session, shared_key, key, value):
+    """
+    Store an event that the server sends to the clients as `meta` message.
+
+    :param Session session: session that sent the event
+    :param shared_key: shared key of the event, typically the server time in ns
+    :param str key: key of the event
+    :param value: value of the event
+    """
+    if key == "trial-start":
+        track_trial(session, shared_key, True)
+    logdata_batch(session, "server", [[0, shared_key, key, value]])
+    if key == "trial-end":
+        track_trial(session, shared_key, False)
+
+
+def track_trial(session, shared_key, is_start):
+    """
+    Mark the FicTrac archive with the running trial and log the latency summary at the end of
+    a trial.
+
+    :param Session session: session that runs the trial
+    :param shared_key: shared key of the `trial-start` or `trial-end` event
+    :param bool is_start: True at the start of the trial
+    """
+    if session.fictrac_archive is not None:
+        session.fictrac_archive.set_shared_key(shared_key if is_start else 0)
+    if not is_start:
+        summary = session.latency_monitor.trial_summary()
+        if summary is not None:
+            logdata_batch(
+                session, "server", [[0, shared_key, "latency-summary", json.dumps(summary)]])
+
+
+def get_session(name=None):
+    """
+    Find a session by name.
+
+    :param str name: name of the session, the default session if empty
+    :rtype: Session or None if there is no session with that name
+    """
+    return sessions.get(name or default_session_name)
+
+
+def request_session():
+    """
+    Session selected by the `session` query parameter of the current HTTP request.
+
+    :rtype: Session or None if the selected session does not exist
+    """
+    return get_session(request.args.get("session"))
+
+
+def client_session():
+    """
+    Session of the client that sent the current Socket.IO message.
+
+    :rtype: Session
+    """
+    return get_session(client_sessions.get(request.sid))
+
+
+def arena_session():
+    """
+    Session of the arena display that sent the current Socket.IO message. Log and timing
+    messages from other clients are ignored, so that open control panels and observers do not
+    add rows to the log.
+
+    :rtype: Session or None if the client is not an arena display
+    """
+    session = client_session()
+    if session is None or session.role_of(request.sid) != "arena":
+        return None
+    return session
+
+
+def read_sessions():
+    """
+    Create the sessions defined in sessions.yaml, or a single session named `default` that
+    reads FicTrac from FICTRAC_HOST and FICTRAC_PORT if the file does not exist. Each session
+    needs its own FicTrac port:
+
+        sessions:
+          rig1:
+            fictrac_port: 1717
+          rig2:
+            fictrac_port: 1718
+            metadata:
+              rig: left
+
+    The first session is the default session.
+    """
+    global default_session_name
+    definitions = None
+    sessions_path = Path("sessions.yaml")
+    if sessions_path.exists():
+        with open(sessions_path, "r") as stream:
+            try:
+                definitions = (yaml.safe_load(stream) or {}).get("sessions")
+            except yaml.YAMLError as exc:
+                print(exc)
+    if not definitions:
+        definitions = {"default": {}}
+    ports = {}
+    for name, definition in definitions.items():
+        definition = definition or {}
+        session = Session(
+            str(name), socketio,
+            fictrac_host=definition.get("fictrac_host", app.config["FICTRAC_HOST"]),
+            fictrac_port=definition.get("fictrac_port", app.config["FICTRAC_PORT"]))
+        address = (session.fictrac_host, session.fictrac_port)
+        if address in ports:
+            warnings.warn(f"Sessions {ports[address]} and {name} share the FicTrac port {address}")
+        ports[address] = name
+        session.socket.log = partial(log_server_event, session)
+        read_metadata(session)
+        with session.metadata_lock:
+            session.metadata.update(data_as_string(definition.get("metadata") or {}))
+        sessions[session.name] = session
+    default_session_name = next(iter(sessions))
+
+
+def read_metadata(session):
     """
     read metadata values from a config file
+
+    :param Session session: session that receives the default metadata
     """
-    global metadata
     # read in defaults from defaultsconfig.yaml
     with open("defaultsconfig.yaml", "r") as stream:
         try:
             filedata = yaml.safe_load(stream)
         except yaml.YAMLError as exc:
             print(exc)
-    with metadata_lock:
-        metadata = data_as_string(filedata)
+    with session.metadata_lock:
+        session.metadata = data_as_string(filedata)
+
+def read_log_policy(session):
+    """
+    read the log policy from logpolicy.yaml, if the file exists
+
+    :param Session session: session that uses the policy
+    """
+    policy_path = Path("logpolicy.yaml")
+    if not policy_path.exists():
+        return
+    with open(policy_path, "r") as stream:
+        try:
+            filedata = yaml.safe_load(stream) or {}
+        except yaml.YAMLError as exc:
+            print(exc)
+            return
+    set_log_policy(session, filedata.get("log-policy"))
+
+
+def set_log_policy(session, rules):
+    """
+    Replace the log policy of a session, for example at the beginning of a protocol. The policy
+    in effect is logged as `log-policy` and sent to all clients of the session. The markers of
+    the policy are sent without waiting for the `meta-batch`, so that clients open and close the
+    windows of the policy on time.
+
+    :param Session session: session that uses the policy
+    :param dict rules: rules for each key, see `LogPolicy`
+    """
+    session.log_policy = LogPolicy(rules)
+    session.socket.flush_keys = set(session.socket.FLUSH_KEYS) | session.log_policy.markers
+    if session.log_handler is not None:
+        logdata(
+            session, "server", 0, time.time_ns(), "log-policy",
+            json.dumps(session.log_policy.as_dict()))
+    session.emit("log-policy", session.log_policy.as_dict(), role="arena")
+
 
 def data_as_string(dictionary):
     """
@@ -115,11 +281,31 @@ def data_as_string(dictionary):
 
 def before_first_request():
     """
-    Server initiator: check for paths  and initialize logger.
+    Server initiator: check for paths, create the sessions with their loggers and FicTrac
+    readers.
     """
+    global protocols
     app.config.update(
         FICTRAC_HOST = '127.0.0.1',
-        FICTRAC_PORT = 1717
+        FICTRAC_PORT = 1717,
+        FICTRAC_ARCHIVE = True,
+        FICTRAC_FRAME_META = False,
+        LOG_QUEUE_SIZE = 100000,
+        LOG_FLUSH_INTERVAL = 0.25,
+        LOG_FLUSH_SIZE = 500,
+        LOG_FORMAT = 'csv',
+        LOG_COMPRESSION = True,
+        LOG_SEGMENT_MAX_BYTES = 256*1024*1024,
+        LOG_WRITER_PROCESS = False,
+        LOG_RING_SLOTS = 65536,
+        LOG_RING_SLOT_SIZE = 128,
+        META_ECHO = False,
+        META_BATCH = True,
+        COMPILED_TIMELINE = False,
+        SYNC_DISPLAYS = False,
+        SYNC_LEAD_MS = 50,
+        CLOCK_SYNC_INTERVAL = 1.0,
+        CLOCK_LOG_INTERVAL = 10.0
     )
     data_path = Path("data")
     if data_path.exists():
@@ -129,47 +315,207 @@ def before_first_request():
             raise Exception("'data' exists as a file, but we need to create a directory with that name to log data")
     else:
         data_path.mkdir()
-    read_metadata()
-    csv_handler = FileHandler("data/repeater_{}.csv".format(time.strftime("%Y%m%d_%H%M%S")))
-    csv_handler.setFormatter(CsvFormatter())
-    app.logger.removeHandler(default_handler)
-    app.logger.setLevel(logging.INFO)
-    app.logger.addHandler(csv_handler)
-    app.logger.info(["client_id", "client_timestamp", "request_timestamp", "key", "value"])
-
+    read_sessions()
+    log_time = time.strftime("%Y%m%d_%H%M%S")
+    for session in sessions.values():
+        log_name = f"data/repeater_{log_time}"
+        if len(sessions) > 1 or session.name != "default":
+            log_name = f"{log_name}_{session.name}"
+        open_log(session, log_name)
+        session.socket.echo_meta = app.config["META_ECHO"]
+        session.socket.batch_meta = app.config["META_BATCH"]
+        if app.config["SYNC_DISPLAYS"]:
+            # all arena displays of the session apply stimulus changes on the same frame
+            session.socket.sync_lead_ms = app.config["SYNC_LEAD_MS"]
+        session.fictrac_reader = FicTracReader.get(session.fictrac_host, session.fictrac_port)
+        session.socket.fictrac = session.fictrac_reader
+        if app.config["FICTRAC_ARCHIVE"]:
+            # read with `FicTracArchive.read(filename, shared_key)`
+            session.fictrac_reader.framer.full_columns = True
+            session.fictrac_archive = FicTracArchive(f"{log_name}.fictrac")
+        print(f"Session {session.name}: FicTrac on port {session.fictrac_port}, "
+              f"log {log_name}")
+    socketio.start_background_task(target=sync_clocks)
+    protocols = Protocol.load_all("protocols")
+    for name, protocol in list(protocols.items()):
+        try:
+            summary = protocol.summary()
+        except ProtocolError as error:
+            warnings.warn(f"Protocol {name} skipped: {error}")
+            del protocols[name]
+            continue
+        print(f"Protocol {name}: {summary['trials']} trials × {protocol.repetitions}, "
+              f"{summary['duration_ms']/60000:.1f} min")
+        for problem in protocol.problems:
+            warnings.warn(problem)
+
+
+def open_log(session, log_name):
+    """
+    Create the log file of a session and log the log policy in effect.
 
-def savedata(sid, shared, key, value=0):
+    :param Session session: session that writes the log
+    :param str log_name: file name of the log without suffix
+    """
+    handler_options = {
+        'max_queue_size': app.config["LOG_QUEUE_SIZE"],
+        'flush_interval': app.config["LOG_FLUSH_INTERVAL"],
+        'flush_size': app.config["LOG_FLUSH_SIZE"]}
+    log_header = ["client_id", "client_timestamp", "request_timestamp", "key", "value"]
+    if app.config["LOG_FORMAT"] == 'binary':
+        # convert to CSV with `BinaryLogReader(filename).to_csv(csv_filename)`
+        handler_class, formatter_class = BinaryFileHandler, None
+        handler_args = [f"{log_name}.bin"]
+    else:
+        # one segment per protocol run, extract trials with `SegmentedFileHandler.extract()`
+        handler_class, formatter_class = SegmentedFileHandler, CsvFormatter
+        handler_args = [log_name]
+        handler_options.update(
+            compress=app.config["LOG_COMPRESSION"],
+            max_bytes=app.config["LOG_SEGMENT_MAX_BYTES"],
+            header=log_header)
+    if app.config["LOG_WRITER_PROCESS"] and not ORDERED_STORES:
+        warnings.warn("LOG_WRITER_PROCESS needs x86, logging in the server process")
+    if app.config["LOG_WRITER_PROCESS"] and ORDERED_STORES:
+        # records are only copied into shared memory, a separate process writes them to disk
+        log_handler = SharedMemoryHandler(
+            handler_class, *handler_args, formatter_class=formatter_class,
+            capacity=app.config["LOG_RING_SLOTS"], slot_size=app.config["LOG_RING_SLOT_SIZE"],
+            **handler_options)
+    else:
+        log_handler = handler_class(*handler_args, **handler_options)
+        if formatter_class is not None:
+            log_handler.setFormatter(formatter_class())
+    session.set_log_handler(log_handler)
+    session.log_segmented = handler_class is SegmentedFileHandler
+    if not session.log_segmented:
+        session.logger.info(log_header)
+    read_log_policy(session)
+    logdata(
+        session, "server", 0, time.time_ns(), "log-policy",
+        json.dumps(session.log_policy.as_dict()))
+
+
+def savedata(session, sid, shared, key, value=0):
     """
     Store data on disk. It is intended to be key-value pairs, together with a shared knowledge
-    item. Data storage is done through the logging.FileHandler.
+    item. Data storage is done through the logging.FileHandler of the session.
 
+    :param Session session: session that stores the data
     :param str shared: intended for shared knowledge between client and server
     :param str key: Key from the key-value pair
     :param str value: Value from the key-value pair.
     """
-    app.logger.info([sid, shared, key, value])
+    session.logger.info([sid, shared, key, value])
 
 
-def logdata(sid, client_timestamp, request_timestamp, key, value):
+def logdata(session, sid, client_timestamp, request_timestamp, key, value):
     """
     Store data on disk. In addition to a key-value pair, the interface allows to store a client
     timestamp and an additional timestamp, for example from the initial server request. In
     practice, all these values are just logged to disk and stored no matter what they are.
 
+    :param Session session: session that stores the data
     :param str client_timestamp: timestamp received from the client
     :param str request_timestamp: server timestamp that initiated the client action
     :param str key: key of the key-value pair
     :param str value: value of the key-value pair
     """
-    app.logger.info([sid, client_timestamp, request_timestamp, key, value])
+    session.logger.info([sid, client_timestamp, request_timestamp, key, value])
+
+
+def logdata_batch(session, sid, entries, policy_version=None):
+    """
+    Store a list of client log entries on disk with a single logging call. Each entry consists
+    of client timestamp, request timestamp, key, and value (see `logdata`), the order of the
+    entries is kept. Entries are filtered by the log policy, unless the client already applied
+    the current version of the policy.
+
+    :param Session session: session that stores the data
+    :param str sid: client id
+    :param list entries: list of [client_timestamp, request_timestamp, key, value]
+    :param str policy_version: version of the log policy the client applied
+    """
+    rows = [[sid] + list(entry) for entry in entries]
+    if policy_version != session.log_policy.version:
+        rows = session.log_policy.filter_rows(rows)
+    if rows:
+        session.logger.info(rows, extra={'batch': True})
+
+
+def rotate_log(session):
+    """
+    Start a new log segment, if the log is segmented. The log policy is logged again at the
+    beginning of the new segment. Before the first trial, the rows logged so far stay in the
+    current segment, see `SegmentedFileHandler.rotate`.
+
+    :param Session session: session that writes the log
+    """
+    if not session.log_segmented:
+        return
+    session.log_handler.rotate()
+    logdata(
+        session, "server", 0, time.time_ns(), "log-policy",
+        json.dumps(session.log_policy.as_dict()))
+
+
+def drain_log(session):
+    """
+    Write all queued log records and pending summaries of the log policy to disk. The number of
+    records that were dropped because the queue was full is logged as `log-dropped-records`. With
+    LOG_WRITER_PROCESS set, the fill level and high-water mark of the ring buffer are logged as
+    `log-ring`.
+
+    :param Session session: session that writes the log
+    """
+    if session.fictrac_archive is not None:
+        session.fictrac_archive.flush()
+    log_handler = session.log_handler
+    if log_handler is None:
+        return
+    summaries = session.log_policy.flush_summaries()
+    if summaries:
+        session.logger.info(summaries, extra={'batch': True})
+    log_handler.flush()
+    stats = getattr(log_handler, "stats", None)
+    if stats is not None:
+        logdata(session, "server", 0, time.time_ns(), "log-ring", json.dumps(stats()))
+    if log_handler.dropped_count:
+        logdata(
+            session, "server", 0, time.time_ns(), "log-dropped-records",
+            log_handler.dropped_count)
+    if stats is not None or log_handler.dropped_count:
+        log_handler.flush()
 
 
 @socketio.on("connect")
 def connect():
     """
-    Confirm SocketIO connection by printing "Client connected"
+    Confirm SocketIO connection by printing "Client connected" and add the client to the room of
+    its role in the session it selected with the `session` query parameter. The role is one of
+    `Session.ROLES` from the `role` query parameter, clients without a role are arena displays.
+    Arena displays receive the log policy and keep a clock estimate. Server events are logged by
+    the server, so the arena only sends `meta` messages back if `META_ECHO` is set. Connections
+    to unknown sessions or with unknown roles are refused.
     """
-    print("Client connected", request.sid)
+    session = get_session(request.args.get("session"))
+    if session is None:
+        print("Client refused, unknown session", request.args.get("session"))
+        return False
+    role = request.args.get("role") or "arena"
+    try:
+        room = session.join(request.sid, role)
+    except ValueError as error:
+        print("Client refused:", error)
+        return False
+    print("Client connected", request.sid, "to session", session.name, "as", role)
+    client_sessions[request.sid] = session.name
+    join_room(room)
+    if role == "arena":
+        socketio.emit("log-policy", session.log_policy.as_dict(), to=request.sid)
+        socketio.emit("meta-echo", session.socket.echo_meta, to=request.sid)
+        session.socket.clocks[request.sid] = ClockEstimator()
+    return None
 
 
 @socketio.on("disconnect")
@@ -178,42 +524,56 @@ def disconnect():
     Verify SocketIO disconnect
     """
     print("Client disconnected", request.sid)
+    session = client_session()
+    if session is None:
+        return
+    model = session.socket.clock_model(request.sid)
+    if model is not None:
+        logdata(
+            session, request.sid, 0, time.time_ns(), "clock-model", json.dumps(model.as_dict()))
+    room = session.leave(request.sid)
+    if room is not None:
+        leave_room(room)
+    client_sessions.pop(request.sid, None)
 
 
 @socketio.on('stop-pressed')
 def trigger_stop(empty):
-    socketio.emit('stop-triggered', empty)
+    client_session().emit('stop-triggered', empty, role=PAGE_ROLES)
 
 @socketio.on('start-pressed')
 def trigger_start(empty):
-    socketio.emit('start-triggered', empty)
+    client_session().emit('start-triggered', empty, role=PAGE_ROLES)
     #socketio.broadcast.emit('start-triggered', num)
     #print("recieved by flyflix")
 
 @socketio.on('restart-pressed')
 def trigger_restart(empty):
-    socketio.emit('condition-update', "Once the experiment is started, status will be shown here.")
-    socketio.emit('restart-triggered', empty)
+    session = client_session()
+    session.emit('condition-update', "Once the experiment is started, status will be shown here.")
+    session.emit('restart-triggered', empty, role=PAGE_ROLES)
     
 @socketio.on('manual-restart')
 def manual_restart(empty):
     print('manually restarted - recieved')
-    socketio.emit('condition-update', "Once the experiment is started, status will be shown here.")
+    client_session().emit(
+        'condition-update', "Once the experiment is started, status will be shown here.")
 
 
 @socketio.on('start-experiment')
 def finally_start(number):
     """
-    When the server receives a `start-experiment` message via SocketIO, the global variable start
-    is set to true
+    When the server receives a `start-experiment` message via SocketIO, the session of the
+    client is started
 
     :param number: TODO find out what it does
     """
-    # FIXME: bad practice. Will break at some point
-    print("Started at {}".format(time.strftime("%Y%m%d_%H%M%S")))
-    global start
-    start = True
-    socketio.emit('experiment-started')
+    session = client_session()
+    print("Started {} at {}".format(session.name, time.strftime("%Y%m%d_%H%M%S")))
+    if not session.is_started:
+        rotate_log(session)
+    session.is_started = True
+    session.emit('experiment-started', role="arena")
 
 
 @socketio.on('slog')
@@ -223,8 +583,11 @@ def server_log(json):
 
     :param json: dictionary received from the client via SocketIO
     """
+    session = arena_session()
+    if session is None:
+        return
     shared_key = time.time()
-    savedata(request.sid, shared_key, json['key'], json['value'])
+    savedata(session, request.sid, shared_key, json['key'], json['value'])
 
 @socketio.on('csync')
 def server_client_sync(client_timestamp, request_timestamp, key):
@@ -237,7 +600,51 @@ def server_client_sync(client_timestamp, request_timestamp, key):
         which started the process
     :param key: key that should be logged.
     """
-    logdata(request.sid, client_timestamp, request_timestamp, key, time.time_ns())
+    received = time.time_ns()
+    session = arena_session()
+    if session is None:
+        return
+    logdata(session, request.sid, client_timestamp, request_timestamp, key, received)
+    if key == "de-sync" and session.timeline["timeline"] is None:
+        # the request timestamp is the server time when `ssync` was sent
+        session.socket.update_latency(request.sid, received - int(request_timestamp))
+
+
+@socketio.on('cpong')
+def clock_pong(sequence, client_timestamp):
+    """
+    Answer of a client to a `cping`, used to estimate the client clock.
+
+    :param int sequence: sequence number of the ping
+    :param float client_timestamp: client time when the ping was answered
+    """
+    received = time.time_ns()
+    estimator = client_session().socket.clocks.get(request.sid)
+    if estimator is not None:
+        estimator.pong(sequence, client_timestamp, received)
+
+
+def sync_clocks():
+    """
+    Background exchange of `cping` and `cpong` messages with every connected client. The current
+    clock model of each client is logged as `clock-model` every CLOCK_LOG_INTERVAL seconds, use
+    `align_rows` to convert logged client timestamps to server time.
+    """
+    last_log = time.monotonic()
+    while True:
+        socketio.sleep(app.config["CLOCK_SYNC_INTERVAL"])
+        for session in sessions.values():
+            for sid, estimator in list(session.socket.clocks.items()):
+                socketio.emit("cping", estimator.ping(time.time_ns()), to=sid)
+        if time.monotonic() - last_log >= app.config["CLOCK_LOG_INTERVAL"]:
+            last_log = time.monotonic()
+            for session in sessions.values():
+                for sid in list(session.socket.clocks):
+                    model = session.socket.clock_model(sid)
+                    if model is not None:
+                        logdata(
+                            session, sid, 0, time.time_ns(), "clock-model",
+                            json.dumps(model.as_dict()))
 
 
 @socketio.on('dl')
@@ -251,353 +658,419 @@ def data_logger(client_timestamp, request_timestamp, key, value):
     :param key: key from key-value pair
     :param value: value from key-value pair
     """
-    logdata(request.sid, client_timestamp, request_timestamp, key, value)
+    session = arena_session()
+    if session is None:
+        return
+    logdata_batch(session, request.sid, [[client_timestamp, request_timestamp, key, value]])
+
+
+@socketio.on('dl-batch')
+def data_logger_batch(entries, policy_version=None):
+    """
+    data logger routine for batches of data sent from the client. The client buffers its log
+    entries and sends them once per animation frame.
+
+    :param entries: list of [client_timestamp, request_timestamp, key, value]
+    :param policy_version: version of the log policy that the client applied to the entries
+    """
+    session = arena_session()
+    if session is None:
+        return
+    logdata_batch(session, request.sid, entries, policy_version)
+
+
+@socketio.on('latency-report')
+def latency_report(reports):
+    """
+    Receive the times when the client received, ticked, and rendered closed loop updates.
+
+    :param reports: list of [cnt, receive, tick, render] with client times in ms
+    """
+    session = arena_session()
+    if session is None:
+        return
+    session.latency_monitor.report(request.sid, reports)
+
+
+@socketio.on('timeline-loaded')
+def timeline_loaded(timeline_id):
+    """
+    The client received the timeline and is ready to start it.
+
+    :param timeline_id: ID of the loaded timeline
+    """
+    session = arena_session()
+    if session is None:
+        return
+    active_timeline = session.timeline
+    timeline = active_timeline["timeline"]
+    if timeline is not None and timeline.timeline_id == timeline_id:
+        active_timeline["loaded"] = True
+
+
+@socketio.on('timeline-executed')
+def timeline_executed(timeline_id, executed):
+    """
+    Log the client time at which timeline entries were executed. `meta` entries are logged with
+    their key and value at the time of execution, progress updates are forwarded to the control
+    panel.
+
+    :param timeline_id: ID of the running timeline
+    :param executed: list of [index, client_timestamp]
+    """
+    session = arena_session()
+    if session is None:
+        return
+    timeline = session.timeline["timeline"]
+    if timeline is None or timeline.timeline_id != timeline_id:
+        return
+    rows = []
+    for index, client_timestamp in executed:
+        _, event, args = timeline.entries[index]
+        rows.append([client_timestamp, timeline_id, "timeline-executed", index])
+        if event == "meta":
+            rows.append([client_timestamp] + args)
+            if args[1] in ("trial-start", "trial-end"):
+                track_trial(session, args[0], args[1] == "trial-start")
+        elif event == "condition-update":
+            session.emit("condition-update", args[0])
+    logdata_batch(session, request.sid, rows)
+
+
+@socketio.on('timeline-finished')
+def timeline_finished(timeline_id):
+    """
+    The client executed all entries of the timeline.
+
+    :param timeline_id: ID of the finished timeline
+    """
+    session = arena_session()
+    if session is None:
+        return
+    active_timeline = session.timeline
+    timeline = active_timeline["timeline"]
+    if timeline is not None and timeline.timeline_id == timeline_id:
+        active_timeline["finished"] = True
 
 
 @socketio.on('display')
 def display_event(data):
-    savedata(request.sid, data['cnt'], "display-offset", data['counter'])
+    session = arena_session()
+    if session is None:
+        return
+    savedata(session, request.sid, data['cnt'], "display-offset", data['counter'])
 
 
 @socketio.on('stop-pressed')
 def trigger_stop(empty):
-    socketio.emit('stop-triggered', empty)
-    print("Stopped")
-    global start
-    start = False
+    session = client_session()
+    session.emit('stop-triggered', empty, role=PAGE_ROLES)
+    print("Stopped", session.name)
+    session.is_started = False
+    drain_log(session)
 
 
 @socketio.on('start-pressed')
 def trigger_start(empty):
-    socketio.emit('start-triggered', empty)
+    client_session().emit('start-triggered', empty, role=PAGE_ROLES)
     #socketio.broadcast.emit('start-triggered', num)
     #print("recieved by flyflix")
 
 @socketio.on('restart-pressed')
 def trigger_restart(empty):
-    socketio.emit('restart-triggered', empty)
+    client_session().emit('restart-triggered', empty, role=PAGE_ROLES)
 
 
-def log_fictrac_timestamp():
+def log_fictrac_timestamp(session, run):
+    """
+    Store each FicTrac frame in the FicTrac archive as long as the FicTrac run continues. The
+    frame counter is only sent as `fictrac-frame` meta message if FICTRAC_FRAME_META is set.
+
+    :param Session session: session that reads FicTrac
+    :param int run: number of the FicTrac run, see `Session.start_fictrac`
+    """
     shared_key = time.time_ns()
-    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
-        sock.settimeout(0.1)
-        data = ""
-        try:
-            sock.bind(( '127.0.0.1', 1717))
-            new_data = sock.recv(1)
-            data = new_data.decode('UTF-8')
-            socketio.emit("meta", (shared_key, "fictrac-connect-ok", 1))
-        except: # If Fictrac doesn't exist # FIXME: catch specific exception
-            socketio.emit("meta", (shared_key, "fictrac-connect-fail", 0))
-            warnings.warn("Fictrac is not running on 127.0.0.1:1717")
-            return
+    on_frame = None
+    if app.config["FICTRAC_FRAME_META"] or session.fictrac_archive is None:
+        on_frame = lambda frame: session.socket.emit(
+            "meta", (shared_key, "fictrac-frame", frame.cnt))
+    overflow_count = session.archive_fictrac(run, on_frame)
+    if session.fictrac_archive is not None and overflow_count:
+        logdata(session, "server", 0, shared_key, "fictrac-archive-overflow", overflow_count)
 
-        while RUN_FICTRAC:
-            new_data = sock.recv(1024)
-            if not new_data:
-                break
-            data += new_data.decode('UTF-8')
-            endline = data.find("\n")
-            line = data[:endline]
-            data = data[endline+1:]
-            toks = line.split(", ")
-            if (len(toks) < 24) | (toks[0] != "FT"):
-                continue # This is not the expected fictrac data package
-            cnt = int(toks[1])
-            #if cnt-prevfrm > 100:
-            socketio.emit("meta", (shared_key, "fictrac-frame", cnt))
-            #    prevfrm = cnt
-
-
-def proto_optomotor_4dir():
-    print(time.strftime("%H:%M:%S", time.localtime()))
-    block = []
-    counter = 0
-
-    ## rotation
-    for alpha in [20]:
-        for speed in [4]:
-            for updown in [False, True]:
-                for direction in [-1, 1]:
-                    for clrs in [(0, 255)]:
-                        bright = clrs[1]
-                        contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                        fg_color = clrs[1] << 8
-                        bg_color = clrs[0] << 8
-                        rotation_speed = alpha*2*speed*direction
-                        trial = Trial(
-                            counter,
-                            bar_deg=alpha,
-                            rotate_deg_hz=rotation_speed,
-                            openloop_duration=Duration(5000),
-                            pretrial_duration=Duration(0), posttrial_duration=Duration(0),
-                            fg_color=fg_color, bg_color=bg_color,
-                            flip_camera=updown,
-                            comment=f"Rotation alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast} updown {updown}")
-                        block.append(trial)
-                        counter += 1
-
-    while not start:
-        time.sleep(0.1)
-    global RUN_FICTRAC
-    RUN_FICTRAC = True
-    log_metadata()
-    _ = socketio.start_background_task(target = log_fictrac_timestamp)
-
-    repetitions = 4
-    counter = 0
-    opening_black_screen = Duration(100)
-    opening_black_screen.trigger_delay(socketio)
-    for i in range(repetitions):
-        socketio.emit("meta", (time.time_ns(), "block-repetition", i))
-        #block = random.sample(block, k=len(block))
-        for current_trial in block:
-            counter = counter + 1
-            progress = f"Condition {counter} of {len(block*repetitions)}"
-            print(progress)
-            socketio.emit("condition-update", progress)
-            current_trial.set_id(counter)
-            current_trial.trigger(socketio)
-            if not start:
-                return
-
-    RUN_FICTRAC = False
-    socketio.emit("condition-update", "Completed")
-    print(time.strftime("%H:%M:%S", time.localtime()))
 
-def proto_grating():
-    print(time.strftime("%H:%M:%S", time.localtime()))
-    block = []
-    counter = 0
-
-    ## rotation
-    for alpha in [22.5, 45]:
-        for speed in [2, 4, 8]:
-            for clrs in [(0, 255)]:
-                for colorshift  in [8, 0]:
-                    for direction in [-1, 1]:
-                        bright = clrs[1]
-                        contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                        fg_color = clrs[1] << colorshift
-                        bg_color = clrs[0] << colorshift
-                        rotation_speed = alpha*2*speed*direction
-                        trial = Trial(
-                            counter,
-                            bar_deg=alpha,
-                            rotate_deg_hz=rotation_speed,
-                            openloop_duration=Duration(5000),
-                            pretrial_duration=Duration(0), posttrial_duration=Duration(0),
-                            fg_color=fg_color, bg_color=bg_color,
-                            comment=f"Rotation alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast}")
-                        block.append(trial)
-                        counter += 1
-
-    while not start:
-        time.sleep(0.1)
-    global RUN_FICTRAC
-    RUN_FICTRAC = True
-    log_metadata()
-    _ = socketio.start_background_task(target = log_fictrac_timestamp)
-
-    repetitions = 2
-    counter = 0
-    opening_black_screen = Duration(100)
-    opening_black_screen.trigger_delay(socketio)
-    for i in range(repetitions):
-        socketio.emit("meta", (time.time_ns(), "block-repetition", i))
-        #block = random.sample(block, k=len(block))
-        for current_trial in block:
-            counter = counter + 1
-            progress = f"Condition {counter} of {len(block*repetitions)}"
-            print(progress)
-            socketio.emit("condition-update", progress)
-            current_trial.set_id(counter)
-            current_trial.trigger(socketio)
-            if not start:
-                return
-
-    RUN_FICTRAC = False
-    socketio.emit("condition-update", "Completed")
-    print(time.strftime("%H:%M:%S", time.localtime()))
+def send_fictrac_telemetry(session, run, interval=0.2):
+    """
+    Send the latest FicTrac frame to the control panel every `interval` seconds as long as the
+    FicTrac run continues.
 
+    :param Session session: session that reads FicTrac
+    :param int run: number of the FicTrac run, see `Session.start_fictrac`
+    :param float interval: time between updates in seconds
+    """
+    fictrac_reader = session.fictrac_reader
+    subscription = fictrac_reader.subscribe(maxsize=1)
+    try:
+        while session.reads_fictrac(run):
+            socketio.sleep(interval)
+            frame = subscription.get(timeout=0)
+            if frame is None:
+                continue
+            session.emit("fictrac-telemetry", {
+                'cnt': frame.cnt, 'heading': frame.heading,
+                'frames': fictrac_reader.frame_count})
+    finally:
+        fictrac_reader.unsubscribe(subscription)
+
+
+def send_latency_telemetry(session, run, interval=1.0):
+    """
+    Send the closed loop latency percentiles to the control panel every `interval` seconds as
+    long as the FicTrac run continues.
 
-def proto_smallfield():
-    print(time.strftime("%H:%M:%S", time.localtime()))
-    block = []
-    counter = 0
-
-    # ## rotation
-    for alpha in [15]:
-        for speed in [2, 3, 6, 12]:
-            for counter in range(3):
-                for direction in [-1, 1]:
-                    for clrs in [(255, 0)]:
-                        bright = clrs[1]
-                        contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                        fg_color = clrs[1] << 8
-                        bg_color = clrs[0] << 8
-                        rotation_speed = alpha*2*speed*direction
-                        trial = Trial(
-                            counter,
-                            bar_deg=alpha,
-                            space_deg=360-alpha,
-                            sweep=1, openloop_duration=None,
-                            rotate_deg_hz=rotation_speed,
-                            pretrial_duration=Duration(0), posttrial_duration=Duration(0),
-                            fg_color=fg_color, bg_color=bg_color,
-                            comment=f"Sweep alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast}")
-                        block.append(trial)
-                        counter += 1
-
-
-    # Small object
-    for alpha in [15]:
-        for speed in [2, 3, 6, 12]:
-            for clrs in [(255, 0)]:
-                for counter in range(3):
-                    for direction in [-1, 1]:
-                        bright = clrs[1]
-                        contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                        fg_color = clrs[1] << 8
-                        bg_color = clrs[0] << 8
-                        rotation_speed = alpha*2*speed*direction
-                        trial = Trial(
-                            counter,
-                            bar_deg=alpha, space_deg=360-alpha,
-                            sweep=1, openloop_duration=None,
-                            rotate_deg_hz=rotation_speed,
-                            pretrial_duration=Duration(0), posttrial_duration=Duration(0),
-                            fg_color=fg_color, bg_color=bg_color,
-                            bar_height=0.03,
-                            comment=f"Object alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast}")
-                        block.append(trial)
-                        counter += 1
-
-    while not start:
-        time.sleep(0.1)
-    global RUN_FICTRAC
-    RUN_FICTRAC = True
-    log_metadata()
-    _ = socketio.start_background_task(target = log_fictrac_timestamp)
-
-    repetitions = 4
-    counter = 0
-    opening_black_screen = Duration(100)
-    opening_black_screen.trigger_delay(socketio)
-    for i in range(repetitions):
-        socketio.emit("meta", (time.time_ns(), "block-repetition", i))
-        #block = random.sample(block, k=len(block))
-        for current_trial in block:
-            counter = counter + 1
-            progress = f"Condition {counter} of {len(block*repetitions)}"
-            print(progress)
-            socketio.emit("condition-update", progress)
-            current_trial.set_id(counter)
-            current_trial.trigger(socketio)
-            if not start:
-                return
-
-    RUN_FICTRAC = False
-    socketio.emit("condition-update", "Completed")
-    print(time.strftime("%H:%M:%S", time.localtime()))
+    :param Session session: session that reads FicTrac
+    :param int run: number of the FicTrac run, see `Session.start_fictrac`
+    :param float interval: time between updates in seconds
+    """
+    while session.reads_fictrac(run):
+        socketio.sleep(interval)
+        percentiles = session.latency_monitor.percentiles()
+        if percentiles['total']['count']:
+            session.emit("latency-telemetry", percentiles)
+
+
+def start_fictrac(session):
+    """
+    Start the FicTrac reader of the session together with the frame logger and the FicTrac and
+    latency telemetry for the control panel, unless the session already reads FicTrac. The
+    run ends with `Session.stop_fictrac` at the end of the protocol.
+
+    :param Session session: session that reads FicTrac
+    """
+    run = session.start_fictrac()
+    if run is None:
+        return
+    session.fictrac_reader.start(session.socket)
+    for target in (log_fictrac_timestamp, send_fictrac_telemetry, send_latency_telemetry):
+        _ = socketio.start_background_task(target=target, session=session, run=run)
 
 
-def proto_cshlfly22():
+def start_schedule(session):
+    """
+    Start a new schedule for the protocol. All following Durations end at deadlines measured
+    from now, so that the protocol does not drift from its nominal length.
+
+    :param Session session: session that runs the protocol
+    """
+    session.socket.scheduler = Scheduler()
+    session.socket.scheduler.start()
+
+
+def log_schedule(session):
+    """
+    Log the overshoot statistics and the drift of the current schedule as `schedule-summary`.
+
+    :param Session session: session that runs the protocol
+    """
+    scheduler = getattr(session.socket, "scheduler", None)
+    if scheduler is not None:
+        logdata(
+            session, "server", 0, time.time_ns(), "schedule-summary",
+            json.dumps(scheduler.summary()))
+
+
+def run_trials(session, sequence):
+    """
+    Show a short black screen and then run the trials of the sequence. The progress is sent to
+    the control panel.
+
+    With COMPILED_TIMELINE set, the sequence is compiled into a Timeline and executed by the
+    client on its own frame clock, see `run_timeline`. Blocks with closed loop trials are run
+    live.
+
+    :param Session session: session that runs the trials
+    :param TrialSequence sequence: trials in the order they are run
+    """
+    def play(target, compiled):
+        """
+        Trigger all trials through `target`, return False if the experiment was stopped.
+        """
+        def progress(message):
+            print(session.name, message)
+            session.emit("condition-update", message)
+        return play_trials(
+            target, sequence, progress=None if compiled else progress,
+            is_running=lambda: session.is_started)
+
+    if app.config["COMPILED_TIMELINE"]:
+        try:
+            timeline = Timeline()
+            play(timeline, compiled=True)
+        except ValueError as error:
+            warnings.warn(f"Running live: {error}")
+            timeline = None
+        is_completed = run_timeline(session, timeline) if timeline is not None else \
+            play(session.socket, compiled=False)
+    else:
+        is_completed = play(session.socket, compiled=False)
+    log_schedule(session)
+    if not is_completed:
+        return
+    session.emit("condition-update", "Completed")
     print(time.strftime("%H:%M:%S", time.localtime()))
-    block = []
-    counter = 0
-
-    ## rotation
-    for alpha in [15]:
-        for speed in [4, 8]:
-            for direction in [-1, 1]:
-                for clrs in [(64, 190)]:
-                    bright = clrs[1]
-                    contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                    fg_color = clrs[1] << 8
-                    bg_color = clrs[0] << 8
-                    rotation_speed = alpha*2*speed*direction
-                    trial = Trial(
-                        counter,
-                        bar_deg=alpha,
-                        rotate_deg_hz=rotation_speed,
-                        pretrial_duration=Duration(250), posttrial_duration=Duration(250),
-                        fg_color=fg_color, bg_color=bg_color,
-                        comment=f"Rotation alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast}")
-                    block.append(trial)
-                    counter += 1
-
-    # Oscillation
-    for alpha in [15]:
-        for freq in [0.333]:
-            for direction in [-1, 1]:
-                for clrs in [(190, 64)]:
-                    bright = clrs[1]
-                    contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                    fg_color = clrs[1] << 8
-                    bg_color = clrs[0] << 8
-                    trial = Trial(
-                        counter,
-                        bar_deg=alpha,
-                        osc_freq=freq, osc_width=90*direction,
-                        pretrial_duration=Duration(250), posttrial_duration=Duration(250),
-                        fg_color=fg_color, bg_color=bg_color,
-                        #bar_height=0.04,
-                        comment=f"Oscillation with frequency {freq} direction {direction} brightness {bright} contrast {contrast}")
-                    block.append(trial)
-                    counter += 1
-
-
-
-    # Small object
-    for alpha in [10]:
-        for speed in [2, 4]:
-            for direction in [-1, 1]:
-                for clrs in [(190, 64)]:
-                    bright = clrs[1]
-                    contrast = round((clrs[1]-clrs[0])/(clrs[1]+clrs[0]), 1)
-                    fg_color = clrs[1] << 8
-                    bg_color = clrs[0] << 8
-                    rotation_speed = alpha*2*speed*direction
-                    trial = Trial(
-                        counter,
-                        bar_deg=alpha, space_deg=180-alpha,
-                        rotate_deg_hz=rotation_speed,
-                        pretrial_duration=Duration(250), posttrial_duration=Duration(250),
-                        fg_color=fg_color, bg_color=bg_color,
-                        bar_height=0.03,
-                        comment=f"Object alpha {alpha} speed {speed} direction {direction} brightness {bright} contrast {contrast}")
-                    block.append(trial)
-                    counter += 1
-
-    while not start:
+
+
+def run_timeline(session, timeline, load_timeout=5.0):
+    """
+    Send a compiled timeline to the clients of the session and start it once a client confirmed
+    that it is loaded. Pressing stop aborts the timeline.
+
+    :param Session session: session that runs the timeline
+    :param Timeline timeline: compiled timeline
+    :param float load_timeout: time in seconds to wait for the client to load the timeline, also
+        the grace period after the nominal end of the timeline
+    :rtype: bool
+    :returns: True if the client finished the timeline
+    """
+    active_timeline = session.timeline
+    active_timeline.update(timeline=timeline, loaded=False, finished=False)
+    timeline_id = timeline.timeline_id
+    try:
+        session.emit("timeline-load", (timeline_id, timeline.as_list()), role="arena")
+        deadline = time.monotonic() + load_timeout
+        while not active_timeline["loaded"]:
+            if not session.is_started or time.monotonic() > deadline:
+                logdata(
+                    session, "server", 0, timeline_id, "timeline-load-fail",
+                    len(timeline.entries))
+                return False
+            time.sleep(0.05)
+        start_timeline(session, timeline_id)
+        logdata(session, "server", 0, timeline_id, "timeline-start", timeline.duration_ms)
+        deadline = time.monotonic() + timeline.duration_ms / 1000 + load_timeout
+        while not active_timeline["finished"]:
+            if not session.is_started or time.monotonic() > deadline:
+                session.emit("timeline-abort", timeline_id, role="arena")
+                logdata(session, "server", 0, timeline_id, "timeline-abort", 1)
+                return False
+            time.sleep(0.1)
+        logdata(session, "server", 0, timeline_id, "timeline-end", timeline.duration_ms)
+        return True
+    finally:
+        active_timeline.update(timeline=None, loaded=False, finished=False)
+
+
+def start_timeline(session, timeline_id):
+    """
+    Start a loaded timeline on the arena displays of the session. If the session synchronises
+    its displays, each display receives a start time SYNC_LEAD_MS in the future in its own clock,
+    so that all displays execute the timeline on the same frames.
+
+    :param Session session: session that runs the timeline
+    :param timeline_id: ID of the loaded timeline
+    """
+    lead_ms = session.socket.sync_lead_ms
+    if lead_ms is None:
+        session.emit("timeline-start", timeline_id, role="arena")
+        return
+    start_ns = time.time_ns() + int(lead_ms * 1e6)
+    logdata(session, "server", 0, timeline_id, "sync-at", start_ns)
+    for sid in list(session.socket.clocks):
+        model = session.socket.clock_model(sid)
+        start_ms = model.to_client_ms(start_ns) if model is not None else None
+        session.emit("timeline-start", (timeline_id, start_ms), role="arena", to=sid)
+
+
+def run_protocol(session, protocol, sequence, token):
+    """
+    Wait for the start of the session and run a compiled protocol. The seed and the start of
+    the sequence are logged with the protocol summary, so that an interrupted run can be resumed
+    with the same order, see `protocol_route`. A protocol that is still waiting for the start is
+    replaced when another protocol is requested for the same session. The number of clients and
+    messages for each role is logged as `message-traffic` at the end of the run. The
+    `log-policy` of the protocol replaces the policy of the session until the end of the run.
+
+    :param Session session: session that runs the protocol
+    :param Protocol protocol: protocol compiled from `protocols/<name>.yaml`
+    :param TrialSequence sequence: trials of the protocol in the order they are run
+    :param object token: identifies this request in `session.protocol_token`
+    """
+    print(session.name, time.strftime("%H:%M:%S", time.localtime()))
+    while not session.is_started:
+        if session.protocol_token is not token:
+            return
         time.sleep(0.1)
-    global RUN_FICTRAC
-    RUN_FICTRAC = True
-    log_metadata()
-    _ = socketio.start_background_task(target = log_fictrac_timestamp)
-
-    repetitions = 3
-    counter = 0
-    opening_black_screen = Duration(100)
-    opening_black_screen.trigger_delay(socketio)
-    for i in range(repetitions):
-        socketio.emit("meta", (time.time_ns(), "block-repetition", i))
-        block = random.sample(block, k=len(block))
-        for current_trial in block:
-            counter = counter + 1
-            progress = f"Condition {counter} of {len(block*repetitions)}"
-            print(progress)
-            socketio.emit("condition-update", progress)
-            current_trial.set_id(counter)
-            current_trial.trigger(socketio)
-            if not start:
-                return
-
-    RUN_FICTRAC = False
-    socketio.emit("condition-update", "Completed")
-    print(time.strftime("%H:%M:%S", time.localtime()))
+    if session.protocol_token is not token:
+        return
+    session.is_running = True
+    session_rules = session.log_policy.rules
+    try:
+        if protocol.log_policy is not None:
+            set_log_policy(session, protocol.log_policy)
+        log_metadata(session)
+        summary = protocol.summary()
+        summary['sequence'] = sequence.as_dict()
+        summary['session'] = session.name
+        logdata(session, "server", 0, time.time_ns(), "protocol", json.dumps(summary))
+        start_fictrac(session)
+        start_schedule(session)
+        run_trials(session, sequence)
+    finally:
+        session.stop_fictrac()
+        logdata(
+            session, "server", 0, time.time_ns(), "message-traffic",
+            json.dumps(session.traffic()))
+        if protocol.log_policy is not None:
+            set_log_policy(session, session_rules)
+        session.is_running = False
+        if session.protocol_token is token:
+            session.protocol_token = None
+
+
+def start_protocol(session, name, seed=None, start_index=0):
+    """
+    Load a protocol, which is instant for an unchanged and already compiled protocol file, and
+    run it in the background once the session is started.
+
+    :param Session session: session that runs the protocol
+    :param str name: name of the protocol file in `protocols/` without suffix
+    :param int seed: seed for the order of the trials, overrides the seed of the protocol
+    :param int start_index: position in the sequence to start from
+    :raises ProtocolError: if the protocol cannot be compiled
+    :raises ValueError: if the start is outside the sequence
+    :raises RuntimeError: if the session is already running a protocol
+    :rtype: Protocol
+    """
+    if session.is_running:
+        raise RuntimeError(f"Session {session.name} is already running a protocol")
+    protocol = Protocol.load(Path("protocols") / f"{name}.yaml")
+    sequence = protocol.sequence(seed, start_index)
+    token = object()
+    session.protocol_token = token
+    _ = socketio.start_background_task(
+        target=run_protocol, session=session, protocol=protocol, sequence=sequence, token=token)
+    return protocol
+
+
+def protocol_page(name, seed=None, start_index=0):
+    """
+    Start a protocol in the session selected by the `session` query parameter and show the
+    arena.
+
+    :param str name: name of the protocol file in `protocols/` without suffix
+    :param int seed: seed for the order of the trials
+    :param int start_index: position in the sequence to start from
+    """
+    session = request_session()
+    if session is None:
+        return f"Unknown session {request.args.get('session')}", 404
+    try:
+        start_protocol(session, name, seed, start_index)
+    except ValueError as error:
+        return f"Invalid protocol {name}: {error}", 400
+    except RuntimeError as error:
+        return str(error), 409
+    return render_template('cshlfly.html')
 
 
 @app.route('/control-panel/')
@@ -605,7 +1078,10 @@ def control_panel():
     """
     Control panel for experiments.
     """
-    return render_template('control-panel.html', metadata=json.dumps(metadata))
+    session = request_session()
+    if session is None:
+        return f"Unknown session {request.args.get('session')}", 404
+    return render_template('control-panel.html', metadata=json.dumps(session.metadata))
 
 
 @app.route('/optomotor_4-directions/')
@@ -613,16 +1089,14 @@ def optomotor_4dir():
     """
     Short protocol with optomotor responses moving into four different directions. (~0:50)
     """
-    _ = socketio.start_background_task(target=proto_optomotor_4dir)
-    return render_template('cshlfly.html')
+    return protocol_page("optomotor_4-directions")
 
 @app.route('/grating/')
 def grating():
     """
     Protocol with different contrasts, bar widths, and movement speed (~7:00)
     """
-    _ = socketio.start_background_task(target=proto_grating)
-    return render_template('cshlfly.html')
+    return protocol_page("grating")
 
 
 @app.route('/smallfield/')
@@ -630,8 +1104,7 @@ def smallfield():
     """
     Small field stimuli: first a 15° dark bar and then a small square moves 3× left/rigth at 4 different velocities (~4:30)
     """
-    _ = socketio.start_background_task(target=proto_smallfield)
-    return render_template('cshlfly.html')
+    return protocol_page("smallfield")
 
 
 @app.route('/cshlfly22/')
@@ -639,8 +1112,20 @@ def cshfly22():
     """
     An example protocol from CSHL 2022
     """
-    _ = socketio.start_background_task(target=proto_cshlfly22)
-    return render_template('cshlfly.html')
+    return protocol_page("cshlfly22")
+
+
+@app.route('/protocol/<name>/')
+def protocol_route(name):
+    """
+    Run any protocol from the `protocols` directory. To resume an interrupted run, pass the
+    `seed` from its `protocol` log entry and the index of the first trial to repeat, for example
+    `/protocol/grating/?seed=42&start=17`.
+    """
+    if not (Path("protocols") / f"{name}.yaml").is_file():
+        return f"Unknown protocol {name}", 404
+    return protocol_page(
+        name, request.args.get("seed", type=int), request.args.get("start", 0, type=int))
 
 
 @socketio.on('metadata-submit')
@@ -648,12 +1133,12 @@ def handle_data(data):
     """
     Triggered when metadata is submitted via the control panel
     takes the javascript objects and converts it to a python dictionary
-    stores the dictionary in the metadata variable that is used in log_metadata()
+    stores the dictionary in the metadata of the session that is used in log_metadata()
     """
     metadata_string = json.dumps(data)
-    global metadata
-    with metadata_lock:
-        metadata.update(json.loads(metadata_string))
+    session = client_session()
+    with session.metadata_lock:
+        session.metadata.update(json.loads(metadata_string))
 
 
 @socketio.on('metadata-submit')
@@ -661,26 +1146,31 @@ def handle_data(data):
     """
     Triggered when metadata is submitted via the control panel
     takes the javascript objects and converts it to a python dictionary
-    stores the dictionary in the metadata variable that is used in log_metadata()
+    stores the dictionary in the metadata of the session that is used in log_metadata()
     """
     metadata_string = json.dumps(data)
     print(metadata_string)
-    global metadata
-    metadata.update(json.loads(metadata_string))
-    print(metadata)
+    session = client_session()
+    with session.metadata_lock:
+        session.metadata.update(json.loads(metadata_string))
+    print(session.metadata)
 
 
 
-def log_metadata():
+def log_metadata(session):
     """
-    The content of the `metadata` dictionary gets logged.
+    The content of the metadata dictionary of the session gets logged.
 
     This is a rudimentary way to save information related to the experiment to a file. Edit the
     content of the dictionary for each experiment.
+
+    :param Session session: session that logs its metadata
     """
     shared_key = time.time_ns()
-    for key, value in metadata.items():
-        logdata(1, 0, shared_key, key, value)
+    with session.metadata_lock:
+        items = list(session.metadata.items())
+    for key, value in items:
+        logdata(session, 1, 0, shared_key, key, value)
 
 
 @app.route("/")
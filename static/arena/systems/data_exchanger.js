@@ -2,6 +2,9 @@
  * Module to exchange data between server and client. This is FlyFlix specific.
  */
 import { Color, MathUtils } from '/static/vendor/three.module.js';
+import { LogPolicy } from './log_policy.js';
+import { Timeline } from './timeline.js';
+import { SyncQueue } from './sync_queue.js';
 class DataExchanger{
 
     /**
@@ -11,13 +14,38 @@ class DataExchanger{
      * @param {Scene} scene
      * @param {Loop} loop - The animation loop
      * @param {Panels} panels - the group of panels
+     * @param {Mask} masks - the masks
+     * @param {number} logInterval - interval in ms for sending buffered log entries, 0 sends 
+     *      them once per animation frame
      */
-    constructor(camera, scene, loop, panels, masks){
+    constructor(camera, scene, loop, panels, masks, logInterval=0){
 
-        // The data exchanger connects to a Socket IO at port 17000
+        // The data exchanger connects to a Socket IO at port 17000 as arena display and joins 
+        // the session selected with `?session=<name>`, the default session otherwise
         const socketurl = window.location.hostname + ":17000";
-        this.socket = io(socketurl);
+        const session = new URLSearchParams(window.location.search).get('session') || '';
+        this.socket = io(socketurl, {query: {session: session, role: 'arena'}});
         this.isLogging = false;
+        this.isMetaEcho = true;
+        this.logBuffer = [];
+        this.logInterval = logInterval;
+        this.isFlushScheduled = false;
+        this.logPolicy = new LogPolicy();
+        this.latencyMark = null;
+        this.latencyReports = [];
+        this.latencyInterval = 1000;
+        loop.latencyProbe = this;
+        setInterval(() => this.flushLatency(), this.latencyInterval);
+        this.handlers = {};
+        this.timeline = new Timeline(
+            this.handlers,
+            (id, executed) => this.socket.emit('timeline-executed', id, executed),
+            (id) => this.socket.emit('timeline-finished', id));
+        loop.timeline = this.timeline;
+        this.syncQueue = new SyncQueue(
+            this.handlers,
+            (lid, at, time) => this.log(lid, 'de-sync-phase', time - at));
+        loop.syncQueue = this.syncQueue;
 
         const mr = MathUtils.degToRad(35);
 
@@ -26,12 +54,24 @@ class DataExchanger{
          *      and panels rotation.
          */
         this.socket.on('disconnect', () => {
+            this.logBuffer = [];
+            this.syncQueue.clear();
             const endEvent = new Event('end-experiment');
             panels.setRotateRadHz(0);
             camera.setRotateRadHz(0);
             window.dispatchEvent(endEvent);
         });
 
+        /**
+         * Event handler for `log-policy` replaces the policy that decides which log entries are 
+         *      sent to the server.
+         * 
+         * @param {Object} policy - normalized policy with `version` and `rules`
+         */
+        this.socket.on('log-policy', (policy) => {
+            this.logPolicy = new LogPolicy(policy);
+        });
+
         this.socket.on('experiment-started', () =>{
             const startExperiment = new Event('experiment-started');
             window.dispatchEvent(startExperiment);
@@ -43,13 +83,14 @@ class DataExchanger{
          * @param {bigint} lid - Loop ID
          * @param {number} speed - set rotational speed for panels in radians per second
          */
-        this.socket.on('speed', (lid, speed) => {
+        this._on('speed', (lid, speed) => {
+            this.markReceive(lid);
             panels.setLid(lid);
             panels.setRotateRadHz(speed);
             this.log(lid, 'de-panel-speed', speed);
         });
 
-        this.socket.on('oscillation', (lid, osc_freq, osc_width) => {
+        this._on('oscillation', (lid, osc_freq, osc_width) => {
             panels.setLid(lid);
             panels.setOscillation(osc_freq, osc_width);
             this.log(lid, 'de-panels-oscillation', osc_freq);
@@ -61,24 +102,35 @@ class DataExchanger{
          * 
          * @param {bigint} lid - Loop ID
          */
-        this.socket.on('ssync', (lid) => {
+        this._on('ssync', (lid) => {
             this.socket.emit('csync', performance.now(), lid, 'de-sync');
         });
 
+        /**
+         * Event handler for `cping` answers immediately with the current client time, so that 
+         *      the server can estimate offset and drift of the client clock.
+         * 
+         * @param {number} sequence - sequence number of the ping
+         */
+        this.socket.on('cping', (sequence) => {
+            this.socket.emit('cpong', sequence, performance.now());
+        });
+
         /**
          * Event handler for `rotate-to` message to rotate a panels object to a target rotation.
          * 
          * @param {bigint} lid - Loop ID
          * @param {number} targetRotationRad - target rotation in radians
          */
-        this.socket.on('rotate-to', (lid, targetRotationRad) => {
+        this._on('rotate-to', (lid, targetRotationRad) => {
+            this.markReceive(lid);
             panels.setLid(lid);
             panels.setRotationRad(targetRotationRad);
             this.log(lid, 'de-rotate-panel-to', targetRotationRad);
         })
 
 
-        this.socket.on('camera-flip', (lid, updown) => {
+        this._on('camera-flip', (lid, updown) => {
             camera.flipUpDown(updown);
             this.log(lid, 'de-flip-camera-updown', updown);
         }
@@ -90,7 +142,7 @@ class DataExchanger{
          * @param {bigint} lid - Loop ID
          * @param {number} fps - target client frame rate
          */
-        this.socket.on('fps', (lid, fps) => {
+        this._on('fps', (lid, fps) => {
             loop.setLid(lid);
             loop.setFPS(fps);
             this.log(lid, 'de-fps', fps);
@@ -103,7 +155,7 @@ class DataExchanger{
          * @param {number} barWidth - bar width in radians
          * @param {number} spaceWidth - interval width between bars in radians
          */
-        this.socket.on('spatial-setup', (lid, barWidth, spaceWidth, maskStart, maskEnd, fgColor, bgColor, barHeight) => {
+        this._on('spatial-setup', (lid, barWidth, spaceWidth, maskStart, maskEnd, fgColor, bgColor, barHeight) => {
             panels.setLid(lid);
             panels.changePanels(barWidth, spaceWidth, fgColor, bgColor, barHeight);
             //scene.changeBgColor(bgColor);
@@ -120,16 +172,94 @@ class DataExchanger{
         });
 
         /**
-         * Event handler for `meta`. The key and value will be logged.
+         * Event handler for `sync-at` schedules a stimulus change for the first frame at or after
+         *      the start time. The difference between the frame and the start time is logged as 
+         *      `de-sync-phase`.
+         * 
+         * @param {number} at - start time in client ms
+         * @param {string} event - name of the stimulus event, for example `speed`
+         * @param {Array} args - arguments of the event, starting with the Loop ID
+         */
+        this.socket.on('sync-at', (at, event, args) => {
+            this.syncQueue.schedule(at, event, args);
+        });
+
+        /**
+         * Event handler for `meta`. The key and value will be logged, unless the server logs its 
+         *      events itself. In that case the key is still passed to the log policy, so that 
+         *      `during` windows open and close and summaries are sent.
          * 
          * @param {bigint} lid - Loop ID
          * @param {string} key - key of key-value-pair
          * @param {string} value - value of key-value-pair
          */
-        this.socket.on('meta', (lid, key, value) => {
-            this.log(lid, key, value);
+        this._on('meta', (lid, key, value) => {
+            if (this.isMetaEcho){
+                this.log(lid, key, value);
+            } else {
+                this.observe(lid, key, value);
+            }
         })
 
+        /**
+         * Event handler for `meta-batch` handles the collected `meta` messages in the order they
+         *      were sent.
+         *
+         * @param {Array} entries - list of `[lid, key, value]`
+         */
+        this.socket.on('meta-batch', (entries) => {
+            for (const entry of entries){
+                this.handlers['meta'](...entry);
+            }
+        });
+
+        /**
+         * Event handler for `meta-echo` defines if `meta` messages are logged by the client.
+         * 
+         * @param {boolean} isMetaEcho - true if the client logs `meta` messages
+         */
+        this.socket.on('meta-echo', (isMetaEcho) => {
+            this.isMetaEcho = isMetaEcho;
+        });
+
+        /**
+         * Event handler for `timeline-load` replaces the timeline and confirms with 
+         *      `timeline-loaded`.
+         * 
+         * @param {bigint} id - timeline ID
+         * @param {Array} entries - list of `[offsetMs, event, args]`
+         */
+        this.socket.on('timeline-load', (id, entries) => {
+            this.timeline.load(id, entries);
+            this.log(id, 'de-timeline-load', entries.length);
+            this.socket.emit('timeline-loaded', id);
+        });
+
+        /**
+         * Event handler for `timeline-start` starts the loaded timeline with the next tick, or 
+         *      at the start time that the server assigned to all displays.
+         * 
+         * @param {bigint} id - timeline ID
+         * @param {number} startTime - start time in client ms, optional
+         */
+        this.socket.on('timeline-start', (id, startTime) => {
+            this.timeline.start(id, startTime);
+            this.log(id, 'de-timeline-start', id);
+        });
+
+        /**
+         * Event handler for `timeline-abort` stops the timeline and the panels.
+         * 
+         * @param {bigint} id - timeline ID
+         */
+        this.socket.on('timeline-abort', (id) => {
+            this.timeline.abort();
+            this.syncQueue.clear();
+            panels.setRotateRadHz(0);
+            panels.setOscillation(0, 0);
+            this.log(id, 'de-timeline-abort', id);
+        });
+
         /**
          * Local HTML event listener for click on `start-experiment` button which will emit the 
          *      socket message `start-experiment`.
@@ -140,11 +270,31 @@ class DataExchanger{
             this.log(0, 'de-start-experiment');
         });
 
+        /**
+         * Send the remaining log entries before the page is closed or reloaded.
+         */
+        window.addEventListener('beforeunload', () => {
+            this.flushLog();
+        });
+
     }
 
     /**
-     * Log client on the server by sending a `dl` message with the current client timestamp, lid, 
-     *      key, and value.
+     * (private) Register a handler for a stimulus event, both for messages from the server and 
+     *      for entries of a precompiled timeline.
+     * 
+     * @param {string} event - name of the event
+     * @param {function} handler - event handler
+     */
+    _on(event, handler){
+        this.handlers[event] = handler;
+        this.socket.on(event, handler);
+    }
+
+    /**
+     * Log client on the server. The current client timestamp, lid, key, and value are filtered 
+     *      by the log policy, buffered, and sent together with other log entries in a single 
+     *      `dl-batch` message.
      * 
      * @param {bigint} lid - Loop ID
      * @param {string} key - key of key-value-pair
@@ -152,7 +302,99 @@ class DataExchanger{
      */
     log(lid, key, value){
         if (this.isLogging){
-            this.socket.emit('dl', performance.now(), lid, key, value);
+            const entries = this.logPolicy.filter([performance.now(), lid, key, value]);
+            if (entries.length > 0){
+                this.logBuffer.push(...entries);
+                this._scheduleFlush();
+            }
+        }
+    }
+
+    /**
+     * Pass a marker to the log policy without logging it. Summaries that end with the marker 
+     *      are sent like other log entries.
+     * 
+     * @param {bigint} lid - Loop ID
+     * @param {string} key - key of key-value-pair
+     * @param {string} value - value of key-value-pair
+     */
+    observe(lid, key, value){
+        const entries = this.logPolicy.observe([performance.now(), lid, key, value]);
+        if (this.isLogging && entries.length > 0){
+            this.logBuffer.push(...entries);
+            this._scheduleFlush();
+        }
+    }
+
+    /**
+     * Send all buffered log entries in order as one `dl-batch` message. The version of the log 
+     *      policy tells the server that the entries were already filtered.
+     */
+    flushLog(){
+        this.isFlushScheduled = false;
+        if (this.logBuffer.length > 0){
+            this.socket.emit('dl-batch', this.logBuffer, this.logPolicy.version);
+            this.logBuffer = [];
+        }
+    }
+
+    /**
+     * Start measuring the latency for an update from the server. Only the latest update is 
+     *      followed until it is rendered.
+     * 
+     * @param {bigint} lid - Loop ID, the FicTrac frame counter for closed loop updates
+     */
+    markReceive(lid){
+        this.latencyMark = {cnt: lid, receive: performance.now(), tick: undefined};
+    }
+
+    /**
+     * Called by the loop after each tick.
+     * 
+     * @param {number} time - current time in ms
+     */
+    tickMark(time){
+        if (this.latencyMark && this.latencyMark.tick === undefined){
+            this.latencyMark.tick = time;
+        }
+    }
+
+    /**
+     * Called by the loop after each render. Completes the measurement of the current update.
+     * 
+     * @param {number} time - current time in ms
+     */
+    renderMark(time){
+        const mark = this.latencyMark;
+        if (mark && mark.tick !== undefined){
+            this.latencyReports.push([mark.cnt, mark.receive, mark.tick, time]);
+            this.latencyMark = null;
+        }
+    }
+
+    /**
+     * Send the collected latency measurements as one `latency-report` message.
+     */
+    flushLatency(){
+        if (this.latencyReports.length > 0){
+            this.socket.emit('latency-report', this.latencyReports);
+            this.latencyReports = [];
+        }
+    }
+
+    /**
+     * (private) Schedule sending the log buffer at the next animation frame or after 
+     *      `logInterval` ms.
+     */
+    _scheduleFlush(){
+        if (this.isFlushScheduled){
+            return;
+        }
+        this.isFlushScheduled = true;
+        if (this.logInterval > 0){
+            setTimeout(() => this.flushLog(), this.logInterval);
+        } else {
+            requestAnimationFrame(() => this.flushLog());
         }
     }
 }
@@ -0,0 +1,132 @@
+/**
+ * Module to reduce the number of log entries sent to the server. This is the client side
+ *      counterpart of `Experiment/log_policy.py` and uses the rules sent by the server.
+ */
+class LogPolicy {
+
+    /**
+     * Create a policy from the normalized rules sent by the server in the `log-policy` message.
+     *
+     * @constructor
+     * @param {Object} policy - object with `version` and `rules`, keys without a rule are kept
+     */
+    constructor(policy={version: null, rules: {}}) {
+        this.version = policy.version;
+        this.rules = policy.rules;
+        this.windows = new Map();
+        this.summaryWindows = new Map();
+        for (const [key, rule] of Object.entries(this.rules)) {
+            if (rule.during) {
+                this.windows.set(rule.during.join('\n'), false);
+            }
+            if (rule.action === 'summarize') {
+                if (!this.summaryWindows.has(rule.window)) {
+                    this.summaryWindows.set(rule.window, []);
+                }
+                this.summaryWindows.get(rule.window).push(key);
+            }
+        }
+        this.counters = new Map();
+        this.summaries = new Map();
+    }
+
+    /**
+     * Apply the policy to a single log entry.
+     *
+     * @param {Array} entry - log entry with client timestamp, lid, key, and value
+     * @returns {Array} - log entries that should be sent, including summaries
+     */
+    filter(entry) {
+        const key = entry[2];
+        const entries = this._observeMarker(key);
+        const rule = this.rules[key];
+        if (rule === undefined || this._accept(entry, rule)) {
+            entries.push(entry);
+        }
+        return entries;
+    }
+
+    /**
+     * Open or close `during` windows with a marker that is not logged itself, for example a 
+     *      `meta` message that the server logs.
+     *
+     * @param {Array} entry - log entry with client timestamp, lid, key, and value
+     * @returns {Array} - summary entries that end with this key
+     */
+    observe(entry) {
+        return this._observeMarker(entry[2]);
+    }
+
+    /**
+     * (private) Open or close `during` windows and return summaries that end with this key.
+     *
+     * @param {string} key - key of the log entry
+     * @returns {Array} - summary entries
+     */
+    _observeMarker(key) {
+        for (const window of this.windows.keys()) {
+            const [start, end] = window.split('\n');
+            if (key === start) {
+                this.windows.set(window, true);
+            } else if (key === end) {
+                this.windows.set(window, false);
+            }
+        }
+        const entries = [];
+        for (const skey of this.summaryWindows.get(key) || []) {
+            const summary = this.summaries.get(skey);
+            if (summary === undefined) {
+                continue;
+            }
+            this.summaries.delete(skey);
+            const last = summary.last;
+            const value = {
+                count: summary.count, min: summary.min, max: summary.max,
+                mean: summary.count > 0 ? summary.sum / summary.count : null};
+            entries.push([last[0], last[1], skey + '-summary', JSON.stringify(value)]);
+        }
+        return entries;
+    }
+
+    /**
+     * (private) Decide if an entry is kept.
+     *
+     * @param {Array} entry - log entry
+     * @param {Object} rule - normalized rule for the key of the entry
+     * @returns {boolean} - true if the entry should be sent
+     */
+    _accept(entry, rule) {
+        if (rule.during && !this.windows.get(rule.during.join('\n'))) {
+            return false;
+        }
+        const key = entry[2];
+        switch (rule.action) {
+            case 'keep':
+                return true;
+            case 'drop':
+                return false;
+            case 'decimate': {
+                const count = this.counters.get(key) || 0;
+                this.counters.set(key, count + 1);
+                return count % rule.every === 0;
+            }
+            default: {
+                if (!this.summaries.has(key)) {
+                    this.summaries.set(key, {count: 0, sum: 0, min: null, max: null, last: null});
+                }
+                const summary = this.summaries.get(key);
+                summary.last = entry;
+                const value = entry[3];
+                if (typeof value === 'number') {
+                    summary.count += 1;
+                    summary.sum += value;
+                    summary.min = summary.min === null ? value : Math.min(summary.min, value);
+                    summary.max = summary.max === null ? value : Math.max(summary.max, value);
+                }
+                return false;
+            }
+        }
+    }
+}
+
+export { LogPolicy };
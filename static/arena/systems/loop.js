@@ -17,6 +17,11 @@ class Loop {
      * @param {Camera} camera - Camera object to be animated
      * @param {Scene} scene - scene to be animated
      * @param {Renderer} renderer - renderer where the scene and camera are going to be animated
+     * 
+     * An optional `latencyProbe` with `tickMark(time)` and `renderMark(time)` methods is 
+     *      notified after each tick and each render. An optional `timeline` executes its due 
+     *      entries at the beginning of each tick, followed by the due changes of an optional 
+     *      `syncQueue`.
      */
     constructor(camera, scene, renderer) {
         this.camera = camera;
@@ -28,6 +33,9 @@ class Loop {
 
         this.lid = 0;
         this.loggable = null;
+        this.latencyProbe = null;
+        this.timeline = null;
+        this.syncQueue = null;
     }
 
     /**
@@ -38,6 +46,9 @@ class Loop {
             this.tick();
             if( this.rdelta > this.interval){
                 this.renderer.render(this.scene, this.camera);
+                if (this.latencyProbe){
+                    this.latencyProbe.renderMark(performance.now());
+                }
                 this.rdelta = this.rdelta % this.interval;
                 this._log('loop-render', this.rdelta);
             } else {
@@ -61,11 +72,21 @@ class Loop {
      */
     tick() {
         const delta = clock.getDelta();
+        const now = performance.now();
+        if (this.timeline){
+            this.timeline.tick(now);
+        }
+        if (this.syncQueue){
+            this.syncQueue.tick(now);
+        }
         this.rdelta += delta;
         this._log('loop-tick-delta', delta);
         for(const object of this.updateables) {
             object.tick(delta);
         }
+        if (this.latencyProbe){
+            this.latencyProbe.tickMark(performance.now());
+        }
     }
 
     /**
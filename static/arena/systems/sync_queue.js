@@ -0,0 +1,73 @@
+/**
+ * Stimulus changes that are applied at a given time, to keep several displays in sync.
+ */
+class SyncQueue {
+
+    /**
+     * The server sends each stimulus change of a synchronised session together with a start 
+     *      time in the clock of this client (`performance.now()`). A change is applied in the 
+     *      first tick at or after its start time by calling the handler for the event with the 
+     *      arguments. Displays with a good clock model therefore change on the same frame.
+     *
+     * @constructor
+     * @param {Object} handlers - map of event names to handler functions
+     * @param {function} report - called with the shared key, the start time, and the time of 
+     *      the tick for each group of changes with the same start time
+     */
+    constructor(handlers, report) {
+        this.handlers = handlers;
+        this.report = report;
+        this.entries = [];
+    }
+
+    /**
+     * Add a change. Changes with the same start time are applied in the order they arrive.
+     *
+     * @param {number} at - start time in ms
+     * @param {string} event - name of the event
+     * @param {Array} args - arguments for the handler, starting with the shared key
+     */
+    schedule(at, event, args) {
+        let position = this.entries.length;
+        while (position > 0 && this.entries[position - 1][0] > at){
+            position--;
+        }
+        this.entries.splice(position, 0, [at, event, args]);
+    }
+
+    /**
+     * Remove all changes that were not applied yet.
+     */
+    clear() {
+        this.entries = [];
+    }
+
+    /**
+     * Apply all changes that are due. Called by the loop at the beginning of each tick, so 
+     *      that the changes are shown in the frame that is rendered next.
+     *
+     * @param {number} time - current time in ms
+     */
+    tick(time) {
+        let count = 0;
+        while (count < this.entries.length && this.entries[count][0] <= time){
+            count++;
+        }
+        if (count === 0){
+            return;
+        }
+        let reportedAt;
+        for (const [at, event, args] of this.entries.splice(0, count)){
+            const handler = this.handlers[event];
+            if (handler){
+                handler(...args);
+            }
+            if (at !== reportedAt){
+                this.report(args[0], at, time);
+                reportedAt = at;
+            }
+        }
+    }
+}
+
+export { SyncQueue };
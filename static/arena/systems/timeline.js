@@ -0,0 +1,99 @@
+/**
+ * Execution of a precompiled timeline in the animation loop.
+ */
+class Timeline {
+
+    /**
+     * A timeline is a list of `[offsetMs, event, args]` entries that were compiled on the server.
+     *      Each entry is executed in the first tick at or after its offset from the start of the
+     *      timeline by calling the handler for the event with the arguments.
+     *
+     * @constructor
+     * @param {Object} handlers - map of event names to handler functions
+     * @param {function} report - called with the timeline ID and a list of `[index, time]` for
+     *      the entries executed in a tick
+     * @param {function} finish - called with the timeline ID once all entries are executed
+     */
+    constructor(handlers, report, finish) {
+        this.handlers = handlers;
+        this.report = report;
+        this.finish = finish;
+        this.id = undefined;
+        this.entries = [];
+        this.next = 0;
+        this.startTime = undefined;
+        this.isRunning = false;
+    }
+
+    /**
+     * Replace the timeline.
+     *
+     * @param {bigint} id - timeline ID
+     * @param {Array} entries - list of `[offsetMs, event, args]` sorted by offset
+     */
+    load(id, entries) {
+        this.id = id;
+        this.entries = entries;
+        this.next = 0;
+        this.startTime = undefined;
+        this.isRunning = false;
+    }
+
+    /**
+     * Start the timeline with the next tick, or at a given time to start it on several displays 
+     *      at once.
+     *
+     * @param {bigint} id - timeline ID, ignored if it is not the loaded timeline
+     * @param {number} startTime - client time in ms when the timeline starts, the next tick if 
+     *      not given
+     */
+    start(id, startTime) {
+        if (id === this.id){
+            this.startTime = startTime ?? undefined;
+            this.isRunning = true;
+        }
+    }
+
+    /**
+     * Stop executing the timeline.
+     */
+    abort() {
+        this.isRunning = false;
+        this.entries = [];
+    }
+
+    /**
+     * Execute all entries that are due. Called by the loop at the beginning of each tick, so
+     *      that the changes are shown in the frame that is rendered next.
+     *
+     * @param {number} time - current time in ms
+     */
+    tick(time) {
+        if (!this.isRunning || (this.startTime !== undefined && time < this.startTime)){
+            return;
+        }
+        if (this.startTime === undefined){
+            this.startTime = time;
+        }
+        const executed = [];
+        const offset = time - this.startTime;
+        while (this.next < this.entries.length && this.entries[this.next][0] <= offset){
+            const [, event, args] = this.entries[this.next];
+            const handler = this.handlers[event];
+            if (handler){
+                handler(...args);
+            }
+            executed.push([this.next, time]);
+            this.next++;
+        }
+        if (executed.length > 0){
+            this.report(this.id, executed);
+        }
+        if (this.next >= this.entries.length){
+            this.isRunning = false;
+            this.finish(this.id);
+        }
+    }
+}
+
+export { Timeline };
@@ -9,7 +9,7 @@ import { ExperimentControl } from './arena/systems/experiment_control.js';
  *    `three-container-bars.html` template file.
  */
 
-var socket = io();
+var socket = io({query: {session: new URLSearchParams(window.location.search).get('session') || '', role: 'observer'}});
 
 
 function main() {
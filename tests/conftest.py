@@ -0,0 +1,21 @@
+"""Fixtures shared by the tests"""
+
+import logging
+
+import pytest
+
+
+@pytest.fixture
+def logger(request):
+    """
+    Logger without other handlers, its handlers are closed at the end of the test.
+
+    :rtype: logging.Logger
+    """
+    logger = logging.getLogger(f"test.{request.node.name}")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
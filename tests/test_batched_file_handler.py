@@ -0,0 +1,24 @@
+"""Tests for the log handler with a background writer"""
+
+import threading
+
+from Experiment.batched_file_handler import BatchedFileHandler
+from Experiment.csv_formatter import CsvFormatter
+
+
+def test_flush_lets_the_writer_thread_write(tmp_path, logger):
+    path = tmp_path / "log.csv"
+    # long interval, only the flush starts a write
+    handler = BatchedFileHandler(str(path), flush_interval=60, mode='w')
+    handler.setFormatter(CsvFormatter())
+    logger.addHandler(handler)
+    writers = []
+    write_batch = handler._write_batch
+    handler._write_batch = lambda records: (
+        writers.append(threading.current_thread()), write_batch(records))
+    for index in range(3):
+        logger.info(["client", float(index), 0, "key", index])
+        handler.flush()
+        assert len(path.read_text().splitlines()) == index + 1
+    assert writers == [handler._writer] * 3
+    assert handler.written_count == 3
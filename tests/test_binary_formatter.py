@@ -0,0 +1,79 @@
+"""Tests for the binary log format and its conversion to CSV"""
+
+import pytest
+
+from Experiment.batched_file_handler import BatchedFileHandler
+from Experiment.binary_file_handler import BinaryFileHandler
+from Experiment.binary_formatter import BinaryFormatter, RECORD_SIZE
+from Experiment.binary_log_reader import BinaryLogReader
+from Experiment.csv_formatter import CsvFormatter
+
+ROWS = [
+    ["client", 12.5, 1700000000000000000, "trial-start", 3],
+    ["client", 13.0, 0, "text", "comma, \"quote\"\nnewline"],
+    ["server", 0, 0, "flag", True],
+    ["server", 0, 0, "nothing", None],
+    ["client", -1.25e-7, -5, "large", 2**70],
+    ["client", 14.0, 0, "object", {'a': [1, 2]}],
+    ["client", 15.0],
+]
+
+
+def test_rows_keep_values_and_types(tmp_path, logger):
+    path = tmp_path / "log.bin"
+    handler = BinaryFileHandler(str(path))
+    logger.addHandler(handler)
+    logger.info(ROWS[0])
+    logger.info(ROWS[1:], extra={'batch': True})
+    handler.close()
+
+    rows = list(BinaryLogReader(str(path)).rows())
+    assert path.stat().st_size == RECORD_SIZE * (len(ROWS) + 1)
+    assert [row[1:] for row in rows] == ROWS[:4] + [
+        ROWS[4][:4] + [str(2**70)], ROWS[5][:4] + ["{'a': [1, 2]}"], ROWS[6]]
+    assert [type(value) for value in rows[0]] == [int, str, float, int, str, int]
+    assert rows[2][5] is True
+    assert all(row[0] == rows[1][0] for row in rows[1:])
+
+
+def test_csv_export_matches_the_csv_log(tmp_path, logger):
+    binary_path = tmp_path / "log.bin"
+    csv_path = tmp_path / "log.csv"
+    csv_handler = BatchedFileHandler(str(csv_path), mode='w')
+    csv_handler.setFormatter(CsvFormatter())
+    binary_handler = BinaryFileHandler(str(binary_path))
+    logger.addHandler(binary_handler)
+    logger.addHandler(csv_handler)
+    for row in ROWS:
+        logger.info(row)
+    logger.info(ROWS, extra={'batch': True})
+    binary_handler.close()
+    csv_handler.close()
+
+    BinaryLogReader(str(binary_path)).to_csv(str(tmp_path / "export.csv"))
+    assert (tmp_path / "export.csv").read_text() == csv_path.read_text()
+
+
+def test_appended_logs_continue_the_string_table(tmp_path, logger):
+    path = tmp_path / "log.bin"
+    logged = [["client", 1.0, 0, "key", "first"], ["other", 2.0, 0, "key", "client"]]
+    for row in logged:
+        handler = BinaryFileHandler(str(path))
+        logger.addHandler(handler)
+        logger.info(row)
+        logger.removeHandler(handler)
+        handler.close()
+    strings = (tmp_path / "log.bin.strings").read_text().splitlines()
+    assert strings == ['"client"', '"key"', '"first"', '"other"']
+    assert [row[1:] for row in BinaryLogReader(str(path)).rows()] == logged
+
+
+def test_invalid_input_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        BinaryFormatter().format_row(0, list(range(6)))
+    with pytest.raises(TypeError):
+        BinaryFileHandler(str(tmp_path / "log.bin")).setFormatter(CsvFormatter())
+    (tmp_path / "other.bin").write_bytes(b"\x00" * RECORD_SIZE)
+    (tmp_path / "other.bin.strings").write_text("")
+    with pytest.raises(ValueError):
+        list(BinaryLogReader(str(tmp_path / "other.bin")).rows())
@@ -0,0 +1,108 @@
+"""Tests for the clock model and its estimation from ping exchanges"""
+
+import json
+import random
+
+import pytest
+
+from Experiment.clock_estimator import ClockEstimator
+from Experiment.clock_model import ClockModel, align_rows
+
+# client clock: starts at 0 ms when the server clock is at START_NS and runs SKEW slower
+START_NS = 1_700_000_000_000_000_000
+SKEW = 40e-6
+
+
+def server_ns_at(client_ms):
+    """
+    True server time of a client timestamp.
+
+    :param float client_ms: client time in ms
+    :rtype: float
+    """
+    return START_NS + client_ms * 1e6 * (1 + SKEW)
+
+
+def client_ms_at(server_ns):
+    """
+    True client time of a server timestamp.
+
+    :param float server_ns: server time in ns
+    :rtype: float
+    """
+    return (server_ns - START_NS) / (1e6 * (1 + SKEW))
+
+
+def exchange(estimator, sent_ns, delay_ns, queued_ns=0):
+    """
+    Simulate one ping exchange with symmetric network delay and queuing on the way back.
+
+    :param ClockEstimator estimator: estimator under test
+    :param float sent_ns: server time when the ping is sent
+    :param float delay_ns: one-way network delay
+    :param float queued_ns: additional delay of the pong
+    :rtype: None
+    """
+    sequence = estimator.ping(int(sent_ns))
+    client_ms = client_ms_at(sent_ns + delay_ns)
+    assert estimator.pong(sequence, client_ms, int(sent_ns + 2 * delay_ns + queued_ns))
+
+
+def test_model_without_exchanges_is_none():
+    assert ClockEstimator().model() is None
+
+
+def test_unknown_pong_is_ignored():
+    estimator = ClockEstimator()
+    assert not estimator.pong(5, 1.0, START_NS)
+    assert estimator.model() is None
+
+
+def test_offset_and_skew_are_recovered_from_symmetric_exchanges():
+    estimator = ClockEstimator()
+    for index in range(64):
+        exchange(estimator, START_NS + index * 1e9, 2e6)
+    model = estimator.model()
+    assert model.samples == 64
+    assert model.skew == pytest.approx(SKEW, rel=1e-3)
+    for client_ms in (0.0, 30_000.0, 63_000.0):
+        assert model.to_server_ns(client_ms) == pytest.approx(server_ns_at(client_ms), abs=1e3)
+    assert model.error_ns == pytest.approx(2e6, rel=1e-3)
+
+
+def test_exchanges_with_queuing_delays_are_left_out():
+    rng = random.Random(3)
+    estimator = ClockEstimator(best_fraction=0.25)
+    for index in range(64):
+        queued_ns = rng.uniform(5e6, 50e6) if index % 2 else 0
+        exchange(estimator, START_NS + index * 1e9, 1e6, queued_ns)
+    model = estimator.model()
+    assert model.skew == pytest.approx(SKEW, rel=1e-2)
+    assert model.to_server_ns(32_000.0) == pytest.approx(server_ns_at(32_000.0), abs=1e4)
+    assert model.error_ns < 1.1e6
+
+
+def test_conversion_in_both_directions():
+    model = ClockModel(offset_ns=START_NS + 5e9, skew=SKEW, ref_ms=5000.0)
+    # server timestamps around 1.7e18 ns are only resolved to 256 ns as float
+    for client_ms in (0.0, 1234.5, 99_999.0):
+        assert model.to_client_ms(model.to_server_ns(client_ms)) == pytest.approx(
+            client_ms, abs=1e-3)
+    assert ClockModel.from_dict(model.as_dict()).as_dict() == model.as_dict()
+
+
+def test_align_rows_uses_the_latest_model_of_each_client():
+    first = ClockModel(offset_ns=1_000_000_000)
+    second = ClockModel(offset_ns=2_000_000_000)
+    rows = [
+        ["100", "a", "1.0", "0", "early", "x"],
+        ["200", "server", "0", "0", "clock-model", json.dumps(first.as_dict())],
+        ["200", "a", "0", "0", "clock-model", json.dumps(first.as_dict())],
+        ["300", "a", "2.0", "0", "tick", "x"],
+        ["400", "a", "0", "0", "clock-model", json.dumps(second.as_dict())],
+        ["500", "a", "3.0", "0", "tick", "x"],
+        ["600", "b", "4.0", "0", "tick", "x"],
+        ["700", "a", "0", "0", "no-timestamp", "x"]]
+    aligned = [row[-1] for row in align_rows(rows)]
+    assert aligned == [
+        1_001_000_000, None, None, 1_002_000_000, None, 2_003_000_000, None, None]
@@ -0,0 +1,138 @@
+"""Tests for the log policy on the server and its client counterpart"""
+
+import json
+import shutil
+import subprocess
+
+from pathlib import Path
+
+import pytest
+
+from Experiment.log_policy import LogPolicy
+
+CLIENT_POLICY = Path(__file__).parent.parent / "static" / "arena" / "systems" / "log_policy.js"
+
+
+def rows(keys, sid="client"):
+    """
+    Log rows with one row per key and the position as value.
+
+    :param list keys: key of each row
+    :param str sid: client id
+    :rtype: list
+    """
+    return [[sid, float(index), 0, key, index] for index, key in enumerate(keys)]
+
+
+def kept_keys(policy, keys):
+    """
+    Keys of the rows that the policy keeps.
+
+    :param LogPolicy policy: policy under test
+    :param list keys: key of each row
+    :rtype: list
+    """
+    return [row[3] for row in policy.filter_rows(rows(keys))]
+
+
+def test_keys_without_rule_are_kept():
+    policy = LogPolicy({'loop-skip': 'drop'})
+    assert kept_keys(policy, ['a', 'loop-skip', 'b']) == ['a', 'b']
+    assert LogPolicy().filter_rows(rows(['loop-skip'])) == rows(['loop-skip'])
+
+
+def test_decimate_keeps_every_nth_row_per_client():
+    policy = LogPolicy({'tick': {'action': 'decimate', 'every': 3}})
+    kept = policy.filter_rows(rows(['tick'] * 7, sid="a") + rows(['tick'] * 4, sid="b"))
+    assert [(row[0], row[4]) for row in kept] == [
+        ("a", 0), ("a", 3), ("a", 6), ("b", 0), ("b", 3)]
+
+
+def test_decimate_below_one_keeps_all_rows():
+    with pytest.warns(UserWarning):
+        policy = LogPolicy({'tick': {'action': 'decimate', 'every': 0}})
+    assert kept_keys(policy, ['tick'] * 3) == ['tick'] * 3
+
+
+def test_during_only_keeps_rows_inside_the_window():
+    policy = LogPolicy({'tick': {'action': 'keep', 'during': ['start', 'end']}})
+    keys = ['tick', 'start', 'tick', 'tick', 'end', 'tick', 'start', 'tick']
+    assert kept_keys(policy, keys) == ['start', 'tick', 'tick', 'end', 'start', 'tick']
+
+
+def test_summarize_reports_at_the_window_key():
+    policy = LogPolicy({'render': {'action': 'summarize', 'window': 'trial-end'}})
+    keys = ['render', 'render', 'other', 'render', 'trial-end', 'render']
+    kept = policy.filter_rows(rows(keys))
+    assert [row[3] for row in kept] == ['other', 'render-summary', 'trial-end']
+    summary = json.loads(kept[1][4])
+    assert summary == {'count': 3, 'min': 0, 'max': 3, 'mean': pytest.approx(4 / 3)}
+    assert kept[1][1] == 3.0
+    flushed = policy.flush_summaries()
+    assert [row[3] for row in flushed] == ['render-summary']
+    assert json.loads(flushed[0][4])['count'] == 1
+    assert policy.flush_summaries() == []
+
+
+def test_summarize_ignores_values_that_are_not_numbers():
+    policy = LogPolicy({'render': 'summarize'})
+    policy.filter_rows([["c", 1.0, 0, 'render', "text"], ["c", 2.0, 0, 'render', True]])
+    summary = json.loads(policy.flush_summaries()[0][4])
+    assert summary == {'count': 0, 'min': None, 'max': None, 'mean': None}
+
+
+def test_markers_open_windows_without_being_logged_by_the_policy():
+    policy = LogPolicy({'tick': {'action': 'summarize', 'during': ['start', 'end']}})
+    kept = policy.filter_rows(rows(['start', 'tick', 'tick', 'end']))
+    assert [row[3] for row in kept] == ['start', 'tick-summary', 'end']
+
+
+def test_invalid_rules_are_rejected():
+    with pytest.raises(ValueError):
+        LogPolicy({'tick': 'compress'})
+    with pytest.raises(ValueError):
+        LogPolicy({'tick': {'action': 'keep', 'during': ['start']}})
+
+
+def test_version_depends_on_the_normalized_rules():
+    short = LogPolicy({'a': 'drop', 'b': {'action': 'decimate', 'every': 2}})
+    long = LogPolicy({
+        'b': {'action': 'decimate', 'every': '2', 'window': 'trial-end'},
+        'a': {'action': 'drop'}})
+    assert short.version == long.version
+    assert short.version != LogPolicy({'a': 'drop'}).version
+    assert short.as_dict() == {'version': short.version, 'rules': short.rules}
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="node is not installed")
+def test_client_policy_matches_server_policy(tmp_path):
+    policy = LogPolicy({
+        'skip': 'drop',
+        'tick': {'action': 'decimate', 'every': 2},
+        'render': {'action': 'summarize', 'window': 'trial-end'},
+        'rotation': {'action': 'keep', 'during': ['start', 'end']}})
+    keys = [
+        'tick', 'rotation', 'start', 'skip', 'tick', 'render', 'rotation', 'tick', 'render',
+        'end', 'rotation', 'tick', 'trial-end', 'other']
+    entries = [[float(index), 0, key, index] for index, key in enumerate(keys)]
+
+    shutil.copy(CLIENT_POLICY, tmp_path / "log_policy.mjs")
+    (tmp_path / "run.mjs").write_text(
+        "import { LogPolicy } from './log_policy.mjs';\n"
+        "const [policy, entries] = JSON.parse(process.argv[2]);\n"
+        "const client = new LogPolicy(policy);\n"
+        "const sent = entries.flatMap((entry) => client.filter(entry));\n"
+        "console.log(JSON.stringify({version: client.version, sent: sent}));\n")
+    result = subprocess.run(
+        ["node", str(tmp_path / "run.mjs"), json.dumps([policy.as_dict(), entries])],
+        capture_output=True, text=True, check=True)
+    client = json.loads(result.stdout)
+
+    assert client['version'] == policy.version
+    expected = policy.filter_rows([["client"] + entry for entry in entries])
+    assert [entry[2] for entry in client['sent']] == [row[3] for row in expected]
+    for entry, row in zip(client['sent'], expected):
+        if entry[2].endswith('-summary'):
+            assert json.loads(entry[3]) == json.loads(row[4])
+        else:
+            assert entry == row[1:]
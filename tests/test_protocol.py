@@ -0,0 +1,91 @@
+"""Tests for protocols declared in YAML"""
+
+import gc
+import weakref
+
+from pathlib import Path
+
+import pytest
+
+from Experiment.log_policy import LogPolicy
+from Experiment.protocol import Protocol, ProtocolError
+
+PROTOCOLS = Path(__file__).parent.parent / "protocols"
+
+
+def descriptors(trial):
+    """
+    Conditions of a trial together with their spatial-temporal descriptions.
+
+    :param Trial trial: trial of a protocol
+    :rtype: list
+    """
+    return [
+        item for condition in trial.conditions
+        for item in (condition, condition.spatial_temporal)]
+
+
+def test_repetitions_reuse_the_descriptors_of_a_loaded_protocol():
+    protocol = Protocol.load(PROTOCOLS / "grating.yaml")
+    assert protocol.repetitions == 2
+    # only weak references, the protocol has to keep the descriptors alive
+    created = {}
+    for _, repetition, trial in protocol.sequence():
+        first = created.setdefault(
+            trial.trial_id, [weakref.ref(item) for item in descriptors(trial)])
+        if repetition == 1:
+            assert [ref() for ref in first] == descriptors(trial)
+            assert all(ref() is item for ref, item in zip(first, descriptors(trial)))
+        del trial
+        gc.collect()
+    assert len(created) == len(protocol)
+
+
+def test_identical_stimuli_share_one_descriptor(tmp_path):
+    path = tmp_path / "shared.yaml"
+    path.write_text(
+        "blocks:\n"
+        "  - grid:\n"
+        "      label: [a, b, c]\n"
+        "    trial:\n"
+        "      bar_deg: 30\n"
+        "      rotate_deg_hz: 90\n"
+        "      openloop_duration: 1000\n"
+        "      comment: \"trial {label}\"\n")
+    protocol = Protocol.load(path)
+    trials = [protocol[index] for index in range(len(protocol))]
+    gc.collect()
+    assert [trial.comment for trial in trials] == ["trial a", "trial b", "trial c"]
+    first = descriptors(trials[0])
+    for trial in trials[1:]:
+        assert all(a is b for a, b in zip(descriptors(trial), first))
+    assert protocol[1].trial_id == 1 and protocol[1].conditions is trials[1].conditions
+
+
+def write_protocol(tmp_path, log_policy):
+    """
+    Protocol file with one trial and a log policy.
+
+    :param pathlib.Path tmp_path: directory of the file
+    :param str log_policy: YAML of the `log-policy` key
+    :rtype: pathlib.Path
+    """
+    path = tmp_path / "policy.yaml"
+    path.write_text(
+        f"log-policy: {log_policy}\n"
+        "blocks:\n"
+        "  - trial:\n"
+        "      bar_deg: 30\n"
+        "      openloop_duration: 1000\n")
+    return path
+
+
+def test_log_policy_of_a_protocol_is_validated(tmp_path):
+    protocol = Protocol.load(write_protocol(
+        tmp_path, "{loop-skip: drop, loop-tick-delta: {action: decimate, every: 10}}"))
+    assert LogPolicy(protocol.log_policy).rules['loop-tick-delta']['every'] == 10
+    assert Protocol({'blocks': [{'trial': {'bar_deg': 30}}]}).log_policy is None
+    for invalid in ("[drop]", "{loop-skip: remove}", "{loop-skip: 3}",
+                    "{loop-render: {action: keep, during: [trial-start]}}"):
+        with pytest.raises(ProtocolError):
+            Protocol.load(write_protocol(tmp_path, invalid))
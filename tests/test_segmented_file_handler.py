@@ -0,0 +1,163 @@
+"""Tests for the segmented CSV log and the extraction of single trials"""
+
+import gzip
+import json
+
+from pathlib import Path
+
+import pytest
+
+from Experiment.csv_formatter import CsvFormatter
+from Experiment.segmented_file_handler import SegmentedFileHandler
+
+HEADER = ["client_id", "client_timestamp", "request_timestamp", "key", "value"]
+
+
+def open_log(logger, basename, **kwargs):
+    """
+    Attach a segmented handler to a logger.
+
+    :param logging.Logger logger: logger that receives the handler
+    :param pathlib.Path basename: path of the log without suffix
+    :param kwargs: see SegmentedFileHandler
+    :rtype: SegmentedFileHandler
+    """
+    handler = SegmentedFileHandler(str(basename), header=HEADER, **kwargs)
+    handler.setFormatter(CsvFormatter())
+    logger.addHandler(handler)
+    return handler
+
+
+def log_trial(logger, handler, trial, rows=20):
+    """
+    Log a trial with one write batch per row.
+
+    :param logging.Logger logger: logger with the handler
+    :param SegmentedFileHandler handler: handler under test
+    :param int trial: shared key of the trial
+    :param int rows: number of rows between `trial-start` and `trial-end`
+    :rtype: None
+    """
+    logger.info(["server", 0, trial, "trial-start", trial])
+    handler.flush()
+    for index in range(rows):
+        logger.info(["client", float(index), trial, "tick", f"{trial}-{index}"])
+        handler.flush()
+    logger.info(["server", 0, trial, "trial-end", trial])
+    handler.flush()
+
+
+def read_segment(path):
+    """
+    Content of a segment.
+
+    :param pathlib.Path path: path of the segment
+    :rtype: str
+    """
+    if path.suffix == ".gz":
+        with gzip.open(path, "rt", encoding="utf-8") as stream:
+            return stream.read()
+    return path.read_text(encoding="utf-8")
+
+
+def index_entries(path):
+    """
+    Entries in the index of a segment.
+
+    :param pathlib.Path path: path of the segment
+    :rtype: list
+    """
+    with open(f"{path}.index", "r", encoding="utf-8") as stream:
+        return [json.loads(line) for line in stream]
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_extract_returns_the_rows_of_one_trial(tmp_path, logger, compress):
+    handler = open_log(logger, tmp_path / "log", compress=compress)
+    logger.info(["client", 0.0, 0, "before", 0])
+    for trial in (11, 12, 13):
+        log_trial(logger, handler, trial)
+        logger.info(["client", 0.0, 0, "between", trial])
+    handler.close()
+
+    segment = handler.filename
+    assert [(entry['key'], entry['shared_key']) for entry in index_entries(segment)] == [
+        (key, trial) for trial in (11, 12, 13) for key in ("trial-start", "trial-end")]
+    lines = SegmentedFileHandler.extract(segment, 12).splitlines()
+    assert len(lines) == 22
+    assert lines[0].endswith('"12","trial-start","12"')
+    assert lines[-1].endswith('"12","trial-end","12"')
+    assert all('"tick","12-' in line for line in lines[1:-1])
+    content = read_segment(Path(segment))
+    assert content.splitlines()[0].endswith(
+        '"client_id","client_timestamp","request_timestamp","key","value"')
+    assert SegmentedFileHandler.extract(segment, "13") in content
+
+
+def test_extract_reads_a_trial_that_is_still_running(tmp_path, logger):
+    handler = open_log(logger, tmp_path / "log")
+    log_trial(logger, handler, 1)
+    logger.info(["server", 0, 2, "trial-start", 2])
+    logger.info(["client", 0.0, 2, "tick", "2-0"])
+    handler.flush()
+    lines = SegmentedFileHandler.extract(handler.filename, 2).splitlines()
+    assert [line.rsplit(",", 2)[1] for line in lines] == ['"trial-start"', '"tick"']
+    handler.close()
+
+
+def test_extract_of_an_unknown_trial_fails(tmp_path, logger):
+    handler = open_log(logger, tmp_path / "log")
+    log_trial(logger, handler, 1)
+    handler.close()
+    with pytest.raises(KeyError):
+        SegmentedFileHandler.extract(handler.filename, 2)
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_size_rotation_keeps_trials_in_one_segment(tmp_path, logger, compress):
+    handler = open_log(logger, tmp_path / "log", compress=compress, max_bytes=500)
+    for trial in range(1, 5):
+        log_trial(logger, handler, trial)
+    handler.close()
+
+    segments = sorted(tmp_path.glob("log_*.csv.gz" if compress else "log_*.csv"))
+    # the segment after the last trial is started but stays empty
+    assert len(segments) == 5
+    assert read_segment(segments[-1]) == "" and index_entries(segments[-1]) == []
+    for trial, segment in enumerate(segments[:-1], 1):
+        assert [entry['shared_key'] for entry in index_entries(segment)] == [trial, trial]
+        lines = SegmentedFileHandler.extract(str(segment), trial).splitlines()
+        assert len(lines) == 22
+        content = read_segment(segment).splitlines()
+        assert content[0].endswith('"key","value"')
+        assert content[1:] == lines
+
+
+def test_rotate_starts_a_new_segment_after_the_queued_rows(tmp_path, logger):
+    handler = open_log(logger, tmp_path / "log", compress=False)
+    log_trial(logger, handler, 1, rows=0)
+    logger.info(["client", 0.0, 0, "first", 1])
+    handler.rotate()
+    logger.info(["client", 0.0, 0, "second", 2])
+    handler.close()
+    first, second = sorted(tmp_path.glob("log_*.csv"))
+    assert first.name == "log_000.csv" and second.name == "log_001.csv"
+    assert [line.rsplit(",", 2)[1] for line in first.read_text().splitlines()] == [
+        '"key"', '"trial-start"', '"trial-end"', '"first"']
+    assert [line.rsplit(",", 2)[1] for line in second.read_text().splitlines()] == [
+        '"key"', '"second"']
+
+
+def test_rotate_continues_a_segment_without_trials(tmp_path, logger):
+    handler = open_log(logger, tmp_path / "log", compress=False)
+    logger.info(["server", 0, 0, "log-policy", "{}"])
+    handler.rotate()
+    log_trial(logger, handler, 1, rows=0)
+    handler.rotate()
+    handler.rotate()
+    log_trial(logger, handler, 2, rows=0)
+    handler.close()
+    first, second = sorted(tmp_path.glob("log_*.csv"))
+    assert [line.rsplit(",", 2)[1] for line in first.read_text().splitlines()] == [
+        '"key"', '"log-policy"', '"trial-start"', '"trial-end"']
+    assert [entry['shared_key'] for entry in index_entries(second)] == [2, 2]
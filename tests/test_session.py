@@ -0,0 +1,86 @@
+"""Tests for the state of a session"""
+
+import threading
+import time
+
+from Experiment.fictrac_archive import FicTracArchive
+from Experiment.fictrac_frame import FicTracFrame
+from Experiment.fictrac_reader import FicTracReader
+from Experiment.session import Session
+
+
+def test_fictrac_is_started_once_per_run():
+    session = Session("rig", object())
+    run = session.start_fictrac()
+    assert session.reads_fictrac(run)
+    assert session.start_fictrac() is None
+    session.stop_fictrac()
+    assert not session.reads_fictrac(run)
+
+
+def test_tasks_of_a_stopped_run_end_when_a_new_run_starts():
+    session = Session("rig", object())
+    first = session.start_fictrac()
+    session.stop_fictrac()
+    second = session.start_fictrac()
+    assert second != first
+    assert not session.reads_fictrac(first)
+    assert session.reads_fictrac(second)
+
+
+def publish(reader, first, last):
+    """
+    Send frames to all subscribers of a reader, as the reader does for received frames.
+
+    :param FicTracReader reader: reader of the session
+    :param int first: counter of the first frame
+    :param int last: counter of the last frame
+    :rtype: None
+    """
+    for cnt in range(first, last + 1):
+        frame = FicTracFrame(cnt, 0.1 * cnt, 10.0 * cnt, received_ns=cnt, values=(cnt,))
+        for subscription in reader.subscriptions:
+            subscription.put(frame)
+
+
+def wait_for(condition, timeout=5.0):
+    """
+    Wait until a condition is met.
+
+    :param callable condition: checked every millisecond
+    :param float timeout: maximum time to wait in seconds
+    :rtype: None
+    """
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.001)
+
+
+def test_stop_and_restart_archive_each_frame_once(tmp_path):
+    session = Session("rig", object())
+    reader = FicTracReader("127.0.0.1", 0)
+    session.fictrac_reader = reader
+    session.fictrac_archive = FicTracArchive(str(tmp_path / "log.fictrac"))
+    archive = session.fictrac_archive
+    writers = []
+    try:
+        for first in (1, 4):
+            subscriptions = list(reader.subscriptions)
+            writer = threading.Thread(
+                target=session.archive_fictrac, args=(session.start_fictrac(),), daemon=True)
+            writer.start()
+            writers.append(writer)
+            wait_for(lambda known=subscriptions: any(
+                subscription not in known for subscription in reader.subscriptions))
+            publish(reader, first, first + 2)
+            wait_for(lambda last=first + 2: archive.frame_count >= last)
+            # the writer of the stopped run is still subscribed when the next run starts
+            session.stop_fictrac()
+    finally:
+        session.stop_fictrac()
+    for writer in writers:
+        writer.join()
+    archive.close()
+    assert list(FicTracArchive.read(archive.filename)['frame']) == [1, 2, 3, 4, 5, 6]
+    assert reader.subscriptions == []
@@ -0,0 +1,82 @@
+"""Tests for the Socket.IO wrapper of a session"""
+
+from Experiment.session_socket import SessionSocket
+
+
+class RecordingSocketIO():
+    """Stand-in for the Socket.IO server that records the sent messages"""
+
+    def __init__(self) -> None:
+        """Simple constructor"""
+        self.messages = []
+
+    def emit(self, event, *args, **kwargs) -> None:
+        """
+        Record a message.
+
+        :param str event: name of the event
+        :param args: content of the message
+        :rtype: None
+        """
+        self.messages.append((event, *args))
+
+
+def test_trial_markers_send_the_meta_batch():
+    socket_io = RecordingSocketIO()
+    socket = SessionSocket(socket_io, batch_meta=True)
+    socket.emit("meta", (1, "comment", "first"))
+    assert socket_io.messages == []
+    socket.emit("meta", (1, "trial-start", 1))
+    assert socket_io.messages == [("meta-batch", [[1, "comment", "first"], [1, "trial-start", 1]])]
+    socket.emit("meta", (2, "openloop-trial-start", 3))
+    assert len(socket_io.messages) == 1
+    socket.flush_keys.add("openloop-trial-start")
+    socket.emit("meta", (2, "openloop-trial-start", 3))
+    socket.emit("meta", (3, "trial-end", 1))
+    assert [message[1] for message in socket_io.messages[1:]] == [
+        [[2, "openloop-trial-start", 3], [2, "openloop-trial-start", 3]],
+        [[3, "trial-end", 1]]]
+
+
+class SleepingSocketIO(RecordingSocketIO):
+    """Stand-in for the Socket.IO server that records sleeps"""
+
+    def __init__(self) -> None:
+        """Simple constructor"""
+        super().__init__()
+        self.sleeps = []
+
+    def sleep(self, seconds=0) -> None:
+        """
+        Record a sleep without sleeping.
+
+        :param float seconds: duration in seconds
+        :rtype: None
+        """
+        self.sleeps.append(seconds)
+
+
+class UnmeasuredClock():
+    """Clock estimator of a client without measurements"""
+
+    def model(self) -> None:
+        """
+        No model of the client clock yet.
+
+        :rtype: None
+        """
+        return None
+
+
+def test_immediate_messages_wait_for_the_last_synced_change():
+    socket_io = SleepingSocketIO()
+    socket = SessionSocket(socket_io, sync_lead_ms=50)
+    socket.wait_for_sync()
+    assert socket_io.sleeps == []
+    socket.clocks["display"] = UnmeasuredClock()
+    socket.emit("rotate-to", (1, 0.5))
+    socket.wait_for_sync()
+    assert len(socket_io.sleeps) == 1 and 0.04 < socket_io.sleeps[0] <= 0.05
+    socket.sync_at_ns -= 60_000_000
+    socket.wait_for_sync()
+    assert len(socket_io.sleeps) == 1
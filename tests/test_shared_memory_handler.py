@@ -0,0 +1,93 @@
+"""Tests for the shared-memory ring and the log handler with a writer process"""
+
+import csv
+
+from pathlib import Path
+
+import pytest
+
+from Experiment.batched_file_handler import BatchedFileHandler
+from Experiment.csv_formatter import CsvFormatter
+from Experiment.shared_memory_handler import (
+    KIND_RECORD, KIND_ROTATE, _WRITE_POS, SharedMemoryHandler, SharedMemoryRing)
+
+from .test_binary_formatter import ROWS
+
+
+@pytest.fixture
+def ring():
+    """
+    Ring with 8 slots of 16 bytes, removed at the end of the test.
+
+    :rtype: SharedMemoryRing
+    """
+    ring = SharedMemoryRing(capacity=8, slot_size=16)
+    yield ring
+    ring.close()
+
+
+def test_records_wrap_around_the_end_of_the_ring(ring):
+    pushed = []
+    for index in range(40):
+        # 1 or 2 slots, records start at every position of the ring
+        payload = bytes(range(index, index + 5 + 9 * (index % 3)))
+        assert ring.push(KIND_RECORD, payload)
+        pushed.append(payload)
+        if len(pushed) > 1:
+            assert ring.pop() == (KIND_RECORD, pushed.pop(0))
+    while pushed:
+        assert ring.pop() == (KIND_RECORD, pushed.pop(0))
+    assert ring.pop() is None
+    assert ring.used() == 0 and ring.get(_WRITE_POS) > 4 * ring.capacity
+
+
+def test_push_fails_when_the_ring_is_full(ring):
+    for index in range(ring.capacity):
+        assert ring.push(KIND_RECORD, bytes([index]) * 11)
+    assert not ring.push(KIND_ROTATE, b"")
+    assert ring.pop() == (KIND_RECORD, bytes([0]) * 11)
+    # a record of two slots does not fit into the single free slot
+    assert not ring.push(KIND_RECORD, b"x" * 12)
+    assert ring.push(KIND_RECORD, b"x" * 11)
+    assert ring.used() == ring.capacity
+    assert [ring.pop() for _ in range(ring.capacity)][-1] == (KIND_RECORD, b"x" * 11)
+
+
+def read_rows(path):
+    """
+    Rows of a CSV log without the server timestamp.
+
+    :param pathlib.Path path: path of the log
+    :rtype: list
+    """
+    with open(path, "r", encoding="utf-8", newline="") as stream:
+        return [row[1:] for row in csv.reader(stream)]
+
+
+def test_writer_process_writes_the_same_log(tmp_path, logger, monkeypatch):
+    # the writer process imports the Experiment package from the working directory
+    monkeypatch.chdir(Path(__file__).parent.parent)
+    csv_handler = BatchedFileHandler(str(tmp_path / "direct.csv"), mode='w')
+    csv_handler.setFormatter(CsvFormatter())
+    handler = SharedMemoryHandler(
+        BatchedFileHandler, str(tmp_path / "ring.csv"), formatter_class=CsvFormatter,
+        capacity=64, slot_size=64, mode='w')
+    logger.addHandler(csv_handler)
+    logger.addHandler(handler)
+    for _ in range(3):
+        for row in ROWS:
+            logger.info(row)
+        logger.info(ROWS, extra={'batch': True})
+    handler.flush()
+    assert handler.stats()['written'] == 6 * len(ROWS)
+    assert handler.dropped_count == 0
+    logger.removeHandler(handler)
+    handler.close()
+    csv_handler.close()
+
+    assert handler.process.returncode == 0
+    assert read_rows(tmp_path / "ring.csv") == read_rows(tmp_path / "direct.csv")
+    # each string is sent to the writer process once
+    assert handler.encoder.string_count == len(
+        {str(value) for row in ROWS for value in row if isinstance(value, (str, dict))}
+        | {str(2**70)})
@@ -0,0 +1,136 @@
+"""Tests for the order of the trials in a protocol"""
+
+from collections import Counter
+
+import pytest
+
+from Experiment.trial_sequence import TrialSequence, latin_square, play_trials
+
+
+class FakeTrial():
+    """Trial that only records when it is triggered"""
+
+    def __init__(self, name, triggered) -> None:
+        """
+        :param str name: name of the trial
+        :param list triggered: receives the id and name of the trial when it is triggered
+        """
+        self.name = name
+        self.triggered = triggered
+        self.trial_id = None
+
+    def set_id(self, trial_id) -> None:
+        """
+        :param int trial_id: id of the trial
+        """
+        self.trial_id = trial_id
+
+    def trigger(self, socket_io) -> None:
+        """
+        :param socket_io: ignored
+        """
+        self.triggered.append((self.trial_id, self.name))
+
+
+class Recorder():
+    """Target of `play_trials` that records the emitted messages"""
+
+    def __init__(self) -> None:
+        self.messages = []
+
+    def emit(self, event, *args) -> None:
+        """
+        :param str event: name of the message
+        :param args: content of the message
+        """
+        self.messages.append((event, args))
+
+
+def orders(sequence):
+    """
+    Block positions of all repetitions of a sequence over a block of integers.
+
+    :param TrialSequence sequence: sequence under test
+    :rtype: list
+    """
+    rows = {}
+    for _, repetition, trial in sequence:
+        rows.setdefault(repetition, []).append(trial)
+    return [rows[repetition] for repetition in sorted(rows)]
+
+
+@pytest.mark.parametrize("size", [2, 3, 4, 5, 6, 7])
+def test_latin_square_is_balanced(size):
+    rows = size if size % 2 == 0 else 2 * size
+    square = [[latin_square(size, row, column) for column in range(size)] for row in range(rows)]
+    for row in square:
+        assert sorted(row) == list(range(size))
+    for column in range(size):
+        assert Counter(row[column] for row in square) == {
+            value: rows // size for value in range(size)}
+    successors = Counter(pair for row in square for pair in zip(row, row[1:]))
+    assert len(successors) == size * (size - 1)
+    assert set(successors.values()) == {rows // size}
+
+
+def test_latin_square_order_depends_on_the_seed():
+    block = list(range(4))
+    first = orders(TrialSequence(block, repetitions=4, order="latin-square", seed=1))
+    shifted = orders(TrialSequence(block, repetitions=3, order="latin-square", seed=2))
+    assert first[1:] == shifted
+
+
+def test_shuffle_is_reproducible_with_the_same_seed():
+    block = list(range(20))
+    sequence = TrialSequence(block, repetitions=3, order="shuffle", seed=42)
+    first = orders(sequence)
+    assert first == orders(TrialSequence(block, repetitions=3, order="shuffle", seed=42))
+    assert first != orders(TrialSequence(block, repetitions=3, order="shuffle", seed=43))
+    assert all(sorted(row) == block for row in first)
+    assert first[0] != first[1]
+
+
+def test_random_seed_is_reported():
+    sequence = TrialSequence(list(range(5)), order="shuffle")
+    again = TrialSequence(list(range(5)), order="shuffle", seed=sequence.as_dict()['seed'])
+    assert orders(sequence) == orders(again)
+
+
+@pytest.mark.parametrize("order", TrialSequence.ORDERS)
+@pytest.mark.parametrize("start", [0, 1, 4, 5, 11, 15])
+def test_resume_continues_the_same_order(order, start):
+    block = list(range(5))
+    full = list(TrialSequence(block, repetitions=3, order=order, seed=7))
+    resumed = list(TrialSequence(block, repetitions=3, order=order, seed=7, start=start))
+    assert resumed == full[start:]
+    assert [index for index, _, _ in full] == list(range(15))
+
+
+def test_invalid_parameters_are_rejected():
+    with pytest.raises(ValueError):
+        TrialSequence([1, 2], order="random")
+    with pytest.raises(ValueError):
+        TrialSequence([1, 2], repetitions=2, start=5)
+
+
+def test_play_trials_resumes_with_trial_ids_of_the_full_sequence():
+    triggered = []
+    block = [FakeTrial(name, triggered) for name in "abc"]
+    target = Recorder()
+    sequence = TrialSequence(block, repetitions=2, order="latin-square", seed=0, start=2)
+    assert play_trials(target, sequence)
+    assert [trial_id for trial_id, _ in triggered] == [3, 4, 5, 6]
+    repetitions = [args[0][1:] for event, args in target.messages
+        if event == "meta" and args[0][1] == "block-repetition"]
+    assert repetitions == [("block-repetition", 0), ("block-repetition", 1)]
+    progress = [args[0] for event, args in target.messages if event == "condition-update"]
+    assert progress == [f"Condition {index} of 6" for index in range(3, 7)]
+
+
+def test_play_trials_stops_when_no_longer_running():
+    triggered = []
+    block = [FakeTrial(name, triggered) for name in "abc"]
+    assert not play_trials(
+        Recorder(), TrialSequence(block), progress=lambda message: None,
+        is_running=lambda: len(triggered) < 2)
+    assert len(triggered) == 2